@@ -42,6 +42,12 @@ class ParamGroup:
         for arg in vars(args).items():
             if arg[0] in vars(self) or ("_" + arg[0]) in vars(self):
                 setattr(group, arg[0], arg[1])
+        # Options neither on the command line nor in the model's cfg_args (e.g. options added after
+        # the model was trained, with sentinel groups) keep their defaults
+        for key, value in vars(self).items():
+            key = key[1:] if key.startswith("_") else key
+            if not hasattr(group, key):
+                setattr(group, key, value)
         return group
 
 class ModelParams(ParamGroup): 
@@ -54,6 +60,14 @@ class ModelParams(ParamGroup):
         self._resolution = -1
         self._white_background = False
         self.data_device = "cuda"
+        self.lazy_load = False
+        self.image_cache_size = 32
+        self.prefetch_depth = 4
+        self.image_cache_dir = ""
+        self.load_workers = -1
+        self.json_backend = "auto"
+        self.save_format = "ply"
+        self.quant_chunk_size = 256
         self.eval = False
         super().__init__(parser, "Loading Parameters", sentinel)
 
@@ -66,6 +80,9 @@ class PipelineParams(ParamGroup):
     def __init__(self, parser):
         self.convert_SHs_python = False
         self.compute_cov3D_python = False
+        self.rasterizer = "cuda"
+        self.precull = False
+        self.precull_radius = 0.0
         self.debug = False
         super().__init__(parser, "Pipeline Parameters")
 
@@ -82,12 +99,17 @@ class OptimizationParams(ParamGroup):
         self.rotation_lr = 0.001
         self.percent_dense = 0.01
         self.lambda_dssim = 0.2
+        self.ssim_half = False
         self.densification_interval = 100
         self.opacity_reset_interval = 3000
         self.densify_from_iter = 500
         self.densify_until_iter = 15_000
         self.densify_grad_threshold = 0.00002
         self.random_background = False
+        self.resolution_schedule = ""
+        self.optimizer_type = "default"
+        self.growable_storage = False
+        self.compact_threshold = 0.1
         super().__init__(parser, "Optimization Parameters")
 
 def get_combined_args(parser : ArgumentParser):
@@ -0,0 +1,110 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import os
+import time
+import struct
+import tempfile
+import numpy as np
+from argparse import ArgumentParser
+from scene.colmap_loader import read_points3D_binary, read_extrinsics_binary, read_next_bytes
+
+def write_synthetic_points3D(path, num_points, max_track_length, seed=0, chunk_size=250_000):
+    """ Write a points3D.bin with random points and random track lengths in [2, max_track_length]. """
+    rng = np.random.default_rng(seed)
+    header = np.dtype([("id", "<u8"), ("xyz", "<f8", 3), ("rgb", "u1", 3), ("error", "<f8"), ("track_length", "<u8")])
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", num_points))
+        for start in range(0, num_points, chunk_size):
+            n = min(chunk_size, num_points - start)
+            records = np.zeros(n, dtype=header)
+            records["id"] = np.arange(start, start + n) + 1
+            records["xyz"] = rng.normal(size=(n, 3)) * 10
+            records["rgb"] = rng.integers(0, 256, size=(n, 3))
+            records["error"] = rng.random(n)
+            lengths = rng.integers(2, max_track_length + 1, size=n)
+            records["track_length"] = lengths
+
+            # Interleave fixed headers and variable length tracks in one byte buffer
+            sizes = header.itemsize + 8 * lengths
+            starts = np.cumsum(sizes) - sizes
+            chunk = np.empty(int(sizes.sum()), dtype=np.uint8)
+            chunk[(starts[:, None] + np.arange(header.itemsize)).reshape(-1)] = records.view(np.uint8)
+            tracks = rng.integers(0, 1000, size=(int(lengths.sum()), 2)).astype("<i4").view(np.uint8).reshape(-1, 8)
+            owner = np.repeat(np.arange(n), lengths)
+            track_starts = starts[owner] + header.itemsize + 8 * (np.arange(len(owner)) - np.repeat(np.cumsum(lengths) - lengths, lengths))
+            chunk[(track_starts[:, None] + np.arange(8)).reshape(-1)] = tracks.reshape(-1)
+            chunk.tofile(f)
+
+def write_synthetic_images(path, num_images, points_per_image, seed=0):
+    rng = np.random.default_rng(seed)
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", num_images))
+        for image_id in range(1, num_images + 1):
+            qvec = rng.normal(size=4)
+            f.write(struct.pack("<idddddddi", image_id, *(qvec / np.linalg.norm(qvec)), *rng.normal(size=3), 1))
+            f.write("image_{:06d}.jpg".format(image_id).encode("utf-8") + b"\x00")
+            f.write(struct.pack("<Q", points_per_image))
+            points2D = np.zeros(points_per_image, dtype=[("x", "<f8"), ("y", "<f8"), ("point3D_id", "<i8")])
+            points2D["x"], points2D["y"] = rng.random(points_per_image) * 1000, rng.random(points_per_image) * 1000
+            points2D["point3D_id"] = rng.integers(-1, 100000, size=points_per_image)
+            points2D.tofile(f)
+
+def read_points3D_binary_reference(path_to_model_file, max_points):
+    # Per-record struct decoding, as the loader did before it was vectorized
+    with open(path_to_model_file, "rb") as fid:
+        num_points = min(read_next_bytes(fid, 8, "Q")[0], max_points)
+        xyzs = np.empty((num_points, 3))
+        rgbs = np.empty((num_points, 3))
+        errors = np.empty((num_points, 1))
+        for p_id in range(num_points):
+            binary_point_line_properties = read_next_bytes(
+                fid, num_bytes=43, format_char_sequence="QdddBBBd")
+            xyzs[p_id] = np.array(binary_point_line_properties[1:4])
+            rgbs[p_id] = np.array(binary_point_line_properties[4:7])
+            errors[p_id] = np.array(binary_point_line_properties[7])
+            track_length = read_next_bytes(
+                fid, num_bytes=8, format_char_sequence="Q")[0]
+            read_next_bytes(
+                fid, num_bytes=8*track_length,
+                format_char_sequence="ii"*track_length)
+    return num_points
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="COLMAP binary reader benchmark")
+    parser.add_argument("--num_points", type=int, default=10_000_000)
+    parser.add_argument("--max_track_length", type=int, default=8)
+    parser.add_argument("--num_images", type=int, default=500)
+    parser.add_argument("--points_per_image", type=int, default=20_000)
+    parser.add_argument("--reference_points", type=int, default=200_000, help="points decoded by the per-record reader, its full time is extrapolated")
+    parser.add_argument("--workdir", type=str, default=None)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.workdir) as workdir:
+        points_path = os.path.join(workdir, "points3D.bin")
+        images_path = os.path.join(workdir, "images.bin")
+        _, elapsed = timed(write_synthetic_points3D, points_path, args.num_points, args.max_track_length)
+        print("Wrote {} points ({:.1f} MB) in {:.1f}s".format(args.num_points, os.path.getsize(points_path) / 2**20, elapsed))
+        write_synthetic_images(images_path, args.num_images, args.points_per_image)
+
+        (xyzs, _, _), elapsed = timed(read_points3D_binary, points_path)
+        print("read_points3D_binary:   {:8.2f}s  ({} points)".format(elapsed, xyzs.shape[0]))
+        if args.reference_points > 0:
+            decoded, elapsed = timed(read_points3D_binary_reference, points_path, args.reference_points)
+            print("per-record reference:   {:8.2f}s  (extrapolated from {} points)".format(elapsed * args.num_points / max(decoded, 1), decoded))
+
+        images, elapsed = timed(read_extrinsics_binary, images_path)
+        print("read_extrinsics_binary: {:8.2f}s  ({} images, {} points2D each)".format(elapsed, len(images), args.points_per_image))
@@ -11,9 +11,49 @@
 
 import torch
 import math
-from diff_gaussian_rasterization import GaussianRasterizationSettings, GaussianRasterizer
+try:
+    from diff_gaussian_rasterization import GaussianRasterizationSettings, GaussianRasterizer
+except ImportError:
+    # CUDA extension not built (e.g. on GPU-less machines), only --rasterizer cpu can be used
+    from gaussian_renderer.cpu_rasterizer import GaussianRasterizationSettings
+    GaussianRasterizer = None
+from gaussian_renderer import cpu_rasterizer
 from scene.gaussian_model import GaussianModel
+from scene.cameras import MiniCam
 from utils.sh_utils import eval_sh
+from utils.spatial_utils import frustum_visible
+
+def get_rasterizer(raster_settings, pipe):
+    """ Rasterizer backend selected by the --rasterizer pipeline flag, CUDA by default. """
+    if getattr(pipe, "rasterizer", None) == "cpu":
+        return cpu_rasterizer.GaussianRasterizer(raster_settings=raster_settings)
+    if GaussianRasterizer is None:
+        raise ImportError("diff_gaussian_rasterization is not available, use --rasterizer cpu")
+    return GaussianRasterizer(raster_settings=raster_settings)
+
+def precull(viewpoint_camera, pc : GaussianModel, pipe, rasterizer, scaling_modifier = 1.0, spherical = False):
+    """
+    Indices of the Gaussians that can be visible from the camera, found with the
+    model's spatial index, or None to send all of them to the rasterizer
+    (--precull not set).
+    """
+    if not getattr(pipe, "precull", False):
+        return None
+    index = pc.get_spatial_index()
+    radius = getattr(pipe, "precull_radius", 0.0)
+    if spherical:
+        return index.query_sphere(viewpoint_camera.camera_center, scaling_modifier, radius)
+    candidates = index.query_frustum(viewpoint_camera.world_view_transform, viewpoint_camera.full_proj_transform,
+                                     math.tan(viewpoint_camera.FoVx * 0.5), math.tan(viewpoint_camera.FoVy * 0.5),
+                                     int(viewpoint_camera.image_width), int(viewpoint_camera.image_height), scaling_modifier, radius)
+    # Per-center frustum test of the rasterizer, on the candidates only
+    return candidates[rasterizer.markVisible(pc.get_xyz[candidates].detach())]
+
+def scatter_radii(radii, subset, num_points):
+    """ Radii of a pre-culled render for all Gaussians, zero for the culled ones. """
+    if subset is None:
+        return radii
+    return torch.zeros((num_points), dtype=radii.dtype, device=radii.device).index_copy_(0, subset, radii)
 
 def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor, scaling_modifier = 1.0, override_color = None):
     """
@@ -23,7 +63,7 @@ def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor,
     """
  
     # Create zero tensor. We will use it to make pytorch return gradients of the 2D (screen-space) means
-    screenspace_points = torch.zeros_like(pc.get_xyz, dtype=pc.get_xyz.dtype, requires_grad=True, device="cuda") + 0
+    screenspace_points = torch.zeros_like(pc.get_xyz, dtype=pc.get_xyz.dtype, requires_grad=True, device=pc.get_xyz.device) + 0
     try:
         screenspace_points.retain_grad()
     except:
@@ -49,11 +89,16 @@ def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor,
         debug=pipe.debug
     )
 
-    rasterizer = GaussianRasterizer(raster_settings=raster_settings)
+    rasterizer = get_rasterizer(raster_settings, pipe)
 
-    means3D = pc.get_xyz
-    means2D = screenspace_points
-    opacity = pc.get_opacity
+    # Only the Gaussians that can be visible are rasterized, gradients flow back through the indexing
+    subset = precull(viewpoint_camera, pc, pipe, rasterizer, scaling_modifier, spherical=False)
+    def take(tensor):
+        return tensor if subset is None else tensor[subset]
+
+    means3D = take(pc.get_xyz)
+    means2D = take(screenspace_points)
+    opacity = take(pc.get_opacity)
 
     # If precomputed 3d covariance is provided, use it. If not, then it will be computed from
     # scaling / rotation by the rasterizer.
@@ -61,10 +106,10 @@ def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor,
     rotations = None
     cov3D_precomp = None
     if pipe.compute_cov3D_python:
-        cov3D_precomp = pc.get_covariance(scaling_modifier)
+        cov3D_precomp = take(pc.get_covariance(scaling_modifier))
     else:
-        scales = pc.get_scaling
-        rotations = pc.get_rotation
+        scales = take(pc.get_scaling)
+        rotations = take(pc.get_rotation)
 
     # If precomputed colors are provided, use them. Otherwise, if it is desired to precompute colors
     # from SHs in Python, do it. If not, then SH -> RGB conversion will be done by rasterizer.
@@ -72,18 +117,19 @@ def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor,
     colors_precomp = None
     if override_color is None:
         if pipe.convert_SHs_python:
-            shs_view = pc.get_features.transpose(1, 2).view(-1, 3, (pc.max_sh_degree+1)**2)
-            dir_pp = (pc.get_xyz - viewpoint_camera.camera_center.repeat(pc.get_features.shape[0], 1))
+            shs_view = take(pc.get_features).transpose(1, 2).view(-1, 3, (pc.max_sh_degree+1)**2)
+            dir_pp = (means3D - viewpoint_camera.camera_center.repeat(means3D.shape[0], 1))
             dir_pp_normalized = dir_pp/dir_pp.norm(dim=1, keepdim=True)
             sh2rgb = eval_sh(pc.active_sh_degree, shs_view, dir_pp_normalized)
             colors_precomp = torch.clamp_min(sh2rgb + 0.5, 0.0)
         else:
-            shs = pc.get_features
+            shs = take(pc.get_features)
     else:
-        colors_precomp = override_color
+        colors_precomp = take(override_color)
 
     # Rasterize visible Gaussians to image, obtain their radii (on screen). 
     rendered_image, radii = rasterizer(means3D = means3D, means2D = means2D, shs = shs, colors_precomp = colors_precomp, opacities = opacity, scales = scales, rotations = rotations, cov3D_precomp = cov3D_precomp)
+    radii = scatter_radii(radii, subset, pc.get_xyz.shape[0])
 
     # Those Gaussians that were frustum culled or had a radius of 0 were not visible.
     # They will be excluded from value updates used in the splitting criteria.
@@ -92,91 +138,136 @@ def render(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor,
             "visibility_filter" : radii > 0,
             "radii": radii}
 
-def render_panorama(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor, scaling_modifier = 1.0, override_color = None):
+def render_multiview(views, pc : GaussianModel, pipe, bg_color : torch.Tensor, scaling_modifier = 1.0, override_color = None, spherical = False):
     """
-    Render the scene. 
-    
-    Background tensor (bg_color) must be on GPU!
+    Render the scene from several views (Camera or MiniCam objects) at once.
+
+    The per-Gaussian work that does not depend on the view is done a single time
+    for all views and handed to the rasterizer precomputed: 3D covariances once
+    when there is more than one view, SH to RGB conversion once per distinct
+    camera center when views share one (all faces of a cube map do). The
+    rasterizer then only projects and rasterizes per view. The
+    compute_cov3D_python and convert_SHs_python flags only matter where nothing
+    is shared, there the rasterizer does the work like in render(). Screen-space
+    gradients of all views accumulate into the one returned viewspace_points
+    tensor.
     """
- 
+
     # Create zero tensor. We will use it to make pytorch return gradients of the 2D (screen-space) means
-    screenspace_points = torch.zeros_like(pc.get_xyz, dtype=pc.get_xyz.dtype, requires_grad=True, device="cuda") + 0
+    screenspace_points = torch.zeros_like(pc.get_xyz, dtype=pc.get_xyz.dtype, requires_grad=True, device=pc.get_xyz.device) + 0
     try:
         screenspace_points.retain_grad()
     except:
         pass
 
-    # Set up rasterization configuration
-    tanfovx = math.tan(viewpoint_camera.FoVx * 0.5)
-    tanfovy = math.tan(viewpoint_camera.FoVy * 0.5)
-
-    raster_settings = GaussianRasterizationSettings(
-        image_height=int(viewpoint_camera.image_height),
-        image_width=int(viewpoint_camera.image_width),
-        tanfovx=tanfovx,
-        tanfovy=tanfovy,
-        bg=bg_color,
-        scale_modifier=scaling_modifier,
-        viewmatrix=viewpoint_camera.world_view_transform,
-        projmatrix=viewpoint_camera.full_proj_transform,
-        sh_degree=pc.active_sh_degree,
-        campos=viewpoint_camera.camera_center,
-        prefiltered=False,
-        spherical=False,
-        debug=pipe.debug
-    )
-
-    rasterizer = GaussianRasterizer(raster_settings=raster_settings)
-
-    means3D = pc.get_xyz
-    means2D = screenspace_points
-    opacity = pc.get_opacity
+    # Views that share a camera center see the same SH colors
+    centers = []
+    center_index = []
+    for view in views:
+        for idx, center in enumerate(centers):
+            if torch.allclose(center, view.camera_center):
+                break
+        else:
+            idx = len(centers)
+            centers.append(view.camera_center)
+        center_index.append(idx)
 
-    # If precomputed 3d covariance is provided, use it. If not, then it will be computed from
-    # scaling / rotation by the rasterizer.
+    # Covariances computed once for all views, unless there is a single view (then as in render())
     scales = None
     rotations = None
     cov3D_precomp = None
-    if pipe.compute_cov3D_python:
+    if pipe.compute_cov3D_python or len(views) > 1:
         cov3D_precomp = pc.get_covariance(scaling_modifier)
     else:
         scales = pc.get_scaling
         rotations = pc.get_rotation
 
-    # If precomputed colors are provided, use them. Otherwise, if it is desired to precompute colors
-    # from SHs in Python, do it. If not, then SH -> RGB conversion will be done by rasterizer.
+    # Colors computed once per camera center, unless every view has its own center (then as in render())
     shs = None
-    colors_precomp = None
+    view_colors = [None] * len(views)
     if override_color is None:
-        if pipe.convert_SHs_python:
+        if pipe.convert_SHs_python or len(centers) < len(views):
             shs_view = pc.get_features.transpose(1, 2).view(-1, 3, (pc.max_sh_degree+1)**2)
-            dir_pp = (pc.get_xyz - viewpoint_camera.camera_center.repeat(pc.get_features.shape[0], 1))
-            dir_pp_normalized = dir_pp/dir_pp.norm(dim=1, keepdim=True)
-            sh2rgb = eval_sh(pc.active_sh_degree, shs_view, dir_pp_normalized)
-            colors_precomp = torch.clamp_min(sh2rgb + 0.5, 0.0)
+            dir_pp = pc.get_xyz[None] - torch.stack(centers)[:, None, :]
+            dir_pp_normalized = dir_pp/dir_pp.norm(dim=2, keepdim=True)
+            sh2rgb = eval_sh(pc.active_sh_degree, shs_view[None], dir_pp_normalized)
+            colors = torch.clamp_min(sh2rgb + 0.5, 0.0)
+            view_colors = [colors[idx] for idx in center_index]
         else:
             shs = pc.get_features
     else:
-        colors_precomp = override_color
+        view_colors = [override_color] * len(views)
 
-    # Rasterize visible Gaussians to image, obtain their radii (on screen). 
-    rendered_image, radii = rasterizer(means3D = means3D, means2D = means2D, shs = shs, colors_precomp = colors_precomp, opacities = opacity, scales = scales, rotations = rotations, cov3D_precomp = cov3D_precomp)
-    rasterizer.set_raster_viewproj(viewpoint_camera.world_view_transform_right, viewpoint_camera.full_proj_transform_right)
-    rendered_image_right, radii_right = rasterizer(means3D = means3D, means2D = means2D, shs = shs, colors_precomp = colors_precomp, opacities = opacity, scales = scales, rotations = rotations, cov3D_precomp = cov3D_precomp)
-    rasterizer.set_raster_viewproj(viewpoint_camera.world_view_transform_back, viewpoint_camera.full_proj_transform_back)
-    rendered_image_back, radii_back = rasterizer(means3D = means3D, means2D = means2D, shs = shs, colors_precomp = colors_precomp, opacities = opacity, scales = scales, rotations = rotations, cov3D_precomp = cov3D_precomp)
-    rasterizer.set_raster_viewproj(viewpoint_camera.world_view_transform_left, viewpoint_camera.full_proj_transform_left)
-    rendered_image_left, radii_left = rasterizer(means3D = means3D, means2D = means2D, shs = shs, colors_precomp = colors_precomp, opacities = opacity, scales = scales, rotations = rotations, cov3D_precomp = cov3D_precomp)
-    rendered_image = torch.cat([rendered_image_right, rendered_image, rendered_image_left, rendered_image_back], dim=2)
-    if viewpoint_camera.oritinal_image_width !=  rendered_image.shape[2]:
-        rendered_image = torch.nn.functional.interpolate(rendered_image.unsqueeze(0), size=(viewpoint_camera.image_height, viewpoint_camera.oritinal_image_width), mode='bilinear', align_corners=False)
+    # Without --precull, pinhole views are still culled before projection, on each Gaussian's
+    # center and extent; each face of a cube map then projects about a quarter of the model
+    extent = None
+    if not spherical and not getattr(pipe, "precull", False):
+        with torch.no_grad():
+            extent = 3 * pc.get_scaling.max(dim=1).values
+
+    means3D = pc.get_xyz
+    opacity = pc.get_opacity
+    renders = []
+    radii = []
+    for view, colors_precomp in zip(views, view_colors):
+        raster_settings = GaussianRasterizationSettings(
+            image_height=int(view.image_height),
+            image_width=int(view.image_width),
+            tanfovx=math.tan(view.FoVx * 0.5),
+            tanfovy=math.tan(view.FoVy * 0.5),
+            bg=bg_color,
+            scale_modifier=scaling_modifier,
+            viewmatrix=view.world_view_transform,
+            projmatrix=view.full_proj_transform,
+            sh_degree=pc.active_sh_degree,
+            campos=view.camera_center,
+            prefiltered=False,
+            spherical=spherical,
+            debug=pipe.debug
+        )
+        rasterizer = get_rasterizer(raster_settings, pipe)
+        subset = precull(view, pc, pipe, rasterizer, scaling_modifier, spherical)
+        if extent is not None:
+            subset = frustum_visible(means3D, extent, view, scaling_modifier).nonzero().squeeze(1)
+        def take(tensor):
+            return tensor if subset is None or tensor is None else tensor[subset]
+        rendered_image, view_radii = rasterizer(means3D = take(means3D), means2D = take(screenspace_points), shs = take(shs), colors_precomp = take(colors_precomp), opacities = take(opacity),
+                                                scales = take(scales), rotations = take(rotations), cov3D_precomp = take(cov3D_precomp))
+        renders.append(rendered_image)
+        radii.append(scatter_radii(view_radii, subset, pc.get_xyz.shape[0]))
+
+    radii = torch.stack(radii)
+    return {"renders": renders,
+            "viewspace_points": screenspace_points,
+            "visibility_filter" : (radii > 0).any(dim=0),
+            "radii": radii}
+
+def render_panorama(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torch.Tensor, scaling_modifier = 1.0, override_color = None):
+    """
+    Render an equirectangular camera as the four horizontal faces of a cube map,
+    placed side by side and resized to the camera resolution.
+    
+    Background tensor (bg_color) must be on GPU!
+    """
+    face_width = viewpoint_camera.image_width // 4
+    faces = []
+    for suffix in ("_right", "", "_left", "_back"):
+        faces.append(MiniCam(face_width, viewpoint_camera.image_height, viewpoint_camera.FoVy, viewpoint_camera.FoVx,
+                             viewpoint_camera.znear, viewpoint_camera.zfar,
+                             getattr(viewpoint_camera, "world_view_transform" + suffix),
+                             getattr(viewpoint_camera, "full_proj_transform" + suffix)))
+
+    render_pkg = render_multiview(faces, pc, pipe, bg_color, scaling_modifier, override_color)
+    rendered_image = torch.cat(render_pkg["renders"], dim=2)
+    if viewpoint_camera.image_width != rendered_image.shape[2]:
+        rendered_image = torch.nn.functional.interpolate(rendered_image.unsqueeze(0), size=(viewpoint_camera.image_height, viewpoint_camera.image_width), mode='bilinear', align_corners=False)
         rendered_image = rendered_image.squeeze(0)
-    radii = radii + radii_back + radii_left + radii_right
+    radii = render_pkg["radii"].sum(dim=0)
 
     # Those Gaussians that were frustum culled or had a radius of 0 were not visible.
     # They will be excluded from value updates used in the splitting criteria.
     return {"render": rendered_image,
-            "viewspace_points": screenspace_points,
+            "viewspace_points": render_pkg["viewspace_points"],
             "visibility_filter" : radii > 0,
             "radii": radii}
 
@@ -189,7 +280,7 @@ def render_spherical(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torc
     """
  
     # Create zero tensor. We will use it to make pytorch return gradients of the 2D (screen-space) means
-    screenspace_points = torch.zeros_like(pc.get_xyz, dtype=pc.get_xyz.dtype, requires_grad=True, device="cuda") + 0
+    screenspace_points = torch.zeros_like(pc.get_xyz, dtype=pc.get_xyz.dtype, requires_grad=True, device=pc.get_xyz.device) + 0
     try:
         screenspace_points.retain_grad()
     except:
@@ -215,11 +306,16 @@ def render_spherical(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torc
         debug=pipe.debug
     )
 
-    rasterizer = GaussianRasterizer(raster_settings=raster_settings)
+    rasterizer = get_rasterizer(raster_settings, pipe)
 
-    means3D = pc.get_xyz
-    means2D = screenspace_points
-    opacity = pc.get_opacity
+    # Only the Gaussians that can be visible are rasterized, gradients flow back through the indexing
+    subset = precull(viewpoint_camera, pc, pipe, rasterizer, scaling_modifier, spherical=True)
+    def take(tensor):
+        return tensor if subset is None else tensor[subset]
+
+    means3D = take(pc.get_xyz)
+    means2D = take(screenspace_points)
+    opacity = take(pc.get_opacity)
 
     # If precomputed 3d covariance is provided, use it. If not, then it will be computed from
     # scaling / rotation by the rasterizer.
@@ -227,10 +323,10 @@ def render_spherical(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torc
     rotations = None
     cov3D_precomp = None
     if pipe.compute_cov3D_python:
-        cov3D_precomp = pc.get_covariance(scaling_modifier)
+        cov3D_precomp = take(pc.get_covariance(scaling_modifier))
     else:
-        scales = pc.get_scaling
-        rotations = pc.get_rotation
+        scales = take(pc.get_scaling)
+        rotations = take(pc.get_rotation)
 
     # If precomputed colors are provided, use them. Otherwise, if it is desired to precompute colors
     # from SHs in Python, do it. If not, then SH -> RGB conversion will be done by rasterizer.
@@ -238,18 +334,19 @@ def render_spherical(viewpoint_camera, pc : GaussianModel, pipe, bg_color : torc
     colors_precomp = None
     if override_color is None:
         if pipe.convert_SHs_python:
-            shs_view = pc.get_features.transpose(1, 2).view(-1, 3, (pc.max_sh_degree+1)**2)
-            dir_pp = (pc.get_xyz - viewpoint_camera.camera_center.repeat(pc.get_features.shape[0], 1))
+            shs_view = take(pc.get_features).transpose(1, 2).view(-1, 3, (pc.max_sh_degree+1)**2)
+            dir_pp = (means3D - viewpoint_camera.camera_center.repeat(means3D.shape[0], 1))
             dir_pp_normalized = dir_pp/dir_pp.norm(dim=1, keepdim=True)
             sh2rgb = eval_sh(pc.active_sh_degree, shs_view, dir_pp_normalized)
             colors_precomp = torch.clamp_min(sh2rgb + 0.5, 0.0)
         else:
-            shs = pc.get_features
+            shs = take(pc.get_features)
     else:
-        colors_precomp = override_color
+        colors_precomp = take(override_color)
 
     # Rasterize visible Gaussians to image, obtain their radii (on screen). 
     rendered_image, radii = rasterizer(means3D = means3D, means2D = means2D, shs = shs, colors_precomp = colors_precomp, opacities = opacity, scales = scales, rotations = rotations, cov3D_precomp = cov3D_precomp)
+    radii = scatter_radii(radii, subset, pc.get_xyz.shape[0])
 
     # Those Gaussians that were frustum culled or had a radius of 0 were not visible.
     # They will be excluded from value updates used in the splitting criteria.
@@ -0,0 +1,246 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import math
+from typing import NamedTuple
+import torch
+import torch.nn as nn
+from utils.sh_utils import eval_sh
+
+# Same tiling as the CUDA rasterizer (cuda_rasterizer/config.h)
+BLOCK_X = 16
+BLOCK_Y = 16
+
+class GaussianRasterizationSettings(NamedTuple):
+    image_height: int
+    image_width: int
+    tanfovx : float
+    tanfovy : float
+    bg : torch.Tensor
+    scale_modifier : float
+    viewmatrix : torch.Tensor
+    projmatrix : torch.Tensor
+    sh_degree : int
+    campos : torch.Tensor
+    prefiltered : bool
+    spherical : bool
+    debug : bool
+
+class GaussianRasterizer(nn.Module):
+    """
+    Pure PyTorch reference implementation of the forward pass of
+    diff_gaussian_rasterization.GaussianRasterizer, for machines without CUDA.
+
+    Preprocessing follows cuda_rasterizer/forward.cu step by step (including
+    the spherical equirectangular projection); Gaussians are then binned into
+    16x16 pixel tiles, depth sorted, and every tile is alpha composited as a
+    single (pixels x Gaussians) tensor expression. Only the forward pass is
+    provided: means2D receives no gradient, so it cannot drive densification.
+    """
+
+    def __init__(self, raster_settings):
+        super().__init__()
+        self.raster_settings = raster_settings
+
+    def markVisible(self, positions):
+        with torch.no_grad():
+            p_view = positions @ self.raster_settings.viewmatrix[:3, :3] + self.raster_settings.viewmatrix[3, :3]
+            if self.raster_settings.spherical:
+                depth = p_view.norm(dim=1)
+                return (depth > 0.2) & (depth < 100.0)
+            return p_view[:, 2] > 0.2
+
+    def set_raster_viewproj(self, viewmatrix, projmatrix):
+        self.raster_settings = self.raster_settings._replace(viewmatrix=viewmatrix, projmatrix=projmatrix)
+
+    def forward(self, means3D, means2D, opacities, shs = None, colors_precomp = None, scales = None, rotations = None, cov3D_precomp = None):
+        raster_settings = self.raster_settings
+
+        if (shs is None and colors_precomp is None) or (shs is not None and colors_precomp is not None):
+            raise Exception('Please provide excatly one of either SHs or precomputed colors!')
+
+        if ((scales is None or rotations is None) and cov3D_precomp is None) or ((scales is not None or rotations is not None) and cov3D_precomp is not None):
+            raise Exception('Please provide exactly one of either scale/rotation pair or precomputed 3D covariance!')
+
+        device = means3D.device
+        viewmatrix = raster_settings.viewmatrix.to(device)
+        projmatrix = raster_settings.projmatrix.to(device)
+        campos = raster_settings.campos.to(device)
+        bg = raster_settings.bg.to(device)
+        H, W = raster_settings.image_height, raster_settings.image_width
+
+        if cov3D_precomp is None:
+            cov3D = computeCov3D(scales, raster_settings.scale_modifier, rotations)
+        else:
+            cov3D = unpackCov3D(cov3D_precomp)
+
+        if raster_settings.spherical:
+            xy, depths, cov2D, valid = preprocessSpherical(means3D, cov3D, viewmatrix, W, H, raster_settings.tanfovx, raster_settings.tanfovy)
+        else:
+            xy, depths, cov2D, valid = preprocess(means3D, cov3D, viewmatrix, projmatrix, W, H, raster_settings.tanfovx, raster_settings.tanfovy)
+
+        # Invert covariance (EWA algorithm) and bound the footprint by 3 standard deviations
+        a, b, c = cov2D[:, 0, 0], cov2D[:, 0, 1], cov2D[:, 1, 1]
+        det = a * c - b * b
+        valid = valid & (det != 0)
+        det_inv = 1.0 / torch.where(det == 0, torch.ones_like(det), det)
+        conic = torch.stack((c * det_inv, -b * det_inv, a * det_inv), dim=1)
+        mid = 0.5 * (a + c)
+        lambda1 = mid + torch.sqrt(torch.clamp_min(mid * mid - det, 0.1))
+        radius = torch.ceil(3.0 * torch.sqrt(lambda1))
+
+        grid_x = (W + BLOCK_X - 1) // BLOCK_X
+        grid_y = (H + BLOCK_Y - 1) // BLOCK_Y
+        rect_min, rect_max = getRect(xy.detach(), radius.detach(), grid_x, grid_y)
+        tiles_touched = (rect_max[:, 0] - rect_min[:, 0]) * (rect_max[:, 1] - rect_min[:, 1])
+        valid = valid & (tiles_touched > 0)
+        radii = torch.where(valid, radius, torch.zeros_like(radius)).int()
+
+        if colors_precomp is None:
+            dirs = means3D - campos
+            dirs = dirs / dirs.norm(dim=1, keepdim=True)
+            colors = torch.clamp_min(eval_sh(raster_settings.sh_degree, shs.transpose(1, 2), dirs) + 0.5, 0.0)
+        else:
+            colors = colors_precomp
+
+        # Duplicate every visible Gaussian once per touched tile, depth sorted within tiles
+        ids = torch.nonzero(valid).squeeze(1)
+        ids = ids[torch.argsort(depths.detach()[ids], stable=True)]
+        counts = tiles_touched[ids]
+        owner = torch.repeat_interleave(torch.arange(ids.shape[0], device=device), counts)
+        offset = torch.arange(owner.shape[0], device=device) - torch.repeat_interleave(torch.cumsum(counts, 0) - counts, counts)
+        rect_w = (rect_max[:, 0] - rect_min[:, 0])[ids][owner]
+        tile_x = rect_min[ids, 0][owner] + offset % rect_w
+        tile_y = rect_min[ids, 1][owner] + offset // rect_w
+        tiles = tile_y * grid_x + tile_x
+        order = torch.argsort(tiles, stable=True)
+        point_list = ids[owner[order]]
+        ranges = torch.searchsorted(tiles[order], torch.arange(grid_x * grid_y + 1, device=device)).tolist()
+
+        image = bg[:, None].expand(3, H * W).clone()
+        for tile in range(grid_x * grid_y):
+            start, end = ranges[tile], ranges[tile + 1]
+            if start == end:
+                continue
+            x0, y0 = (tile % grid_x) * BLOCK_X, (tile // grid_x) * BLOCK_Y
+            pix_y, pix_x = torch.meshgrid(torch.arange(y0, min(y0 + BLOCK_Y, H), device=device),
+                                          torch.arange(x0, min(x0 + BLOCK_X, W), device=device), indexing="ij")
+            pix_y, pix_x = pix_y.reshape(-1), pix_x.reshape(-1)
+            color = renderTile(torch.stack((pix_x, pix_y), dim=1).to(xy.dtype), point_list[start:end], xy, conic, opacities, colors, bg)
+            image[:, pix_y * W + pix_x] = color.T
+
+        return image.reshape(3, H, W), radii
+
+def computeCov3D(scales, scale_modifier, rotations):
+    # Rotations are used as given, like the CUDA kernel (get_rotation is already normalized)
+    r, x, y, z = rotations.unbind(1)
+    R = torch.stack((
+        1 - 2 * (y*y + z*z), 2 * (x*y - r*z), 2 * (x*z + r*y),
+        2 * (x*y + r*z), 1 - 2 * (x*x + z*z), 2 * (y*z - r*x),
+        2 * (x*z - r*y), 2 * (y*z + r*x), 1 - 2 * (x*x + y*y)), dim=1).reshape(-1, 3, 3)
+    L = R * (scale_modifier * scales)[:, None, :]
+    return L @ L.transpose(1, 2)
+
+def unpackCov3D(cov3D_precomp):
+    c = cov3D_precomp
+    return torch.stack((c[:, 0], c[:, 1], c[:, 2],
+                        c[:, 1], c[:, 3], c[:, 4],
+                        c[:, 2], c[:, 4], c[:, 5]), dim=1).reshape(-1, 3, 3)
+
+def ndc2Pix(v, S):
+    return ((v + 1.0) * S - 1.0) * 0.5
+
+def projectCov2D(J, cov3D, viewmatrix):
+    # cov2D = J W Sigma W^T J^T, with W the rotation of the view transform
+    T = J @ viewmatrix[:3, :3].T
+    cov = T @ cov3D @ T.transpose(1, 2)
+    # Low-pass filter: every Gaussian should be at least one pixel wide/high
+    return cov[:, :2, :2] + 0.3 * torch.eye(2, device=cov.device, dtype=cov.dtype)
+
+def preprocess(means3D, cov3D, viewmatrix, projmatrix, W, H, tanfovx, tanfovy):
+    p_view = means3D @ viewmatrix[:3, :3] + viewmatrix[3, :3]
+    p_hom = means3D @ projmatrix[:3, :] + projmatrix[3, :]
+    p_proj = p_hom[:, :3] / (p_hom[:, 3:4] + 0.0000001)
+    valid = p_view[:, 2] > 0.2
+
+    focal_x = W / (2.0 * tanfovx)
+    focal_y = H / (2.0 * tanfovy)
+    limx = 1.3 * tanfovx
+    limy = 1.3 * tanfovy
+    tz = p_view[:, 2]
+    tx = torch.clamp(p_view[:, 0] / tz, -limx, limx) * tz
+    ty = torch.clamp(p_view[:, 1] / tz, -limy, limy) * tz
+    zeros = torch.zeros_like(tz)
+    J = torch.stack((
+        focal_x / tz, zeros, -(focal_x * tx) / (tz * tz),
+        zeros, focal_y / tz, -(focal_y * ty) / (tz * tz),
+        zeros, zeros, zeros), dim=1).reshape(-1, 3, 3)
+
+    xy = torch.stack((ndc2Pix(p_proj[:, 0], W), ndc2Pix(p_proj[:, 1], H)), dim=1)
+    return xy, p_view[:, 2], projectCov2D(J, cov3D, viewmatrix), valid
+
+def preprocessSpherical(means3D, cov3D, viewmatrix, W, H, tanfovx, tanfovy):
+    t = means3D @ viewmatrix[:3, :3] + viewmatrix[3, :3]
+    tx, ty, tz = t.unbind(1)
+    depth = t.norm(dim=1)
+    valid = (depth > 0.2) & (depth < 100.0)
+    longitude = torch.atan2(tx, tz) / math.pi
+    rho2 = tx * tx + tz * tz
+    rho = torch.sqrt(rho2)
+    latitude = torch.atan2(ty, rho) / (math.pi / 2.0)
+
+    # Focal lengths as set up by CudaRasterizer::Rasterizer::forwardspherical
+    w = W / (2.0 * tanfovx) / 4 * 8
+    h = H / (2.0 * tanfovy) / 2 * 8
+    r2 = depth * depth
+    zeros = torch.zeros_like(tz)
+    J = torch.stack((
+        w / (2 * math.pi) * tz / rho2, zeros, -w / (2 * math.pi) * tx / rho2,
+        -h / math.pi * (tx * ty) / (r2 * rho), h / math.pi * rho / r2, -h / math.pi * (tz * ty) / (r2 * rho),
+        zeros, zeros, zeros), dim=1).reshape(-1, 3, 3)
+
+    xy = torch.stack((ndc2Pix(longitude, W), ndc2Pix(latitude, H)), dim=1)
+    return xy, depth, projectCov2D(J, cov3D, viewmatrix), valid
+
+def getRect(xy, radius, grid_x, grid_y):
+    # Integer casts truncate toward zero, as in auxiliary.h
+    r = radius[:, None]
+    block = torch.tensor([BLOCK_X, BLOCK_Y], device=xy.device, dtype=xy.dtype)
+    grid = torch.tensor([grid_x, grid_y], device=xy.device)
+    rect_min = torch.minimum(torch.clamp_min(torch.trunc((xy - r) / block).long(), 0), grid)
+    rect_max = torch.minimum(torch.clamp_min(torch.trunc((xy + r + block - 1) / block).long(), 0), grid)
+    return rect_min, rect_max
+
+def renderTile(pixels, point_list, xy, conic, opacities, colors, bg, batch_size=256):
+    """ Front-to-back alpha compositing of the depth sorted Gaussians in point_list over a set of pixels. """
+    T = torch.ones(pixels.shape[0], device=pixels.device, dtype=xy.dtype)
+    done = torch.zeros(pixels.shape[0], device=pixels.device, dtype=torch.bool)
+    C = torch.zeros((pixels.shape[0], colors.shape[1]), device=pixels.device, dtype=colors.dtype)
+    for start in range(0, point_list.shape[0], batch_size):
+        ids = point_list[start:start + batch_size]
+        d = xy[ids][None, :, :] - pixels[:, None, :]
+        con = conic[ids]
+        power = -0.5 * (con[:, 0] * d[..., 0] * d[..., 0] + con[:, 2] * d[..., 1] * d[..., 1]) - con[:, 1] * d[..., 0] * d[..., 1]
+        alpha = torch.clamp_max(opacities[ids, 0] * torch.exp(power), 0.99)
+        alpha = torch.where((power > 0) | (alpha < 1.0 / 255.0), torch.zeros_like(alpha), alpha)
+
+        # A pixel stops at the first Gaussian that would bring its transmittance below 1e-4
+        test_T = T[:, None] * torch.cumprod(1 - alpha, dim=1)
+        stop = (test_T < 0.0001) & (alpha > 0)
+        used = ~done[:, None] & (torch.cumsum(stop.int(), dim=1) == 0)
+        alpha = alpha * used
+        transmittance = T[:, None] * torch.cumprod(torch.cat((torch.ones_like(alpha[:, :1]), 1 - alpha[:, :-1]), dim=1), dim=1)
+        C = C + (alpha * transmittance) @ colors[ids]
+        T = transmittance[:, -1] * (1 - alpha[:, -1])
+        done = done | stop.any(dim=1)
+        if bool(done.all()):
+            break
+    return C + T[:, None] * bg[None, :]
@@ -3,84 +3,189 @@
 # GRAPHDECO research group, https://team.inria.fr/graphdeco
 # All rights reserved.
 #
-# This software is free for non-commercial, research and evaluation use 
+# This software is free for non-commercial, research and evaluation use
 # under the terms of the LICENSE.md file.
 #
 # For inquiries contact  george.drettakis@inria.fr
 #
 
+import contextlib
+import copy
+import time
 import torch
 import traceback
 import socket
 import json
+import threading
 from scene.cameras import MiniCam
 
 host = "127.0.0.1"
 port = 6009
 
-conn = None
-addr = None
+server = None
 
-listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+class ViewerServer:
+    """
+    Serves the network viewer from a background thread.
 
-def init(wish_host, wish_port):
-    global host, port, listener
+    The thread accepts one viewer at a time, reads its requests, renders them
+    and sends the images back, at most `max_fps` frames per second. Renders
+    use a read-only snapshot of the Gaussians: when the thread needs a newer
+    one it raises a flag, and the training loop copies the Gaussians the next
+    time it calls serve(). Training therefore only pays for that copy, at most
+    once per frame, and only waits when the viewer pauses it.
+    """
+
+    def __init__(self, listener, max_fps=30):
+        self.listener = listener
+        self.frame_interval = 1.0 / max_fps if max_fps > 0 else 0.0
+        self.device = torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
+        self.stream = torch.cuda.Stream() if torch.cuda.is_available() else None
+
+        self.lock = threading.Condition()
+        self.connected = False
+        self.do_training = True
+        self.keep_alive = False
+        self.snapshot_requested = False
+        self.snapshot = None        # (gaussians, pipe, background, verify, ready event)
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def serve(self, gaussians, pipe, background, verify, last_iteration=False):
+        """
+        Called by the training loop once per iteration: hands over a snapshot
+        when the viewer asked for one, and blocks while the viewer pauses
+        training (or keeps the last iteration alive).
+        """
+        while True:
+            with self.lock:
+                if self.snapshot_requested:
+                    event = None
+                    if torch.cuda.is_available():
+                        event = torch.cuda.Event()
+                    self.snapshot = (gaussians.snapshot(), copy.copy(pipe), background.clone(), verify, event)
+                    if event is not None:
+                        event.record()
+                    self.snapshot_requested = False
+                    self.lock.notify_all()
+                paused = self.connected and (not self.do_training or (last_iteration and self.keep_alive))
+                if not paused:
+                    return
+                self.lock.wait(timeout=max(self.frame_interval, 0.01))
+
+    def _request_snapshot(self):
+        # Wait for the training loop to hand over a fresh snapshot; keep the previous one if it does not
+        # come within a second (e.g. training has finished), so the viewer still gets frames
+        with self.lock:
+            self.snapshot_requested = True
+            self.lock.notify_all()
+            self.lock.wait_for(lambda: not self.snapshot_requested, timeout=1.0)
+            if self.snapshot is None:
+                self.lock.wait_for(lambda: self.snapshot is not None)
+            return self.snapshot
+
+    def _run(self):
+        while True:
+            try:
+                conn, addr = self.listener.accept()
+            except OSError:
+                return
+            print(f"\nConnected by {addr}")
+            with self.lock:
+                self.connected = True
+            try:
+                self._serve_connection(conn)
+            except (ConnectionError, OSError, ValueError):
+                pass
+            except Exception:
+                print("")
+                traceback.print_exc()
+            finally:
+                conn.close()
+                with self.lock:
+                    self.connected = False
+                    self.do_training = True
+                    self.keep_alive = False
+                    self.snapshot = None
+                    self.lock.notify_all()
+
+    def _serve_connection(self, conn):
+        last_frame = 0.0
+        while True:
+            message = read(conn)
+            width = message["resolution_x"]
+            height = message["resolution_y"]
+            with self.lock:
+                if width != 0 and height != 0:
+                    self.do_training = bool(message["train"])
+                    self.keep_alive = bool(message["keep_alive"])
+                self.lock.notify_all()
+
+            image_bytes = None
+            if width != 0 and height != 0:
+                delay = last_frame + self.frame_interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                last_frame = time.perf_counter()
+                gaussians, pipe, background, verify, event = self._request_snapshot()
+                image_bytes = self._render(message, gaussians, pipe, background, event)
+            else:
+                verify = self.snapshot[3] if self.snapshot is not None else ""
+            send(conn, image_bytes, verify)
+
+    def _render(self, message, gaussians, pipe, background, event):
+        from gaussian_renderer import render
+        pipe = copy.copy(pipe)
+        pipe.convert_SHs_python = bool(message["shs_python"])
+        pipe.compute_cov3D_python = bool(message["rot_scale_python"])
+        with torch.no_grad(), torch.cuda.stream(self.stream) if self.stream is not None else contextlib.nullcontext():
+            if event is not None:
+                self.stream.wait_event(event)
+            world_view_transform = torch.reshape(torch.tensor(message["view_matrix"]), (4, 4)).to(self.device)
+            world_view_transform[:,1] = -world_view_transform[:,1]
+            world_view_transform[:,2] = -world_view_transform[:,2]
+            full_proj_transform = torch.reshape(torch.tensor(message["view_projection_matrix"]), (4, 4)).to(self.device)
+            full_proj_transform[:,1] = -full_proj_transform[:,1]
+            custom_cam = MiniCam(message["resolution_x"], message["resolution_y"], message["fov_y"], message["fov_x"],
+                                 message["z_near"], message["z_far"], world_view_transform, full_proj_transform)
+            net_image = render(custom_cam, gaussians, pipe, background, message["scaling_modifier"])["render"]
+            # The copy to host memory waits for the render, the snapshot can be released afterwards
+            return memoryview((torch.clamp(net_image, min=0, max=1.0) * 255).byte().permute(1, 2, 0).contiguous().cpu().numpy())
+
+def init(wish_host, wish_port, max_fps=30):
+    global host, port, server
     host = wish_host
     port = wish_port
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     listener.bind((host, port))
     listener.listen()
-    listener.settimeout(0)
-
-def try_connect():
-    global conn, addr, listener
-    try:
-        conn, addr = listener.accept()
-        print(f"\nConnected by {addr}")
-        conn.settimeout(None)
-    except Exception as inst:
-        pass
-            
-def read():
-    global conn
-    messageLength = conn.recv(4)
-    messageLength = int.from_bytes(messageLength, 'little')
-    message = conn.recv(messageLength)
+    server = ViewerServer(listener, max_fps)
+
+def serve(gaussians, pipe, background, verify, last_iteration=False):
+    """ See ViewerServer.serve, does nothing when init() was not called. """
+    if server is not None:
+        server.serve(gaussians, pipe, background, verify, last_iteration)
+
+def recv_exact(conn, length):
+    # recv may return fewer bytes than asked for, read until the whole message has arrived
+    buffer = bytearray(length)
+    view = memoryview(buffer)
+    received = 0
+    while received < length:
+        count = conn.recv_into(view[received:], length - received)
+        if count == 0:
+            raise ConnectionError("viewer disconnected")
+        received += count
+    return bytes(buffer)
+
+def read(conn):
+    messageLength = int.from_bytes(recv_exact(conn, 4), 'little')
+    message = recv_exact(conn, messageLength)
     return json.loads(message.decode("utf-8"))
 
-def send(message_bytes, verify):
-    global conn
+def send(conn, message_bytes, verify):
     if message_bytes != None:
         conn.sendall(message_bytes)
     conn.sendall(len(verify).to_bytes(4, 'little'))
     conn.sendall(bytes(verify, 'ascii'))
-
-def receive():
-    message = read()
-
-    width = message["resolution_x"]
-    height = message["resolution_y"]
-
-    if width != 0 and height != 0:
-        try:
-            do_training = bool(message["train"])
-            fovy = message["fov_y"]
-            fovx = message["fov_x"]
-            znear = message["z_near"]
-            zfar = message["z_far"]
-            do_shs_python = bool(message["shs_python"])
-            do_rot_scale_python = bool(message["rot_scale_python"])
-            keep_alive = bool(message["keep_alive"])
-            scaling_modifier = message["scaling_modifier"]
-            world_view_transform = torch.reshape(torch.tensor(message["view_matrix"]), (4, 4)).cuda()
-            world_view_transform[:,1] = -world_view_transform[:,1]
-            world_view_transform[:,2] = -world_view_transform[:,2]
-            full_proj_transform = torch.reshape(torch.tensor(message["view_projection_matrix"]), (4, 4)).cuda()
-            full_proj_transform[:,1] = -full_proj_transform[:,1]
-            custom_cam = MiniCam(width, height, fovy, fovx, znear, zfar, world_view_transform, full_proj_transform)
-        except Exception as e:
-            print("")
-            traceback.print_exc()
-            raise e
-        return custom_cam, do_training, do_shs_python, do_rot_scale_python, keep_alive, scaling_modifier
-    else:
-        return None, None, None, None, None, None
\ No newline at end of file
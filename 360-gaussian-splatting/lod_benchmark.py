@@ -0,0 +1,80 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import time
+import torch
+from scene import Scene
+from gaussian_renderer import render, render_spherical, GaussianModel
+from utils.general_utils import safe_state, get_device
+from utils.lod_utils import GaussianHierarchy
+from quantize_benchmark import mean_psnr
+from argparse import ArgumentParser
+from arguments import ModelParams, PipelineParams, get_combined_args
+
+def timed_renders(views, gaussians, hierarchy, threshold, pipeline, background, panorama):
+    """ Renders of each view's cut, mean milliseconds per view (cut included) and mean number of Gaussians rendered. """
+    renderFunc = render_spherical if panorama else render
+    renders, counts = [], []
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for view in views:
+        view_gaussians = hierarchy.cut(view, threshold, spherical=panorama) if threshold > 0 else gaussians
+        renders.append(torch.clamp(renderFunc(view, view_gaussians, pipeline, background)["render"], 0.0, 1.0))
+        counts.append(view_gaussians.get_xyz.shape[0])
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return renders, (time.perf_counter() - start) / len(views) * 1000, sum(counts) / len(counts)
+
+def benchmark(dataset : ModelParams, iteration : int, pipeline : PipelineParams, thresholds, panorama : bool):
+    with torch.no_grad():
+        gaussians = GaussianModel(dataset.sh_degree)
+        scene = Scene(dataset, gaussians, load_iteration=iteration, shuffle=False, panorama=panorama)
+        views = scene.getTestCameras() or scene.getTrainCameras()
+
+        device = get_device()
+        bg_color = [1,1,1] if dataset.white_background else [0, 0, 0]
+        background = torch.tensor(bg_color, dtype=torch.float32, device=device)
+
+        start = time.perf_counter()
+        hierarchy = GaussianHierarchy(gaussians)
+        build_ms = (time.perf_counter() - start) * 1000
+        print("hierarchy: {} leaves, {} nodes, {} levels, built in {:.0f} ms".format(
+            hierarchy.num_leaves, hierarchy.num_nodes, hierarchy.num_levels, build_ms))
+
+        # Warm up, then the full model is the reference for every threshold
+        timed_renders(views[:1], gaussians, hierarchy, 0, pipeline, background, panorama)
+        references, full_ms, _ = timed_renders(views, gaussians, hierarchy, 0, pipeline, background, panorama)
+        gts = [torch.clamp(view.original_image[0:3, :, :].to(device), 0.0, 1.0) for view in views]
+
+        print("{:>10} {:>14} {:>10} {:>10} {:>12} {:>10}".format("threshold", "Gaussians", "ms/view", "speedup", "PSNR vs full", "PSNR"))
+        for threshold in thresholds:
+            renders, ms, count = timed_renders(views, gaussians, hierarchy, threshold, pipeline, background, panorama)
+            vs_full = mean_psnr(renders, references) if threshold > 0 else float("inf")
+            print("{:>10.2f} {:>14.0f} {:>10.1f} {:>10.2f} {:>12.2f} {:>10.4f}".format(
+                threshold, count, ms, full_ms / ms, vs_full, mean_psnr(renders, gts)))
+
+if __name__ == "__main__":
+    # Set up command line argument parser
+    parser = ArgumentParser(description="Level-of-detail benchmark parameters")
+    model = ModelParams(parser, sentinel=True)
+    pipeline = PipelineParams(parser)
+    parser.add_argument("--iteration", default=-1, type=int)
+    parser.add_argument("--thresholds", nargs="+", type=float, default=[0, 1, 2, 4, 8, 16])
+    parser.add_argument("--panorama", action="store_true")
+    parser.add_argument("--quiet", action="store_true")
+    args = get_combined_args(parser)
+    print("Benchmarking " + args.model_path)
+
+    # Initialize system state (RNG)
+    safe_state(args.quiet)
+
+    benchmark(model.extract(args), args.iteration, pipeline.extract(args), args.thresholds, args.panorama)
@@ -2,6 +2,9 @@ import torch
 
 from .modules.lpips import LPIPS
 
+# Networks are built (and their weights loaded) once per type and device
+_criteria = {}
+
 
 def lpips(x: torch.Tensor,
           y: torch.Tensor,
@@ -17,5 +20,7 @@ def lpips(x: torch.Tensor,
         version (str): the version of LPIPS. Default: 0.1.
     """
     device = x.device
-    criterion = LPIPS(net_type, version).to(device)
-    return criterion(x, y)
+    key = (net_type, version, device)
+    if key not in _criteria:
+        _criteria[key] = LPIPS(net_type, version).to(device).eval()
+    return _criteria[key](x, y)
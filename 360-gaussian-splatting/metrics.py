@@ -12,8 +12,10 @@
 from pathlib import Path
 import os
 from PIL import Image
+import numpy as np
 import torch
 import torchvision.transforms.functional as tf
+from torch.utils.data import Dataset, DataLoader
 from utils.loss_utils import ssim
 from lpipsPyTorch import lpips
 import json
@@ -21,19 +23,49 @@ from tqdm import tqdm
 from utils.image_utils import psnr
 from argparse import ArgumentParser
 
-def readImages(renders_dir, gt_dir):
-    renders = []
-    gts = []
-    image_names = []
-    for fname in os.listdir(renders_dir):
-        render = Image.open(renders_dir / fname)
-        gt = Image.open(gt_dir / fname)
-        renders.append(tf.to_tensor(render).unsqueeze(0)[:, :3, :, :].cuda())
-        gts.append(tf.to_tensor(gt).unsqueeze(0)[:, :3, :, :].cuda())
-        image_names.append(fname)
-    return renders, gts, image_names
-
-def evaluate(model_paths):
+def readImage(path):
+    """ (C, H, W) float image in [0, 1] from any of the ImageWriter formats. """
+    if path.suffix == ".npy":
+        image = torch.from_numpy(np.load(path)).permute(2, 0, 1)
+    elif path.suffix == ".exr":
+        # OpenCV only enables its EXR codec when this is set before the import
+        os.environ.setdefault("OPENCV_IO_ENABLE_OPENEXR", "1")
+        import cv2
+        image = torch.from_numpy(cv2.imread(str(path), cv2.IMREAD_UNCHANGED)[..., ::-1].copy()).permute(2, 0, 1)
+    else:
+        return tf.to_tensor(Image.open(path))
+    # Float renders are not clamped when written, png and jpg are by their quantization
+    return image.float().clamp(0, 1)
+
+class ImagePairs(Dataset):
+    """ Render / ground truth pairs of a method directory, decoded in DataLoader workers. """
+
+    def __init__(self, renders_dir, gt_dir):
+        self.renders_dir = renders_dir
+        self.gt_dir = gt_dir
+        self.image_names = os.listdir(renders_dir)
+
+    def __len__(self):
+        return len(self.image_names)
+
+    def __getitem__(self, idx):
+        fname = self.image_names[idx]
+        render = readImage(self.renders_dir / fname)[:3, :, :]
+        gt = readImage(self.gt_dir / fname)[:3, :, :]
+        return render, gt, fname
+
+def readBatches(renders_dir, gt_dir, batch_size, num_workers):
+    # Images are only stacked with neighbours of the same size, so mixed resolutions still work
+    loader = DataLoader(ImagePairs(renders_dir, gt_dir), batch_size=batch_size, num_workers=num_workers, collate_fn=list)
+    for pairs in loader:
+        start = 0
+        for end in range(1, len(pairs) + 1):
+            if end == len(pairs) or pairs[end][0].shape != pairs[start][0].shape:
+                renders, gts, image_names = zip(*pairs[start:end])
+                yield torch.stack(renders), torch.stack(gts), list(image_names)
+                start = end
+
+def evaluate(model_paths, device, batch_size=8, num_workers=4):
 
     full_dict = {}
     per_view_dict = {}
@@ -62,16 +94,20 @@ def evaluate(model_paths):
                 method_dir = test_dir / method
                 gt_dir = method_dir/ "gt"
                 renders_dir = method_dir / "renders"
-                renders, gts, image_names = readImages(renders_dir, gt_dir)
 
                 ssims = []
                 psnrs = []
                 lpipss = []
+                image_names = []
 
-                for idx in tqdm(range(len(renders)), desc="Metric evaluation progress"):
-                    ssims.append(ssim(renders[idx], gts[idx]))
-                    psnrs.append(psnr(renders[idx], gts[idx]))
-                    lpipss.append(lpips(renders[idx], gts[idx], net_type='vgg'))
+                with torch.no_grad(), tqdm(total=len(os.listdir(renders_dir)), desc="Metric evaluation progress") as progress:
+                    for renders, gts, names in readBatches(renders_dir, gt_dir, batch_size, num_workers):
+                        renders, gts = renders.to(device), gts.to(device)
+                        ssims.extend(ssim(renders, gts, size_average=False).tolist())
+                        psnrs.extend(psnr(renders, gts).flatten().tolist())
+                        lpipss.extend(lpips(renders, gts, net_type='vgg').flatten().tolist())
+                        image_names.extend(names)
+                        progress.update(len(names))
 
                 print("  SSIM : {:>12.7f}".format(torch.tensor(ssims).mean(), ".5"))
                 print("  PSNR : {:>12.7f}".format(torch.tensor(psnrs).mean(), ".5"))
@@ -93,11 +129,15 @@ def evaluate(model_paths):
             print("Unable to compute metrics for model", scene_dir)
 
 if __name__ == "__main__":
-    device = torch.device("cuda:0")
-    torch.cuda.set_device(device)
-
     # Set up command line argument parser
     parser = ArgumentParser(description="Training script parameters")
     parser.add_argument('--model_paths', '-m', required=True, nargs="+", type=str, default=[])
+    parser.add_argument('--device', type=str, default="cuda:0" if torch.cuda.is_available() else "cpu")
+    parser.add_argument('--batch_size', type=int, default=8)
+    parser.add_argument('--num_workers', type=int, default=4)
     args = parser.parse_args()
-    evaluate(args.model_paths)
+
+    device = torch.device(args.device)
+    if device.type == "cuda":
+        torch.cuda.set_device(device)
+    evaluate(args.model_paths, device, args.batch_size, args.num_workers)
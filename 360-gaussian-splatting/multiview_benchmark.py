@@ -0,0 +1,87 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import math
+import time
+import numpy as np
+import torch
+from argparse import ArgumentParser
+from arguments import PipelineParams
+from scene.cameras import MiniCam
+from gaussian_renderer import render, render_multiview
+from utils.general_utils import get_device
+from utils.graphics_utils import getWorld2View2, getProjectionMatrix
+from precull_benchmark import random_scene
+
+def cube_faces(width, height, extent, device):
+    """ The four horizontal faces of a cube map around one random camera center. """
+    R = np.linalg.qr(np.random.randn(3, 3))[0]
+    R[:, 0] *= np.sign(np.linalg.det(R))
+    center = np.random.uniform(-0.5, 0.5, 3) * extent
+    projection = getProjectionMatrix(znear=0.01, zfar=100.0, fovX=math.pi / 2, fovY=math.pi / 2).transpose(0, 1).to(device)
+    faces = []
+    for k in range(4):
+        angle = k * math.pi / 2
+        R_y = np.array([[math.cos(angle), 0, math.sin(angle)], [0, 1, 0], [-math.sin(angle), 0, math.cos(angle)]])
+        R_k = R @ R_y
+        world_view_transform = torch.tensor(getWorld2View2(R_k, -R_k.T @ center), dtype=torch.float32).transpose(0, 1).to(device)
+        faces.append(MiniCam(width, height, math.pi / 2, math.pi / 2, 0.01, 100.0, world_view_transform, world_view_transform @ projection))
+    return faces
+
+def timed(fn, repeats):
+    fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeats * 1000, result
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Cube map multi-view rendering benchmark")
+    pp = PipelineParams(parser)
+    parser.add_argument("--num_points", type=int, default=1_000_000)
+    parser.add_argument("--sh_degree", type=int, default=3)
+    parser.add_argument("--extent", type=float, default=20.0)
+    parser.add_argument("--face_size", type=int, default=512)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+    pipe = pp.extract(args)
+
+    device = get_device()
+    np.random.seed(0)
+    torch.manual_seed(0)
+    gaussians = random_scene(args.num_points, args.sh_degree, args.extent, device)
+    faces = cube_faces(args.face_size, args.face_size, args.extent, device)
+    background = torch.zeros((3), device=device)
+
+    # Forward and backward where the rasterizer has one, like a training step
+    backward = getattr(pipe, "rasterizer", None) != "cpu"
+    def step(images):
+        if backward:
+            sum(image.sum() for image in images).backward()
+        return [image.detach() for image in images]
+
+    with torch.set_grad_enabled(backward):
+        single_ms, _ = timed(lambda: step([render(faces[0], gaussians, pipe, background)["render"]]), args.repeats)
+        separate_ms, references = timed(lambda: step([render(face, gaussians, pipe, background)["render"] for face in faces]), args.repeats)
+        shared_ms, renders = timed(lambda: step(render_multiview(faces, gaussians, pipe, background)["renders"]), args.repeats)
+    max_diff = max((a - b).abs().max().item() for a, b in zip(references, renders))
+
+    print("{} Gaussians (SH degree {}) on {}, {} rasterizer, {}x{} faces, {}".format(
+        args.num_points, args.sh_degree, device, getattr(pipe, "rasterizer", "cuda"), args.face_size, args.face_size,
+        "forward + backward" if backward else "forward only"))
+    print("single view:             {:8.1f} ms".format(single_ms))
+    print("cube, four render():     {:8.1f} ms ({:.2f}x single view)".format(separate_ms, separate_ms / single_ms))
+    print("cube, render_multiview:  {:8.1f} ms ({:.2f}x single view)".format(shared_ms, shared_ms / single_ms))
+    print("max image difference: {:.2e}".format(max_diff))
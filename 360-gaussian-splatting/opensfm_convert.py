@@ -1,12 +1,22 @@
 import os
 import cv2 
-import perspective_and_equirectangular.lib.Equirec2Perspec as E2P
-import perspective_and_equirectangular.lib.Perspec2Equirec as P2E
-import perspective_and_equirectangular.lib.multi_Perspec2Equirec as m_P2E
+import sys
 import glob
 import argparse
-
-def panorama2cube4(input_dir):
+from concurrent.futures import ThreadPoolExecutor
+from utils.cubemap_utils import equirect_to_perspective
+from utils.system_utils import resolveWorkers
+
+def convert_frames(image_paths, convert, workers):
+    # Frames are read, projected and written inside the tasks, so at most `workers` frames are in memory
+    with ThreadPoolExecutor(max_workers=resolveWorkers(workers)) as executor:
+        for index, _ in enumerate(executor.map(convert, image_paths)):
+            sys.stdout.write('\r')
+            sys.stdout.write("Converting image {}/{}".format(index + 1, len(image_paths)))
+            sys.stdout.flush()
+    sys.stdout.write('\n')
+
+def panorama2cube4(input_dir, workers=-1):
     base_dir = os.path.basename(input_dir.rstrip('/\\'))
     if not base_dir:
         base_dir = 'images'
@@ -17,30 +27,16 @@ def panorama2cube4(input_dir):
     height, width = cv2.imread(all_image[0]).shape[:2]
     cube_size = int(width / 4)
 
+    def convert(image_path):
+        equ = cv2.imread(image_path, cv2.IMREAD_COLOR)    # Load equirectangular image
+        name = os.path.splitext(os.path.basename(image_path))[0]
+        for face, theta in (('front', 0), ('right', 90), ('back', 180), ('left', 270)):
+            img = equirect_to_perspective(equ, 90, theta, 0, cube_size, cube_size)  # Specify parameters(FOV, theta, phi, height, width)
+            cv2.imwrite(output_dir + name + face + '.jpg', img)
 
-    for index in range(len(all_image)):
-        equ = E2P.Equirectangular(all_image[index])    # Load equirectangular image
-
-        img = equ.GetPerspective(90, 0, 0, cube_size, cube_size)  # Specify parameters(FOV, theta, phi, height, width)
-        output1 = output_dir + os.path.splitext(os.path.basename(all_image[index]))[0] + 'front.jpg'
-        cv2.imwrite(output1, img)
-
-        img = equ.GetPerspective(90, 90, 0, cube_size, cube_size)  # Specify parameters(FOV, theta, phi, height, width)
-        output2 = output_dir + os.path.splitext(os.path.basename(all_image[index]))[0] + 'right.jpg'
-
-        cv2.imwrite(output2, img)
-
-        img = equ.GetPerspective(90, 180, 0, cube_size, cube_size)  # Specify parameters(FOV, theta, phi, height, width)
-        output3 = output_dir + os.path.splitext(os.path.basename(all_image[index]))[0] + 'back.jpg'
+    convert_frames(all_image, convert, workers)
 
-        cv2.imwrite(output3, img)
-
-        img = equ.GetPerspective(90, 270, 0, cube_size, cube_size)  # Specify parameters(FOV, theta, phi, height, width)
-        output4 = output_dir + os.path.splitext(os.path.basename(all_image[index]))[0] + 'left.jpg'
-
-        cv2.imwrite(output4, img)
-
-def panorama2cube(input_dir):
+def panorama2cube(input_dir, workers=-1):
     base_dir = os.path.basename(input_dir.rstrip('/\\'))
     if not base_dir:
         base_dir = 'images'
@@ -49,29 +45,32 @@ def panorama2cube(input_dir):
     height, width = cv2.imread(all_image[0]).shape[:2]
     cube_size = int(width / 4)
 
-    for index in range(len(all_image)):
-        equ = E2P.Equirectangular(all_image[index])    # Load equirectangular image
+    def convert(image_path):
+        equ = cv2.imread(image_path, cv2.IMREAD_COLOR)    # Load equirectangular image
 
-        out_img = input_dir + '/' + os.path.basename(all_image[index])
-        img_0 = equ.GetPerspective(90, 0, 0, cube_size, cube_size)  # Specify parameters(FOV, theta, phi, height, width)
-        img_right = equ.GetPerspective(90, 90, 0, cube_size, cube_size)  # Specify parameters(FOV, theta, phi, height, width)
-        img_left = equ.GetPerspective(90, -90, 0, cube_size, cube_size)  # Specify parameters(FOV, theta, phi, height, width)
-        img_back = equ.GetPerspective(90, 180, 0, cube_size, cube_size)  # Specify parameters(FOV, theta, phi, height, width)
+        out_img = input_dir + '/' + os.path.basename(image_path)
+        img_0 = equirect_to_perspective(equ, 90, 0, 0, cube_size, cube_size)  # Specify parameters(FOV, theta, phi, height, width)
+        img_right = equirect_to_perspective(equ, 90, 90, 0, cube_size, cube_size)
+        img_left = equirect_to_perspective(equ, 90, -90, 0, cube_size, cube_size)
+        img_back = equirect_to_perspective(equ, 90, 180, 0, cube_size, cube_size)
 
         img = cv2.hconcat([img_left, img_0, img_right, img_back])
         cv2.imwrite(out_img, img)
 
+    convert_frames(all_image, convert, workers)
+
 def main():
     parser = argparse.ArgumentParser(description="Convert equirectangular panorama to cube map.")
     parser.add_argument("input_dir", type=str, help="Input directory containing equirectangular images.")
     parser.add_argument("--split", action='store_true', help="Split the panorama into 4 images (front, right, back, left)")
+    parser.add_argument("--workers", type=int, default=-1, help="Number of frames converted in parallel, one per CPU core by default.")
 
     args = parser.parse_args()
 
     if args.split:
-        panorama2cube4(args.input_dir)
+        panorama2cube4(args.input_dir, args.workers)
     else:
-        panorama2cube(args.input_dir)
+        panorama2cube(args.input_dir, args.workers)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
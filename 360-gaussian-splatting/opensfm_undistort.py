@@ -2,82 +2,120 @@ import os
 import cv2 
 import json
 import glob
+import sys
 import numpy as np
 import argparse
+import threading
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+from utils.system_utils import resolveWorkers
 
-def undistort(data_dir):
+def camera_model(params):
+    f = params.get('focal', 0) * params.get('width', 0)
+    cx = params.get('width', 0) / 2
+    cy = params.get('height', 0) / 2
+    k1 = params.get('k1', 0)
+    k2 = params.get('k2', 0)
+
+    camera_matrix = np.array([[f, 0, cx],
+                            [0, f, cy],
+                            [0, 0, 1]])
+    dist_coeffs = np.array([k1, k2, 0, 0, 0])  # k3, p1, p2は0と仮定
+    return camera_matrix, dist_coeffs
+
+def undistort(data_dir, workers=-1):
     with open(data_dir + '/reconstruction_distorted.json', 'r') as file:
         json_data = json.load(file)
-    for i in range(len(json_data)):
-        new_cameras = {}
-        cam_data = json_data[i]['cameras']
-        for camera_name, params in cam_data.items():
-            camera_info = {
-                'name': camera_name,
-                'projection_type': params.get('projection_type', ''),
-                'width': params.get('width', 0),
-                'height': params.get('height', 0),
-                'focal': params.get('focal', 0),
-                'k1': params.get('k1', 0),
-                'k2': params.get('k2', 0)
-            }
-            f = camera_info["focal"] * camera_info["width"]
-            cx = camera_info["width"] / 2
-            cy = camera_info["height"] / 2
-            k1 = camera_info["k1"]
-            k2 = camera_info["k2"]
 
-            camera_matrix = np.array([[f, 0, cx],
-                                    [0, f, cy],
-                                    [0, 0, 1]])
-            dist_coeffs = np.array([k1, k2, 0, 0, 0])  # k3, p1, p2は0と仮定
+    # Each image is undistorted with the camera of its shot; without shots, a single camera is used for all
+    cameras = {}
+    image_cameras = {}
+    for reconstruction in json_data:
+        cameras.update(reconstruction['cameras'])
+        for shot_name, shot in reconstruction.get('shots', {}).items():
+            image_cameras[shot_name] = shot['camera']
+    default_camera = next(iter(cameras)) if len(cameras) == 1 else None
+
+    output_dir = data_dir + '/images_split/'
+    if not os.path.exists(output_dir):
+        os.mkdir(output_dir)
+
+    # One rectify map per camera and image size, built by the first image that needs it
+    rectifiers = {}
+    rectifiers_lock = threading.Lock()
+    def get_rectifier(camera_name, size):
+        key = (camera_name, size)
+        with rectifiers_lock:
+            if key not in rectifiers:
+                camera_matrix, dist_coeffs = camera_model(cameras[camera_name])
+                new_camera_matrix, roi = cv2.getOptimalNewCameraMatrix(camera_matrix, dist_coeffs, size, 1, size)
+                maps = cv2.initUndistortRectifyMap(camera_matrix, dist_coeffs, None, new_camera_matrix, size, cv2.CV_16SC2)
+                rectifiers[key] = (maps, new_camera_matrix, roi)
+            return rectifiers[key]
 
-            distorted_image_path_list = sorted(glob.glob(data_dir + '/images_distorted/*.*'))
-            output_dir = data_dir + '/images_split/'
-            if not os.path.exists(output_dir):
-                os.mkdir(output_dir)
-            for distorted_image_path in distorted_image_path_list:
-                try:
-                    image = cv2.imread(distorted_image_path)
+    def process(distorted_image_path):
+        try:
+            camera_name = image_cameras.get(os.path.basename(distorted_image_path), default_camera)
+            if camera_name is None:
+                raise KeyError(f"no camera for image: {distorted_image_path}")
+            if not os.path.exists(distorted_image_path):
+                raise FileNotFoundError(f"image not found: {distorted_image_path}")
+            with Image.open(distorted_image_path) as image:
+                size = image.size
+            maps, _, roi = get_rectifier(camera_name, size)
 
-                    if image is None:
-                        raise FileNotFoundError(f"image not found: {distorted_image_path}")
+            image_path = output_dir + os.path.basename(distorted_image_path)
+            if os.path.exists(image_path) and os.path.getmtime(image_path) >= os.path.getmtime(distorted_image_path):
+                return
+            image = cv2.imread(distorted_image_path)
+            if image is None:
+                raise FileNotFoundError(f"image not found: {distorted_image_path}")
 
-                    # undistort
-                    h, w = image.shape[:2]
-                    new_camera_matrix, roi = cv2.getOptimalNewCameraMatrix(camera_matrix, dist_coeffs, (w, h), 1, (w, h))
-                    undistorted_img = cv2.undistort(image, camera_matrix, dist_coeffs, None, new_camera_matrix)
-                    x, y, w, h = roi
+            # undistort
+            undistorted_img = cv2.remap(image, maps[0], maps[1], cv2.INTER_LINEAR)
+            x, y, w, h = roi
+            cv2.imwrite(image_path, undistorted_img[y:y+h, x:x+w])
+        except (FileNotFoundError, KeyError) as e:
+            print(e)
+        except Exception as e:
+            print(f"error:  {e}")
 
-                    image_path = output_dir + os.path.basename(distorted_image_path)
-                    cv2.imwrite(image_path, undistorted_img[y:y+h, x:x+w])
-                except FileNotFoundError as e:
-                    print(e)
-                except Exception as e:
-                    print(f"error:  {e}")
-            new_cam_info = camera_info
-            new_cam_info['focal'] = new_camera_matrix[0][0]
-            new_cam_info['k1'] = 0
-            new_cam_info['k2'] = 0
-            new_cam_info['width'] = w
-            new_cam_info['height'] = h
-            new_cameras[camera_name] = new_cam_info
-            temp_json = {}
-            for camera_name, camera_info in json_data[0]['cameras'].items():
-                temp_json[camera_name] = new_cameras[camera_name]
-            json_data[0]['cameras'] = temp_json
-            with open(data_dir + '/reconstruction.json', 'w') as outfile:
-                json.dump(json_data, outfile, indent=4)
+    distorted_image_path_list = sorted(glob.glob(data_dir + '/images_distorted/*.*'))
+    with ThreadPoolExecutor(max_workers=resolveWorkers(workers)) as executor:
+        for index, _ in enumerate(executor.map(process, distorted_image_path_list)):
+            sys.stdout.write('\r')
+            sys.stdout.write("Undistorting image {}/{}".format(index + 1, len(distorted_image_path_list)))
+            sys.stdout.flush()
+    sys.stdout.write('\n')
 
-                
+    # Cameras with undistorted images get the new intrinsics, the reconstruction is written once
+    new_cameras = {}
+    for (camera_name, _), (_, new_camera_matrix, roi) in rectifiers.items():
+        params = cameras[camera_name]
+        new_cameras[camera_name] = {
+            'name': camera_name,
+            'projection_type': params.get('projection_type', ''),
+            'width': roi[2],
+            'height': roi[3],
+            'focal': new_camera_matrix[0][0],
+            'k1': 0,
+            'k2': 0
+        }
+    for reconstruction in json_data:
+        for camera_name in reconstruction['cameras']:
+            if camera_name in new_cameras:
+                reconstruction['cameras'][camera_name] = new_cameras[camera_name]
+    with open(data_dir + '/reconstruction.json', 'w') as outfile:
+        json.dump(json_data, outfile, indent=4)
 
 def main():
     parser = argparse.ArgumentParser(description="Convert equirectangular panorama to cube map.")
     parser.add_argument("data_dir", type=str, help="Input data directory.")
+    parser.add_argument("--workers", type=int, default=-1, help="Number of images undistorted in parallel, one per CPU core by default.")
 
     args = parser.parse_args()
 
-    undistort(args.data_dir)
+    undistort(args.data_dir, args.workers)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
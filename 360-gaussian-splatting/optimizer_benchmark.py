@@ -0,0 +1,140 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import time
+import torch
+from torch import nn
+from argparse import ArgumentParser
+from arguments import OptimizationParams
+from scene import GaussianModel
+from utils.general_utils import get_device
+
+def random_model(num_points, sh_degree, device):
+    gaussians = GaussianModel(sh_degree)
+    gaussians._xyz = nn.Parameter(torch.randn((num_points, 3), device=device))
+    gaussians._features_dc = nn.Parameter(torch.randn((num_points, 1, 3), device=device))
+    gaussians._features_rest = nn.Parameter(torch.randn((num_points, (sh_degree + 1) ** 2 - 1, 3), device=device))
+    gaussians._opacity = nn.Parameter(torch.randn((num_points, 1), device=device))
+    gaussians._scaling = nn.Parameter(torch.randn((num_points, 3), device=device) - 4)
+    gaussians._rotation = nn.Parameter(torch.randn((num_points, 4), device=device))
+    gaussians.max_radii2D = torch.zeros((num_points), device=device)
+    gaussians.spatial_lr_scale = 1.0
+    return gaussians
+
+def fake_backward(gaussians, grads):
+    # What autograd does: hand over a fresh gradient, or add into the existing one
+    params = (gaussians._xyz, gaussians._features_dc, gaussians._features_rest, gaussians._opacity, gaussians._scaling, gaussians._rotation)
+    for param, grad in zip(params, grads):
+        # Gradients are drawn with headroom, the number of slots changes with densification
+        grad = grad[:param.shape[0]]
+        if param.grad is None:
+            param.grad = grad.clone()
+        else:
+            param.grad += grad
+
+def timed(fn, repeats):
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeats * 1000
+
+def benchmark(opt, optimizer_type, growable, num_points, sh_degree, visible_fraction, repeats):
+    device = get_device()
+    opt.optimizer_type = optimizer_type
+    opt.growable_storage = growable
+    gaussians = random_model(num_points, sh_degree, device)
+    gaussians.training_setup(opt)
+    visibility = torch.rand((2 * num_points), device=device) < visible_fraction
+    grads = [torch.randn((2 * num_points, *param.shape[1:]), device=device) for param in (gaussians._xyz, gaussians._features_dc, gaussians._features_rest,
+                                                                                            gaussians._opacity, gaussians._scaling, gaussians._rotation)]
+
+    def step():
+        fake_backward(gaussians, grads)
+        gaussians.update_learning_rate(1000)
+        gaussians.optimizer.step(visibility[:gaussians.get_xyz.shape[0]]) if optimizer_type == "sparse" else gaussians.optimizer.step()
+        gaussians.optimizer.zero_grad(set_to_none=True)
+    step()
+    step_ms = timed(step, repeats)
+
+    def densify():
+        # Clone 5% of the Gaussians, then prune as many, so the model size stays put
+        selected = torch.rand((gaussians.get_xyz.shape[0]), device=device) < 0.05
+        gaussians.densification_postfix(gaussians._xyz[selected], gaussians._features_dc[selected], gaussians._features_rest[selected],
+                                        gaussians._opacity[selected], gaussians._scaling[selected], gaussians._rotation[selected])
+        alive = gaussians.alive_mask()
+        candidates = torch.arange(gaussians.get_xyz.shape[0], device=device) if alive is None else alive.nonzero().squeeze(1)
+        prune = torch.zeros((gaussians.get_xyz.shape[0]), dtype=torch.bool, device=device)
+        prune[candidates[torch.randperm(candidates.shape[0], device=device)[:int(selected.sum())]]] = True
+        gaussians.prune_points(prune)
+        step()
+    if torch.cuda.is_available():
+        torch.cuda.reset_peak_memory_stats()
+    densify_ms = timed(densify, repeats)
+    peak_mb = torch.cuda.max_memory_allocated() / 2 ** 20 if torch.cuda.is_available() else float("nan")
+
+    def reset():
+        gaussians.reset_opacity()
+    reset_ms = timed(reset, repeats)
+    return step_ms, densify_ms, reset_ms, peak_mb
+
+def check_densification(opt, optimizer_type, growable, num_points, sh_degree, rounds=5):
+    """ Live Gaussian counts after each of several densify_and_prune rounds, with consistency checks. """
+    device = get_device()
+    opt.optimizer_type = optimizer_type
+    opt.growable_storage = growable
+    torch.manual_seed(0)
+    gaussians = random_model(num_points, sh_degree, device)
+    gaussians.training_setup(opt)
+    counts = []
+    for _ in range(rounds):
+        # Statistics derived from the Gaussians' own values, so that every storage layout selects the same ones
+        gaussians.xyz_gradient_accum = gaussians.get_opacity.detach() * 0.001
+        gaussians.denom = torch.ones_like(gaussians.xyz_gradient_accum)
+        gaussians.densify_and_prune(0.0009, 0.1, 1.0, 20)
+        rows = gaussians.get_xyz.shape[0]
+        assert all(tensor.shape[0] == rows for tensor in (gaussians._features_dc, gaussians._features_rest, gaussians._opacity, gaussians._scaling,
+                                                          gaussians._rotation, gaussians.xyz_gradient_accum, gaussians.denom, gaussians.max_radii2D))
+        counts.append(gaussians.num_points)
+    return counts
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Gaussian optimizer benchmark")
+    op = OptimizationParams(parser)
+    parser.add_argument("--num_points", type=int, default=5_000_000)
+    parser.add_argument("--sh_degree", type=int, default=3)
+    parser.add_argument("--visible_fraction", type=float, default=0.3)
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--optimizers", nargs="+", default=["default", "fused", "sparse"])
+    parser.add_argument("--check_points", type=int, default=20_000)
+    args = parser.parse_args()
+    opt = op.extract(args)
+
+    # Every optimizer and storage must densify and prune to the same number of Gaussians
+    reference = check_densification(opt, "default", False, args.check_points, args.sh_degree)
+    for optimizer_type in args.optimizers:
+        for growable in ([False] if optimizer_type == "default" else [False, True]):
+            counts = check_densification(opt, optimizer_type, growable, args.check_points, args.sh_degree)
+            assert counts == reference, "{}{}: {} Gaussians after each densification, expected {}".format(
+                optimizer_type, " growable" if growable else "", counts, reference)
+    print("densification check passed: {} Gaussians after each round".format(reference))
+
+    print("{} Gaussians on {}, {:.0%} visible for the sparse step".format(args.num_points, get_device(), args.visible_fraction))
+    print("{:<16} {:>10} {:>14} {:>12} {:>16}".format("optimizer", "step (ms)", "densify (ms)", "reset (ms)", "peak CUDA (MB)"))
+    for optimizer_type in args.optimizers:
+        # The growable storage belongs to GaussianAdam, so it is only benchmarked with it
+        for growable in ([False] if optimizer_type == "default" else [False, True]):
+            step_ms, densify_ms, reset_ms, peak_mb = benchmark(opt, optimizer_type, growable, args.num_points, args.sh_degree, args.visible_fraction, args.repeats)
+            name = optimizer_type + (" growable" if growable else "")
+            print("{:<16} {:>10.1f} {:>14.1f} {:>12.1f} {:>16.0f}".format(name, step_ms, densify_ms, reset_ms, peak_mb))
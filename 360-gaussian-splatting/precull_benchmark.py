@@ -0,0 +1,101 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import math
+import time
+import numpy as np
+import torch
+from torch import nn
+from argparse import ArgumentParser
+from arguments import PipelineParams
+from scene import GaussianModel
+from scene.cameras import MiniCam
+from gaussian_renderer import render, render_spherical
+from utils.general_utils import get_device
+from utils.graphics_utils import getWorld2View2, getProjectionMatrix
+
+def random_scene(num_points, sh_degree, extent, device):
+    """ Gaussians spread over a (2 * extent)^3 box, like a large capture seen from inside. """
+    gaussians = GaussianModel(sh_degree)
+    gaussians.active_sh_degree = sh_degree
+    gaussians._xyz = nn.Parameter((torch.rand((num_points, 3), device=device) * 2 - 1) * extent)
+    gaussians._features_dc = nn.Parameter(torch.randn((num_points, 1, 3), device=device))
+    gaussians._features_rest = nn.Parameter(torch.randn((num_points, (sh_degree + 1) ** 2 - 1, 3), device=device) * 0.1)
+    gaussians._opacity = nn.Parameter(torch.randn((num_points, 1), device=device))
+    gaussians._scaling = nn.Parameter(torch.randn((num_points, 3), device=device) * 0.5 + math.log(extent / 200))
+    gaussians._rotation = nn.Parameter(torch.randn((num_points, 4), device=device))
+    return gaussians
+
+def random_camera(width, height, fovx, extent, device):
+    R = np.linalg.qr(np.random.randn(3, 3))[0]
+    R[:, 0] *= np.sign(np.linalg.det(R))
+    T = np.random.uniform(-0.5, 0.5, 3) * extent
+    world_view_transform = torch.tensor(getWorld2View2(R, T), dtype=torch.float32).transpose(0, 1).to(device)
+    fovy = 2 * math.atan(math.tan(fovx / 2) * height / width)
+    projection = getProjectionMatrix(znear=0.01, zfar=100.0, fovX=fovx, fovY=fovy).transpose(0, 1).to(device)
+    return MiniCam(width, height, fovy, fovx, 0.01, 100.0, world_view_transform, world_view_transform @ projection)
+
+def timed_renders(views, gaussians, pipe, background, spherical):
+    renderFunc = render_spherical if spherical else render
+    images = []
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for view in views:
+        images.append(renderFunc(view, gaussians, pipe, background)["render"])
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / len(views) * 1000, images
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Spatial index pre-culling benchmark")
+    pp = PipelineParams(parser)
+    parser.add_argument("--num_points", type=int, default=2_000_000)
+    parser.add_argument("--sh_degree", type=int, default=3)
+    parser.add_argument("--extent", type=float, default=20.0)
+    parser.add_argument("--views", type=int, default=20)
+    parser.add_argument("--width", type=int, default=800)
+    parser.add_argument("--height", type=int, default=600)
+    parser.add_argument("--fov", type=float, default=70.0, help="horizontal field of view in degrees")
+    parser.add_argument("--panorama", action="store_true")
+    args = parser.parse_args()
+    pipe = pp.extract(args)
+
+    device = get_device()
+    np.random.seed(0)
+    torch.manual_seed(0)
+    with torch.no_grad():
+        gaussians = random_scene(args.num_points, args.sh_degree, args.extent, device)
+        views = [random_camera(args.width, args.height, math.radians(args.fov), args.extent, device) for _ in range(args.views)]
+        background = torch.zeros((3), device=device)
+
+        pipe.precull = False
+        full_ms, references = timed_renders(views, gaussians, pipe, background, args.panorama)
+
+        pipe.precull = True
+        start = time.perf_counter()
+        index = gaussians.get_spatial_index()
+        build_ms = (time.perf_counter() - start) * 1000
+        culled_ms, renders = timed_renders(views, gaussians, pipe, background, args.panorama)
+        if args.panorama:
+            candidates = [index.query_sphere(view.camera_center, radius=pipe.precull_radius).shape[0] for view in views]
+        else:
+            candidates = [index.query_frustum(view.world_view_transform, view.full_proj_transform,
+                                              math.tan(view.FoVx * 0.5), math.tan(view.FoVy * 0.5),
+                                              view.image_width, view.image_height, radius=pipe.precull_radius).shape[0] for view in views]
+        max_diff = max((a - b).abs().max().item() for a, b in zip(references, renders))
+
+    print("{} Gaussians on {}, {} {}x{} views".format(args.num_points, device, args.views, args.width, args.height))
+    print("index build: {:.1f} ms, {} cells".format(build_ms, index.num_cells))
+    print("candidates per view: {:.1%}".format(np.mean(candidates) / args.num_points))
+    print("render without pre-culling: {:.1f} ms/view".format(full_ms))
+    print("render with pre-culling:    {:.1f} ms/view".format(culled_ms))
+    print("max image difference: {:.2e}".format(max_diff))
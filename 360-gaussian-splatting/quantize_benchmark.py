@@ -0,0 +1,87 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import os
+import tempfile
+import torch
+from scene import Scene
+from gaussian_renderer import render, render_spherical, GaussianModel
+from utils.general_utils import safe_state, get_device
+from utils.image_utils import psnr
+from utils.quantize_utils import QUANTIZED_FORMATS
+from argparse import ArgumentParser
+from arguments import ModelParams, PipelineParams, get_combined_args
+
+def render_views(views, gaussians, pipeline, background, panorama):
+    renderFunc = render_spherical if panorama else render
+    return [torch.clamp(renderFunc(view, gaussians, pipeline, background)["render"], 0.0, 1.0) for view in views]
+
+def mean_psnr(renders, references):
+    return torch.stack([psnr(image, reference).mean() for image, reference in zip(renders, references)]).mean().item()
+
+def benchmark(dataset : ModelParams, iteration : int, pipeline : PipelineParams, formats, chunk_sizes, panorama : bool):
+    with torch.no_grad(), tempfile.TemporaryDirectory() as tmp_dir:
+        # Start from the float PLY when there is one, whatever format the model was trained with
+        dataset.save_format = "ply"
+        gaussians = GaussianModel(dataset.sh_degree)
+        scene = Scene(dataset, gaussians, load_iteration=iteration, shuffle=False, panorama=panorama)
+        views = scene.getTestCameras() or scene.getTrainCameras()
+
+        device = get_device()
+        bg_color = [1,1,1] if dataset.white_background else [0, 0, 0]
+        background = torch.tensor(bg_color, dtype=torch.float32, device=device)
+
+        ply_path = os.path.join(dataset.model_path, "point_cloud", "iteration_" + str(scene.loaded_iter), "point_cloud.ply")
+        reference_name = "ply"
+        if not os.path.exists(ply_path):
+            # Saved as .npz only: the reference is the decoded model, with the size it would have as a float PLY
+            ply_path = os.path.join(tmp_dir, "point_cloud.ply")
+            gaussians.save_ply(ply_path)
+            reference_name = "ply (of npz)"
+        ply_size = os.path.getsize(ply_path)
+        references = render_views(views, gaussians, pipeline, background, panorama)
+        gts = [torch.clamp(view.original_image[0:3, :, :].to(device), 0.0, 1.0) for view in views]
+        ply_psnr = mean_psnr(references, gts)
+
+        print("{:<14} {:>12} {:>8} {:>10} {:>10}".format("format", "size (MB)", "ratio", "PSNR", "delta"))
+        print("{:<14} {:>12.2f} {:>8.2f} {:>10.4f} {:>10.4f}".format(reference_name, ply_size / 2**20, 1.0, ply_psnr, 0.0))
+
+        for fmt in formats:
+            for chunk_size in chunk_sizes:
+                path = os.path.join(tmp_dir, "{}_{}.npz".format(fmt, chunk_size))
+                gaussians.save_quantized(path, fmt, chunk_size)
+                size = os.path.getsize(path)
+
+                decoded = GaussianModel(dataset.sh_degree)
+                decoded.load_quantized(path)
+                renders = render_views(views, decoded, pipeline, background, panorama)
+                quantized_psnr = mean_psnr(renders, gts)
+                print("{:<14} {:>12.2f} {:>8.2f} {:>10.4f} {:>10.4f}  (vs float render: {:.2f} dB)".format(
+                    "{}/{}".format(fmt, chunk_size), size / 2**20, ply_size / size, quantized_psnr,
+                    quantized_psnr - ply_psnr, mean_psnr(renders, references)))
+
+if __name__ == "__main__":
+    # Set up command line argument parser
+    parser = ArgumentParser(description="Quantized export benchmark parameters")
+    model = ModelParams(parser, sentinel=True)
+    pipeline = PipelineParams(parser)
+    parser.add_argument("--iteration", default=-1, type=int)
+    parser.add_argument("--formats", nargs="+", default=list(QUANTIZED_FORMATS), choices=QUANTIZED_FORMATS)
+    parser.add_argument("--chunk_sizes", nargs="+", type=int, default=[0, 256])
+    parser.add_argument("--panorama", action="store_true")
+    parser.add_argument("--quiet", action="store_true")
+    args = get_combined_args(parser)
+    print("Benchmarking " + args.model_path)
+
+    # Initialize system state (RNG)
+    safe_state(args.quiet)
+
+    benchmark(model.extract(args), args.iteration, pipeline.extract(args), args.formats, args.chunk_sizes, args.panorama)
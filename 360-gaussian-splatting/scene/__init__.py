@@ -12,11 +12,13 @@
 import os
 import random
 import json
-from utils.system_utils import searchForMaxIteration
+from utils.system_utils import searchForMaxIteration, resolveWorkers
 from scene.dataset_readers import sceneLoadTypeCallbacks
 from scene.gaussian_model import GaussianModel
 from arguments import ModelParams
-from utils.camera_utils import cameraList_from_camInfos, camera_to_JSON
+from utils.camera_utils import cameraList_from_camInfos, cameraList_from_cameras, camera_to_JSON
+from utils.image_cache import ImageCache
+from utils.loss_utils import WeightMaps
 
 class Scene:
 
@@ -27,8 +29,11 @@ class Scene:
         :param path: Path to colmap scene main folder.
         """
         self.model_path = args.model_path
+        self.save_format = args.save_format
+        self.quant_chunk_size = args.quant_chunk_size
         self.loaded_iter = None
         self.gaussians = gaussians
+        self.weight_maps = WeightMaps()
 
         if load_iteration:
             if load_iteration == -1:
@@ -41,9 +46,9 @@ class Scene:
         self.test_cameras = {}
 
         if os.path.exists(os.path.join(args.source_path, "sparse")):
-            scene_info = sceneLoadTypeCallbacks["Colmap"](args.source_path, args.images, args.eval, panorama, masks=args.masks)
+            scene_info = sceneLoadTypeCallbacks["Colmap"](args.source_path, args.images, args.eval, panorama, masks=args.masks, lazy=args.lazy_load, workers=resolveWorkers(args.load_workers))
         if os.path.exists(os.path.join(args.source_path, "reconstruction.json")):
-            scene_info = sceneLoadTypeCallbacks["Opensfm"](args.source_path, args.images, args.eval, panorama, masks=args.masks)
+            scene_info = sceneLoadTypeCallbacks["Opensfm"](args.source_path, args.images, args.eval, panorama, masks=args.masks, lazy=args.lazy_load, workers=resolveWorkers(args.load_workers), json_backend=args.json_backend)
         elif os.path.exists(os.path.join(args.source_path, "transforms_train.json")):
             print("Found transforms_train.json file, assuming Blender data set!")
             scene_info = sceneLoadTypeCallbacks["Blender"](args.source_path, args.white_background, args.eval, panorama, masks=args.masks)
@@ -70,26 +75,46 @@ class Scene:
 
         self.cameras_extent = scene_info.nerf_normalization["radius"]
 
+        self.image_cache = None
+        if args.lazy_load:
+            self.image_cache = ImageCache(args.image_cache_size, args.prefetch_depth)
+
         for resolution_scale in resolution_scales:
             print("Loading Training Cameras")
-            self.train_cameras[resolution_scale] = cameraList_from_camInfos(scene_info.train_cameras, resolution_scale, args, panorama=panorama)
+            self.train_cameras[resolution_scale] = cameraList_from_camInfos(scene_info.train_cameras, resolution_scale, args, panorama=panorama, image_cache=self.image_cache)
             print("Loading Test Cameras")
-            self.test_cameras[resolution_scale] = cameraList_from_camInfos(scene_info.test_cameras, resolution_scale, args, panorama=panorama)
+            self.test_cameras[resolution_scale] = cameraList_from_camInfos(scene_info.test_cameras, resolution_scale, args, panorama=panorama, image_cache=self.image_cache)
 
         if self.loaded_iter:
-            self.gaussians.load_ply(os.path.join(self.model_path,
-                                                           "point_cloud",
-                                                           "iteration_" + str(self.loaded_iter),
-                                                           "point_cloud.ply"))
+            point_cloud_path = os.path.join(self.model_path, "point_cloud", "iteration_" + str(self.loaded_iter))
+            quantized_path = os.path.join(point_cloud_path, "point_cloud.npz")
+            ply_path = os.path.join(point_cloud_path, "point_cloud.ply")
+            if os.path.exists(quantized_path) and (self.save_format != "ply" or not os.path.exists(ply_path)):
+                self.gaussians.load_quantized(quantized_path)
+            else:
+                self.gaussians.load_ply(ply_path)
         else:
             self.gaussians.create_from_pcd(scene_info.point_cloud, self.cameras_extent)
 
-    def save(self, iteration):
+    def save(self, iteration, writer=None):
         point_cloud_path = os.path.join(self.model_path, "point_cloud/iteration_{}".format(iteration))
-        self.gaussians.save_ply(os.path.join(point_cloud_path, "point_cloud.ply"))
+        if self.save_format == "ply":
+            self.gaussians.save_ply(os.path.join(point_cloud_path, "point_cloud.ply"), writer)
+        else:
+            self.gaussians.save_quantized(os.path.join(point_cloud_path, "point_cloud.npz"), self.save_format, self.quant_chunk_size, writer)
+
+    def prefetch(self, cameras):
+        """ Start decoding the images of the given cameras, nearest first. No-op unless lazy loading. """
+        if self.image_cache is not None:
+            self.image_cache.prefetch((cam.image_key, cam.load_image) for cam in cameras)
 
     def getTrainCameras(self, scale=1.0):
+        # Scales that were not loaded up front are derived from the full resolution cameras on first use
+        if scale not in self.train_cameras:
+            self.train_cameras[scale] = cameraList_from_cameras(self.train_cameras[1.0], scale, self.image_cache)
         return self.train_cameras[scale]
 
     def getTestCameras(self, scale=1.0):
+        if scale not in self.test_cameras:
+            self.test_cameras[scale] = cameraList_from_cameras(self.test_cameras[1.0], scale, self.image_cache)
         return self.test_cameras[scale]
\ No newline at end of file
@@ -13,11 +13,13 @@ import torch
 from torch import nn
 import numpy as np
 from utils.graphics_utils import getWorld2View2, getProjectionMatrix
+from utils.general_utils import get_device
 
 class Camera(nn.Module):
     def __init__(self, colmap_id, R, T, FoVx, FoVy, image, mask, gt_alpha_mask,
                  image_name, uid,
-                 trans=np.array([0.0, 0.0, 0.0]), scale=1.0, data_device = "cuda", panorama=False
+                 trans=np.array([0.0, 0.0, 0.0]), scale=1.0, data_device = "cuda", panorama=False,
+                 image_loader=None, image_cache=None, resolution=None
                  ):
         super(Camera, self).__init__()
 
@@ -36,18 +38,19 @@ class Camera(nn.Module):
             print(f"[Warning] Custom device {data_device} failed, fallback to default cuda device" )
             self.data_device = torch.device("cuda")
 
-        self.original_image = image.clamp(0.0, 1.0).to(self.data_device)
-        self.image_width = self.original_image.shape[2]
-        self.image_height = self.original_image.shape[1]
-        self.raw_mask = mask
-        self.is_masked = None
-        if mask is not None:
-            self.is_masked = (mask == 0).expand(*image.shape)  # True represent masked pixel
-            
-        if gt_alpha_mask is not None:
-            self.original_image *= gt_alpha_mask.to(self.data_device)
+        # In lazy mode pixels are only decoded through the shared image cache,
+        # the camera itself keeps nothing but its metadata and a loader.
+        self.image_loader = image_loader
+        self.image_cache = image_cache
+        self.image_key = (image_name, resolution)
+        if image_cache is None:
+            self._original_image, self._is_masked = self.prepare_image(image, mask, gt_alpha_mask)
+            self.image_width = self._original_image.shape[2]
+            self.image_height = self._original_image.shape[1]
+            self.raw_mask = mask
         else:
-            self.original_image *= torch.ones((1, self.image_height, self.image_width), device=self.data_device)
+            self.image_width, self.image_height = resolution
+            self.raw_mask = None
 
         self.zfar = 100.0
         self.znear = 0.01
@@ -55,8 +58,8 @@ class Camera(nn.Module):
         self.trans = trans
         self.scale = scale
 
-        self.world_view_transform = torch.tensor(getWorld2View2(R, T, trans, scale)).transpose(0, 1).cuda()
-        self.projection_matrix = getProjectionMatrix(znear=self.znear, zfar=self.zfar, fovX=self.FoVx, fovY=self.FoVy).transpose(0,1).cuda()
+        self.world_view_transform = torch.tensor(getWorld2View2(R, T, trans, scale)).transpose(0, 1).to(get_device())
+        self.projection_matrix = getProjectionMatrix(znear=self.znear, zfar=self.zfar, fovX=self.FoVx, fovY=self.FoVy).transpose(0,1).to(get_device())
         self.full_proj_transform = (self.world_view_transform.unsqueeze(0).bmm(self.projection_matrix.unsqueeze(0))).squeeze(0)
         self.camera_center = self.world_view_transform.inverse()[3, :3]
         self.panorama = panorama
@@ -67,22 +70,50 @@ class Camera(nn.Module):
             #self.image_height = self.original_image.shape[1]
             R_r, T_r = self.rotate_camera_coordinate(R, T)
 
-            self.world_view_transform_right = torch.tensor(getWorld2View2(R_r, T_r, trans, scale)).transpose(0, 1).cuda()
+            self.world_view_transform_right = torch.tensor(getWorld2View2(R_r, T_r, trans, scale)).transpose(0, 1).to(get_device())
             self.full_proj_transform_right = (self.world_view_transform_right.unsqueeze(0).bmm(self.projection_matrix.unsqueeze(0))).squeeze(0)
             self.camera_center_right = self.world_view_transform_right.inverse()[3, :3]
             R_b, T_b = self.rotate_camera_coordinate(R_r, T_r)
 
-            self.world_view_transform_back = torch.tensor(getWorld2View2(R_b, T_b, trans, scale)).transpose(0, 1).cuda()
+            self.world_view_transform_back = torch.tensor(getWorld2View2(R_b, T_b, trans, scale)).transpose(0, 1).to(get_device())
             self.full_proj_transform_back = (self.world_view_transform_back.unsqueeze(0).bmm(self.projection_matrix.unsqueeze(0))).squeeze(0)
             self.camera_center_back = self.world_view_transform_back.inverse()[3, :3]
 
             R_l, T_l = self.rotate_camera_coordinate(R_b, T_b)
-            self.world_view_transform_left = torch.tensor(getWorld2View2(R_l, T_l, trans, scale)).transpose(0, 1).cuda()
+            self.world_view_transform_left = torch.tensor(getWorld2View2(R_l, T_l, trans, scale)).transpose(0, 1).to(get_device())
             self.full_proj_transform_left = (self.world_view_transform_left.unsqueeze(0).bmm(self.projection_matrix.unsqueeze(0))).squeeze(0)
             self.camera_center_left = self.world_view_transform_left.inverse()[3, :3]
 
 
 
+    def prepare_image(self, image, mask, gt_alpha_mask):
+        original_image = image.clamp(0.0, 1.0).to(self.data_device)
+        is_masked = None
+        if mask is not None:
+            is_masked = (mask == 0).expand(*image.shape)  # True represent masked pixel
+
+        if gt_alpha_mask is not None:
+            original_image *= gt_alpha_mask.to(self.data_device)
+        else:
+            original_image *= torch.ones((1, original_image.shape[1], original_image.shape[2]), device=self.data_device)
+        return original_image, is_masked
+
+    def load_image(self):
+        image, mask, gt_alpha_mask = self.image_loader()
+        return self.prepare_image(image, mask, gt_alpha_mask)
+
+    @property
+    def original_image(self):
+        if self.image_cache is None:
+            return self._original_image
+        return self.image_cache.get(self.image_key, self.load_image)[0]
+
+    @property
+    def is_masked(self):
+        if self.image_cache is None:
+            return self._is_masked
+        return self.image_cache.get(self.image_key, self.load_image)[1]
+
     def rotate_camera_coordinate(self, R, T):
         R_y = np.array([[ 0.0, 0.0,  1.0, 0.0], [ 0.0,  1.0,  0.0, 0.0], [ -1.0,  0.0,  0.0, 0.0], [ 0.0,  0.0,  0.0, 1.0]])
 
@@ -9,6 +9,10 @@
 # For inquiries contact  george.drettakis@inria.fr
 #
 
+import os
+import mmap
+import array
+import warnings
 import numpy as np
 import collections
 import struct
@@ -86,71 +90,66 @@ def read_points3D_text(path):
         void Reconstruction::ReadPoints3DText(const std::string& path)
         void Reconstruction::WritePoints3DText(const std::string& path)
     """
-    xyzs = None
-    rgbs = None
-    errors = None
-    num_points = 0
-    with open(path, "r") as fid:
-        while True:
-            line = fid.readline()
-            if not line:
-                break
-            line = line.strip()
-            if len(line) > 0 and line[0] != "#":
-                num_points += 1
-
-
-    xyzs = np.empty((num_points, 3))
-    rgbs = np.empty((num_points, 3))
-    errors = np.empty((num_points, 1))
-    count = 0
-    with open(path, "r") as fid:
-        while True:
-            line = fid.readline()
-            if not line:
-                break
-            line = line.strip()
-            if len(line) > 0 and line[0] != "#":
-                elems = line.split()
-                xyz = np.array(tuple(map(float, elems[1:4])))
-                rgb = np.array(tuple(map(int, elems[4:7])))
-                error = np.array(float(elems[7]))
-                xyzs[count] = xyz
-                rgbs[count] = rgb
-                errors[count] = error
-                count += 1
-
+    # Single pass: only the fixed columns (xyz, rgb, error) are parsed, tracks are ignored
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)  # Empty reconstruction
+        data = np.loadtxt(path, comments="#", usecols=range(1, 8), ndmin=2, dtype=np.float64)
+    xyzs = data[:, 0:3].copy()
+    rgbs = data[:, 3:6].copy()
+    errors = data[:, 6:7].copy()
     return xyzs, rgbs, errors
 
+def read_at_offsets(buffer, offsets, dtype, count=1):
+    """
+    Read `count` consecutive little endian values of the given dtype at each
+    byte offset of buffer, as an (N, count) array. Offsets need not be aligned:
+    they are grouped by alignment and every group is gathered from a shifted
+    typed view of the buffer.
+    """
+    dtype = np.dtype(dtype).newbyteorder("<")
+    size = dtype.itemsize
+    columns = np.arange(count)
+    if size == 1:
+        return np.frombuffer(buffer, dtype=dtype)[offsets[:, None] + columns]
+    values = np.empty((len(offsets), count), dtype=dtype)
+    phase = offsets % size
+    for shift in np.nonzero(np.bincount(phase, minlength=size))[0]:
+        selected = np.nonzero(phase == shift)[0]
+        view = np.frombuffer(buffer, dtype=dtype, offset=shift, count=(len(buffer) - shift) // size)
+        values[selected] = view[((offsets[selected] - shift) // size)[:, None] + columns]
+    return values
+
 def read_points3D_binary(path_to_model_file):
     """
     see: src/base/reconstruction.cc
         void Reconstruction::ReadPoints3DBinary(const std::string& path)
         void Reconstruction::WritePoints3DBinary(const std::string& path)
     """
-
-
+    # Record layout: point3D_id (Q), xyz (3d), rgb (3B), error (d), track_length (Q), track (ii * track_length)
     with open(path_to_model_file, "rb") as fid:
-        num_points = read_next_bytes(fid, 8, "Q")[0]
+        if os.fstat(fid.fileno()).st_size <= 8:
+            return np.empty((0, 3)), np.empty((0, 3)), np.empty((0, 1))
+        with mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            num_points = struct.unpack_from("<Q", buffer, 0)[0]
 
-        xyzs = np.empty((num_points, 3))
-        rgbs = np.empty((num_points, 3))
-        errors = np.empty((num_points, 1))
+            # Each record starts where the previous track ends, so record offsets are
+            # found by a scan that only reads track lengths; all fields are then
+            # gathered for every point at once. The scan stays a Python loop: every
+            # offset depends on the length read at the previous one, and vectorized
+            # alternatives (pointer doubling over candidate byte offsets) do more
+            # work per record than this loop's ~0.4 us
+            offsets = array.array("q")
+            append = offsets.append
+            track_length = struct.Struct("<Q").unpack_from
+            offset = 8
+            for _ in range(num_points):
+                append(offset)
+                offset += 51 + 8 * track_length(buffer, offset + 43)[0]
+            offsets = np.frombuffer(offsets, dtype=np.int64)
 
-        for p_id in range(num_points):
-            binary_point_line_properties = read_next_bytes(
-                fid, num_bytes=43, format_char_sequence="QdddBBBd")
-            xyz = np.array(binary_point_line_properties[1:4])
-            rgb = np.array(binary_point_line_properties[4:7])
-            error = np.array(binary_point_line_properties[7])
-            track_length = read_next_bytes(
-                fid, num_bytes=8, format_char_sequence="Q")[0]
-            track_elems = read_next_bytes(
-                fid, num_bytes=8*track_length,
-                format_char_sequence="ii"*track_length)
-            xyzs[p_id] = xyz
-            rgbs[p_id] = rgb
-            errors[p_id] = error
+            xyzs = read_at_offsets(buffer, offsets + 8, np.float64, 3)
+            rgbs = read_at_offsets(buffer, offsets + 32, np.uint8, 3).astype(np.float64)
+            errors = read_at_offsets(buffer, offsets + 35, np.float64)
     return xyzs, rgbs, errors
 
 def read_intrinsics_text(path):
@@ -184,31 +183,33 @@ def read_extrinsics_binary(path_to_model_file):
         void Reconstruction::WriteImagesBinary(const std::string& path)
     """
     images = {}
+    properties = struct.Struct("<idddddddi")
+    points2D_dtype = np.dtype([("x", "<f8"), ("y", "<f8"), ("point3D_id", "<i8")])
     with open(path_to_model_file, "rb") as fid:
-        num_reg_images = read_next_bytes(fid, 8, "Q")[0]
-        for _ in range(num_reg_images):
-            binary_image_properties = read_next_bytes(
-                fid, num_bytes=64, format_char_sequence="idddddddi")
-            image_id = binary_image_properties[0]
-            qvec = np.array(binary_image_properties[1:5])
-            tvec = np.array(binary_image_properties[5:8])
-            camera_id = binary_image_properties[8]
-            image_name = ""
-            current_char = read_next_bytes(fid, 1, "c")[0]
-            while current_char != b"\x00":   # look for the ASCII 0 entry
-                image_name += current_char.decode("utf-8")
-                current_char = read_next_bytes(fid, 1, "c")[0]
-            num_points2D = read_next_bytes(fid, num_bytes=8,
-                                           format_char_sequence="Q")[0]
-            x_y_id_s = read_next_bytes(fid, num_bytes=24*num_points2D,
-                                       format_char_sequence="ddq"*num_points2D)
-            xys = np.column_stack([tuple(map(float, x_y_id_s[0::3])),
-                                   tuple(map(float, x_y_id_s[1::3]))])
-            point3D_ids = np.array(tuple(map(int, x_y_id_s[2::3])))
-            images[image_id] = Image(
-                id=image_id, qvec=qvec, tvec=tvec,
-                camera_id=camera_id, name=image_name,
-                xys=xys, point3D_ids=point3D_ids)
+        with mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            num_reg_images = struct.unpack_from("<Q", buffer, 0)[0]
+            offset = 8
+            for _ in range(num_reg_images):
+                binary_image_properties = properties.unpack_from(buffer, offset)
+                image_id = binary_image_properties[0]
+                qvec = np.array(binary_image_properties[1:5])
+                tvec = np.array(binary_image_properties[5:8])
+                camera_id = binary_image_properties[8]
+                offset += properties.size
+                name_end = buffer.find(b"\x00", offset)   # look for the ASCII 0 entry
+                image_name = buffer[offset:name_end].decode("utf-8")
+                offset = name_end + 1
+                num_points2D = struct.unpack_from("<Q", buffer, offset)[0]
+                offset += 8
+                points2D = np.frombuffer(buffer, dtype=points2D_dtype, count=num_points2D, offset=offset)
+                offset += points2D_dtype.itemsize * num_points2D
+                xys = np.column_stack((points2D["x"], points2D["y"]))
+                point3D_ids = points2D["point3D_id"].astype(np.int64)
+                del points2D  # Drop the view into the mapping before it is closed
+                images[image_id] = Image(
+                    id=image_id, qvec=qvec, tvec=tvec,
+                    camera_id=camera_id, name=image_name,
+                    xys=xys, point3D_ids=point3D_ids)
     return images
 
 
@@ -11,11 +11,13 @@
 
 import os
 import sys
+import hashlib
 from PIL import Image
 from typing import NamedTuple
+from concurrent.futures import ThreadPoolExecutor
 from scene.colmap_loader import read_extrinsics_text, read_intrinsics_text, qvec2rotmat, \
     read_extrinsics_binary, read_intrinsics_binary, read_points3D_binary, read_points3D_text
-from scene.opensfm_loader import read_opensfm_extrinsics_split, read_opensfm, read_opensfm_intrinsics_split, qvec2rotmat, read_opensfm_points3D
+from scene.opensfm_loader import read_opensfm_extrinsics_split, read_opensfm, read_opensfm_intrinsics_split, qvec2rotmat, load_opensfm_reconstruction
 from utils.graphics_utils import getWorld2View2, focal2fov, fov2focal
 import numpy as np
 import json
@@ -70,14 +72,8 @@ def getNerfppNorm(cam_info):
 
     return {"translate": translate, "radius": radius}
 
-def readColmapCameras(cam_extrinsics, cam_intrinsics, images_folder):
-    cam_infos = []
-    for idx, key in enumerate(cam_extrinsics):
-        sys.stdout.write('\r')
-        # the exact output you're looking for:
-        sys.stdout.write("Reading camera {}/{}".format(idx+1, len(cam_extrinsics)))
-        sys.stdout.flush()
-
+def readColmapCameras(cam_extrinsics, cam_intrinsics, images_folder, lazy=False, workers=1):
+    def readCamera(key):
         extr = cam_extrinsics[key]
         intr = cam_intrinsics[extr.camera_id]
         height = intr.height
@@ -101,11 +97,20 @@ def readColmapCameras(cam_extrinsics, cam_intrinsics, images_folder):
 
         image_path = os.path.join(images_folder, os.path.basename(extr.name))
         image_name = os.path.basename(image_path).split(".")[0]
-        image = Image.open(image_path)
+        image = None if lazy else Image.open(image_path)
 
-        cam_info = CameraInfo(uid=uid, R=R, T=T, FovY=FovY, FovX=FovX, image=image,
-                              image_path=image_path, image_name=image_name, width=width, height=height)
-        cam_infos.append(cam_info)
+        cam_info = CameraInfo(uid=uid, R=R, T=T, FovY=FovY, FovX=FovX, image=image, mask=None,
+                              image_path=image_path, mask_path=None, image_name=image_name, width=width, height=height, panorama=False)
+        return cam_info
+
+    cam_infos = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for idx, cam_info in enumerate(executor.map(readCamera, cam_extrinsics)):
+            sys.stdout.write('\r')
+            # the exact output you're looking for:
+            sys.stdout.write("Reading camera {}/{}".format(idx+1, len(cam_extrinsics)))
+            sys.stdout.flush()
+            cam_infos.append(cam_info)
     sys.stdout.write('\n')
     return cam_infos
 
@@ -125,15 +130,8 @@ def qvec2rotmat(qvec):
          2 * qvec[2] * qvec[3] + 2 * qvec[0] * qvec[1],
          1 - 2 * qvec[1]**2 - 2 * qvec[2]**2]])
 
-def readOpensfmCameras(cam_extrinsics, cam_intrinsics, images_folder, masks_folder):
-    cam_infos = []
-    mask_count = 0
-    for idx, key in enumerate(cam_extrinsics):
-        sys.stdout.write('\r')
-        # the exact output you're looking for:
-        sys.stdout.write("Reading camera {}/{}".format(idx+1, len(cam_extrinsics)))
-        sys.stdout.flush()
-
+def readOpensfmCameras(cam_extrinsics, cam_intrinsics, images_folder, masks_folder, lazy=False, workers=1):
+    def readCamera(key):
         extr = cam_extrinsics[key]
         intr = cam_intrinsics[extr.camera_id]
         height = intr.height
@@ -175,7 +173,13 @@ def readOpensfmCameras(cam_extrinsics, cam_intrinsics, images_folder, masks_fold
                     mask.size,
                 )
                 mask_path = possible_mask_path
-                mask_count += 1
+        if lazy:
+            # Only the headers were needed, pixels are decoded on demand by the image cache
+            image.close()
+            image = None
+            if mask is not None:
+                mask.close()
+                mask = None
         R_y = np.array([[ 0.0, 0.0,  1.0, 0.0], [ 0.0,  1.0,  0.0, 0.0], [ -1.0,  0.0,  0.0, 0.0], [ 0.0,  0.0,  0.0, 1.0]])
         """
         if extr.camera_id <= 3:
@@ -201,7 +205,19 @@ def readOpensfmCameras(cam_extrinsics, cam_intrinsics, images_folder, masks_fold
 
         cam_info = CameraInfo(uid=uid, R=R, T=T, FovY=FovY, FovX=FovX, image=image, mask=mask,
                               image_path=image_path, mask_path=mask_path, image_name=image_name, width=width, height=height, panorama=panorama)
-        cam_infos.append(cam_info)
+        return cam_info
+
+    cam_infos = []
+    mask_count = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for idx, cam_info in enumerate(executor.map(readCamera, cam_extrinsics)):
+            sys.stdout.write('\r')
+            # the exact output you're looking for:
+            sys.stdout.write("Reading camera {}/{}".format(idx+1, len(cam_extrinsics)))
+            sys.stdout.flush()
+            if cam_info.mask_path is not None:
+                mask_count += 1
+            cam_infos.append(cam_info)
     if masks_folder != "":
         sys.stdout.write('\n')
         sys.stdout.write("Read {} masks".format(mask_count))
@@ -224,16 +240,44 @@ def storePly(path, xyz, rgb):
     
     normals = np.zeros_like(xyz)
 
+    # Fill the structured array one field at a time, casting like the per-row tuples would
     elements = np.empty(xyz.shape[0], dtype=dtype)
     attributes = np.concatenate((xyz, normals, rgb), axis=1)
-    elements[:] = list(map(tuple, attributes))
+    for idx, (name, _) in enumerate(dtype):
+        elements[name] = attributes[:, idx]
 
     # Create the PlyData object and write to file
     vertex_element = PlyElement.describe(elements, 'vertex')
     ply_data = PlyData([vertex_element])
     ply_data.write(path)
 
-def readColmapSceneInfo(path, images, eval, llffhold=8):
+def pointCloudFromArrays(xyz, rgb):
+    # Same values and dtypes as a storePly/fetchPly round trip, without touching the disk
+    positions = xyz.astype(np.float32)
+    colors = rgb.astype(np.uint8) / 255.0
+    normals = np.zeros_like(positions)
+    return BasicPointCloud(points=positions, colors=colors, normals=normals)
+
+def fileDigest(path, chunk_size=1 << 24):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def storePlyIfChanged(path, source_path, xyz, rgb):
+    # The digest of the source file is kept next to the PLY, rewrite only when it differs
+    digest = fileDigest(source_path)
+    digest_path = path + ".sha1"
+    if os.path.exists(path) and os.path.exists(digest_path):
+        with open(digest_path) as f:
+            if f.read().strip() == digest:
+                return
+    storePly(path, xyz, rgb)
+    with open(digest_path, 'w') as f:
+        f.write(digest)
+
+def readColmapSceneInfo(path, images, eval, panorama=False, llffhold=8, masks=None, lazy=False, workers=1):
     try:
         cameras_extrinsic_file = os.path.join(path, "sparse/0", "images.bin")
         cameras_intrinsic_file = os.path.join(path, "sparse/0", "cameras.bin")
@@ -246,7 +290,7 @@ def readColmapSceneInfo(path, images, eval, llffhold=8):
         cam_intrinsics = read_intrinsics_text(cameras_intrinsic_file)
 
     reading_dir = "images" if images == None else images
-    cam_infos_unsorted = readColmapCameras(cam_extrinsics=cam_extrinsics, cam_intrinsics=cam_intrinsics, images_folder=os.path.join(path, reading_dir))
+    cam_infos_unsorted = readColmapCameras(cam_extrinsics=cam_extrinsics, cam_intrinsics=cam_intrinsics, images_folder=os.path.join(path, reading_dir), lazy=lazy, workers=workers)
     cam_infos = sorted(cam_infos_unsorted.copy(), key = lambda x : x.image_name)
 
     if eval:
@@ -268,10 +312,12 @@ def readColmapSceneInfo(path, images, eval, llffhold=8):
         except:
             xyz, rgb, _ = read_points3D_text(txt_path)
         storePly(ply_path, xyz, rgb)
-    try:
-        pcd = fetchPly(ply_path)
-    except:
-        pcd = None
+        pcd = pointCloudFromArrays(xyz, rgb)
+    else:
+        try:
+            pcd = fetchPly(ply_path)
+        except:
+            pcd = None
 
     scene_info = SceneInfo(point_cloud=pcd,
                            train_cameras=train_cam_infos,
@@ -358,44 +404,39 @@ def readNerfSyntheticInfo(path, white_background, eval, extension=".png"):
                            ply_path=ply_path)
     return scene_info
 
-def readOpensfmSceneInfo(path, images, eval, panorama, llffhold=8, masks=None):
+def readOpensfmSceneInfo(path, images, eval, panorama, llffhold=8, masks=None, lazy=False, workers=1, json_backend="auto"):
     reconstruction_file = os.path.join(path, 'reconstruction.json')
-    with open(reconstruction_file) as f:
-        reconstruction = json.load(f)
+    reconstruction, (xyz, rgb, _) = load_opensfm_reconstruction(reconstruction_file, backend=json_backend)
 
-        reading_dir = "images" if images == None else images
-        if panorama:
-            reading_dir = "images"
-            cam_intrinsics, cam_extrinsics = read_opensfm(reconstruction)
-        else:
-            reading_dir = "images_split"
-            cam_extrinsics = read_opensfm_extrinsics_split(reconstruction)
-            cam_intrinsics = read_opensfm_intrinsics_split(reconstruction)
-        cam_infos_unsorted = readOpensfmCameras(cam_extrinsics=cam_extrinsics, cam_intrinsics=cam_intrinsics, images_folder=os.path.join(path, reading_dir), masks_folder=masks)
-        cam_infos = sorted(cam_infos_unsorted.copy(), key = lambda x : x.image_name)
-
-        if eval:
-            train_cam_infos = [c for idx, c in enumerate(cam_infos) if idx % llffhold != 0]
-            test_cam_infos = [c for idx, c in enumerate(cam_infos) if idx % llffhold == 0]
-        else:
-            train_cam_infos = cam_infos
-            test_cam_infos = []
-        nerf_normalization = getNerfppNorm(train_cam_infos)
+    reading_dir = "images" if images == None else images
+    if panorama:
+        reading_dir = "images"
+        cam_intrinsics, cam_extrinsics = read_opensfm(reconstruction)
+    else:
+        reading_dir = "images_split"
+        cam_extrinsics = read_opensfm_extrinsics_split(reconstruction)
+        cam_intrinsics = read_opensfm_intrinsics_split(reconstruction)
+    cam_infos_unsorted = readOpensfmCameras(cam_extrinsics=cam_extrinsics, cam_intrinsics=cam_intrinsics, images_folder=os.path.join(path, reading_dir), masks_folder=masks, lazy=lazy, workers=workers)
+    cam_infos = sorted(cam_infos_unsorted.copy(), key = lambda x : x.image_name)
 
+    if eval:
+        train_cam_infos = [c for idx, c in enumerate(cam_infos) if idx % llffhold != 0]
+        test_cam_infos = [c for idx, c in enumerate(cam_infos) if idx % llffhold == 0]
+    else:
+        train_cam_infos = cam_infos
+        test_cam_infos = []
+    nerf_normalization = getNerfppNorm(train_cam_infos)
 
-        ply_path = os.path.join(path, "reconstruction.ply")
-        xyz, rgb, _ = read_opensfm_points3D(reconstruction)
-        storePly(ply_path, xyz, rgb)
-        try:
-            pcd = fetchPly(ply_path)
-        except:
-            pcd = None
 
-        scene_info = SceneInfo(point_cloud=pcd,
-                            train_cameras=train_cam_infos,
-                            test_cameras=test_cam_infos,
-                            nerf_normalization=nerf_normalization,
-                            ply_path=ply_path)
+    ply_path = os.path.join(path, "reconstruction.ply")
+    storePlyIfChanged(ply_path, reconstruction_file, xyz, rgb)
+    pcd = pointCloudFromArrays(xyz, rgb)
+
+    scene_info = SceneInfo(point_cloud=pcd,
+                        train_cameras=train_cam_infos,
+                        test_cameras=test_cam_infos,
+                        nerf_normalization=nerf_normalization,
+                        ply_path=ply_path)
     return scene_info
 
 sceneLoadTypeCallbacks = {
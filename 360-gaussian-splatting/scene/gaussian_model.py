@@ -11,13 +11,16 @@
 
 import torch
 import numpy as np
-from utils.general_utils import inverse_sigmoid, get_expon_lr_func, build_rotation
+from utils.general_utils import inverse_sigmoid, get_expon_lr_func, build_rotation, get_device
 from torch import nn
 import os
 from utils.system_utils import mkdir_p
 from plyfile import PlyData, PlyElement
+from utils.ply_utils import write_float_ply, read_float_ply
+from utils.quantize_utils import write_quantized, read_quantized
+from utils.optim_utils import GaussianAdam
+from utils.spatial_utils import GaussianGrid
 from utils.sh_utils import RGB2SH
-from simple_knn._C import distCUDA2
 from utils.graphics_utils import BasicPointCloud
 from utils.general_utils import strip_symmetric, build_scaling_rotation
 
@@ -56,42 +59,99 @@ class GaussianModel:
         self.optimizer = None
         self.percent_dense = 0
         self.spatial_lr_scale = 0
+        self.spatial_index = None
         self.setup_functions()
 
     def capture(self):
+        # Free slots of a growable GaussianAdam storage are left out, so checkpoints only hold live Gaussians
+        alive = self.alive_mask()
+        def live(tensor):
+            return tensor if alive is None else tensor.detach()[alive]
         return (
             self.active_sh_degree,
-            self._xyz,
-            self._features_dc,
-            self._features_rest,
-            self._scaling,
-            self._rotation,
-            self._opacity,
-            self.max_radii2D,
-            self.xyz_gradient_accum,
-            self.denom,
+            live(self._xyz),
+            live(self._features_dc),
+            live(self._features_rest),
+            live(self._scaling),
+            live(self._rotation),
+            live(self._opacity),
+            live(self.max_radii2D),
+            live(self.xyz_gradient_accum),
+            live(self.denom),
             self.optimizer.state_dict(),
             self.spatial_lr_scale,
         )
     
     def restore(self, model_args, training_args):
         (self.active_sh_degree, 
-        self._xyz, 
-        self._features_dc, 
-        self._features_rest,
-        self._scaling, 
-        self._rotation, 
-        self._opacity,
-        self.max_radii2D, 
+        xyz, 
+        features_dc, 
+        features_rest,
+        scaling, 
+        rotation, 
+        opacity,
+        max_radii2D, 
         xyz_gradient_accum, 
         denom,
         opt_dict, 
         self.spatial_lr_scale) = model_args
+        # Checkpoints written by the asynchronous writer hold host copies, bring them back to the device
+        self._xyz = nn.Parameter(xyz.cuda().requires_grad_(True))
+        self._features_dc = nn.Parameter(features_dc.cuda().requires_grad_(True))
+        self._features_rest = nn.Parameter(features_rest.cuda().requires_grad_(True))
+        self._scaling = nn.Parameter(scaling.cuda().requires_grad_(True))
+        self._rotation = nn.Parameter(rotation.cuda().requires_grad_(True))
+        self._opacity = nn.Parameter(opacity.cuda().requires_grad_(True))
+        self.max_radii2D = max_radii2D.cuda()
         self.training_setup(training_args)
-        self.xyz_gradient_accum = xyz_gradient_accum
-        self.denom = denom
+        self.xyz_gradient_accum = xyz_gradient_accum.cuda()
+        self.denom = denom.cuda()
         self.optimizer.load_state_dict(opt_dict)
 
+    def alive_mask(self):
+        """ Mask of the parameter rows holding a Gaussian, None when all of them do. """
+        if isinstance(self.optimizer, GaussianAdam):
+            return self.optimizer.alive_mask()
+        return None
+
+    @property
+    def num_points(self):
+        if isinstance(self.optimizer, GaussianAdam):
+            return self.optimizer.num_points
+        return self._xyz.shape[0]
+
+    def snapshot(self):
+        """ Detached copy of the live Gaussians, to render from while training goes on. """
+        alive = self.alive_mask()
+        def copy(tensor):
+            return tensor.detach().clone() if alive is None else tensor.detach()[alive]
+        snapshot = GaussianModel(self.max_sh_degree)
+        snapshot.active_sh_degree = self.active_sh_degree
+        with torch.no_grad():
+            snapshot._xyz = copy(self._xyz)
+            snapshot._features_dc = copy(self._features_dc)
+            snapshot._features_rest = copy(self._features_rest)
+            snapshot._scaling = copy(self._scaling)
+            snapshot._rotation = copy(self._rotation)
+            snapshot._opacity = copy(self._opacity)
+        return snapshot
+
+    def get_spatial_index(self):
+        """
+        Grid over the Gaussian centers for pre-culling. It is rebuilt when the
+        parameters are replaced (densification, pruning, loading) and refit when
+        they were updated in place (optimizer steps) since the last call.
+        """
+        source = (self._xyz, self._scaling)
+        version = (self._xyz._version, self._scaling._version)
+        with torch.no_grad():
+            if self.spatial_index is None or any(a is not b for a, b in zip(self.spatial_index.source, source)):
+                self.spatial_index = GaussianGrid(self._xyz, 3 * self.get_scaling.max(dim=1).values, alive=self.alive_mask())
+            elif self.spatial_index.version != version:
+                self.spatial_index.refit(self._xyz, 3 * self.get_scaling.max(dim=1).values)
+        self.spatial_index.source, self.spatial_index.version = source, version
+        return self.spatial_index
+
     @property
     def get_scaling(self):
         return self.scaling_activation(self._scaling)
@@ -131,6 +191,8 @@ class GaussianModel:
 
         print("Number of points at initialisation : ", fused_point_cloud.shape[0])
 
+        # Imported here so that trained models can be loaded and rendered without the CUDA extensions
+        from simple_knn._C import distCUDA2
         dist2 = torch.clamp_min(distCUDA2(torch.from_numpy(np.asarray(pcd.points)).float().cuda()), 0.0000001)
         scales = torch.log(torch.sqrt(dist2))[...,None].repeat(1, 3)
         rots = torch.zeros((fused_point_cloud.shape[0], 4), device="cuda")
@@ -148,8 +210,8 @@ class GaussianModel:
 
     def training_setup(self, training_args):
         self.percent_dense = training_args.percent_dense
-        self.xyz_gradient_accum = torch.zeros((self.get_xyz.shape[0], 1), device="cuda")
-        self.denom = torch.zeros((self.get_xyz.shape[0], 1), device="cuda")
+        self.xyz_gradient_accum = torch.zeros((self.get_xyz.shape[0], 1), device=get_device())
+        self.denom = torch.zeros((self.get_xyz.shape[0], 1), device=get_device())
 
         l = [
             {'params': [self._xyz], 'lr': training_args.position_lr_init * self.spatial_lr_scale, "name": "xyz"},
@@ -160,7 +222,16 @@ class GaussianModel:
             {'params': [self._rotation], 'lr': training_args.rotation_lr, "name": "rotation"}
         ]
 
-        self.optimizer = torch.optim.Adam(l, lr=0.0, eps=1e-15)
+        if training_args.optimizer_type == "default":
+            self.optimizer = torch.optim.Adam(l, lr=0.0, eps=1e-15)
+        else:
+            # The fused optimizer owns the storage, the model keeps views of it. Free slots of
+            # the growable storage get a zero opacity so that they are not rendered.
+            self.optimizer = GaussianAdam(l, lr=0.0, eps=1e-15, sparse=training_args.optimizer_type == "sparse",
+                                          growable=training_args.growable_storage,
+                                          max_free_fraction=training_args.compact_threshold,
+                                          free_values={"opacity": float("-inf")})
+            self.set_optimizable_tensors(self.optimizer.parameters())
         self.xyz_scheduler_args = get_expon_lr_func(lr_init=training_args.position_lr_init*self.spatial_lr_scale,
                                                     lr_final=training_args.position_lr_final*self.spatial_lr_scale,
                                                     lr_delay_mult=training_args.position_lr_delay_mult,
@@ -188,24 +259,35 @@ class GaussianModel:
             l.append('rot_{}'.format(i))
         return l
 
-    def save_ply(self, path):
+    def vertex_attributes(self):
+        # All properties are float, so the vertex block is a single (N, P) float32 matrix:
+        # gather it on the device so that it is copied to host once
+        xyz = self._xyz.detach()
+        normals = torch.zeros_like(xyz)
+        f_dc = self._features_dc.detach().transpose(1, 2).flatten(start_dim=1)
+        f_rest = self._features_rest.detach().transpose(1, 2).flatten(start_dim=1)
+        opacities = self._opacity.detach()
+        scale = self._scaling.detach()
+        rotation = self._rotation.detach()
+        attributes = torch.cat((xyz, normals, f_dc, f_rest, opacities, scale, rotation), dim=1).float()
+        alive = self.alive_mask()
+        return attributes if alive is None else attributes[alive]
+
+    def save_ply(self, path, writer=None):
         mkdir_p(os.path.dirname(path))
+        attributes = self.vertex_attributes()
+        if writer is None:
+            write_float_ply(path, self.construct_list_of_attributes(), attributes.cpu().numpy())
+        else:
+            writer.submit(write_float_ply, path, self.construct_list_of_attributes(), writer.snapshot(attributes))
 
-        xyz = self._xyz.detach().cpu().numpy()
-        normals = np.zeros_like(xyz)
-        f_dc = self._features_dc.detach().transpose(1, 2).flatten(start_dim=1).contiguous().cpu().numpy()
-        f_rest = self._features_rest.detach().transpose(1, 2).flatten(start_dim=1).contiguous().cpu().numpy()
-        opacities = self._opacity.detach().cpu().numpy()
-        scale = self._scaling.detach().cpu().numpy()
-        rotation = self._rotation.detach().cpu().numpy()
-
-        dtype_full = [(attribute, 'f4') for attribute in self.construct_list_of_attributes()]
-
-        elements = np.empty(xyz.shape[0], dtype=dtype_full)
-        attributes = np.concatenate((xyz, normals, f_dc, f_rest, opacities, scale, rotation), axis=1)
-        elements[:] = list(map(tuple, attributes))
-        el = PlyElement.describe(elements, 'vertex')
-        PlyData([el]).write(path)
+    def save_quantized(self, path, dtype="uint8", chunk_size=256, writer=None):
+        mkdir_p(os.path.dirname(path))
+        attributes = self.vertex_attributes()
+        if writer is None:
+            write_quantized(path, self.construct_list_of_attributes(), attributes.cpu().numpy(), dtype, chunk_size)
+        else:
+            writer.submit(write_quantized, path, self.construct_list_of_attributes(), writer.snapshot(attributes), dtype, chunk_size)
 
     def reset_opacity(self):
         opacities_new = inverse_sigmoid(torch.min(self.get_opacity, torch.ones_like(self.get_opacity)*0.01))
@@ -213,49 +295,60 @@ class GaussianModel:
         self._opacity = optimizable_tensors["opacity"]
 
     def load_ply(self, path):
-        plydata = PlyData.read(path)
-
-        xyz = np.stack((np.asarray(plydata.elements[0]["x"]),
-                        np.asarray(plydata.elements[0]["y"]),
-                        np.asarray(plydata.elements[0]["z"])),  axis=1)
-        opacities = np.asarray(plydata.elements[0]["opacity"])[..., np.newaxis]
-
-        features_dc = np.zeros((xyz.shape[0], 3, 1))
-        features_dc[:, 0, 0] = np.asarray(plydata.elements[0]["f_dc_0"])
-        features_dc[:, 1, 0] = np.asarray(plydata.elements[0]["f_dc_1"])
-        features_dc[:, 2, 0] = np.asarray(plydata.elements[0]["f_dc_2"])
-
-        extra_f_names = [p.name for p in plydata.elements[0].properties if p.name.startswith("f_rest_")]
-        extra_f_names = sorted(extra_f_names, key = lambda x: int(x.split('_')[-1]))
-        assert len(extra_f_names)==3*(self.max_sh_degree + 1) ** 2 - 3
-        features_extra = np.zeros((xyz.shape[0], len(extra_f_names)))
-        for idx, attr_name in enumerate(extra_f_names):
-            features_extra[:, idx] = np.asarray(plydata.elements[0][attr_name])
-        # Reshape (P,F*SH_coeffs) to (P, F, SH_coeffs except DC)
-        features_extra = features_extra.reshape((features_extra.shape[0], 3, (self.max_sh_degree + 1) ** 2 - 1))
-
-        scale_names = [p.name for p in plydata.elements[0].properties if p.name.startswith("scale_")]
-        scale_names = sorted(scale_names, key = lambda x: int(x.split('_')[-1]))
-        scales = np.zeros((xyz.shape[0], len(scale_names)))
-        for idx, attr_name in enumerate(scale_names):
-            scales[:, idx] = np.asarray(plydata.elements[0][attr_name])
-
-        rot_names = [p.name for p in plydata.elements[0].properties if p.name.startswith("rot")]
-        rot_names = sorted(rot_names, key = lambda x: int(x.split('_')[-1]))
-        rots = np.zeros((xyz.shape[0], len(rot_names)))
-        for idx, attr_name in enumerate(rot_names):
-            rots[:, idx] = np.asarray(plydata.elements[0][attr_name])
-
-        self._xyz = nn.Parameter(torch.tensor(xyz, dtype=torch.float, device="cuda").requires_grad_(True))
-        self._features_dc = nn.Parameter(torch.tensor(features_dc, dtype=torch.float, device="cuda").transpose(1, 2).contiguous().requires_grad_(True))
-        self._features_rest = nn.Parameter(torch.tensor(features_extra, dtype=torch.float, device="cuda").transpose(1, 2).contiguous().requires_grad_(True))
-        self._opacity = nn.Parameter(torch.tensor(opacities, dtype=torch.float, device="cuda").requires_grad_(True))
-        self._scaling = nn.Parameter(torch.tensor(scales, dtype=torch.float, device="cuda").requires_grad_(True))
-        self._rotation = nn.Parameter(torch.tensor(rots, dtype=torch.float, device="cuda").requires_grad_(True))
+        ply = read_float_ply(path)
+        if ply is None:
+            # Not a plain binary float PLY, let plyfile decode it
+            plydata = PlyData.read(path)
+            names = [p.name for p in plydata.elements[0].properties]
+            data = np.stack([np.asarray(plydata.elements[0][name], dtype=np.float32) for name in names], axis=1)
+        else:
+            names, data = ply
+        self.load_vertex_attributes(names, data)
+
+    def load_quantized(self, path):
+        self.load_vertex_attributes(*read_quantized(path))
+
+    def load_vertex_attributes(self, names, data):
+        columns = {name: idx for idx, name in enumerate(names)}
+        data = torch.from_numpy(data).to(get_device())
+
+        def gather(prefix):
+            selected = [name for name in names if name.startswith(prefix)]
+            selected = sorted(selected, key = lambda x: int(x.split('_')[-1]))
+            return data[:, [columns[name] for name in selected]]
+
+        xyz = data[:, [columns["x"], columns["y"], columns["z"]]]
+        opacities = data[:, [columns["opacity"]]]
+        features_dc = data[:, [columns["f_dc_0"], columns["f_dc_1"], columns["f_dc_2"]]]
+        features_extra = gather("f_rest_")
+        assert features_extra.shape[1]==3*(self.max_sh_degree + 1) ** 2 - 3
+        scales = gather("scale_")
+        rots = gather("rot")
+
+        # Reshape (P,F*SH_coeffs) to (P, SH_coeffs, F)
+        features_dc = features_dc.reshape(-1, 3, 1).transpose(1, 2).contiguous()
+        features_extra = features_extra.reshape(-1, 3, (self.max_sh_degree + 1) ** 2 - 1).transpose(1, 2).contiguous()
+
+        self._xyz = nn.Parameter(xyz.requires_grad_(True))
+        self._features_dc = nn.Parameter(features_dc.requires_grad_(True))
+        self._features_rest = nn.Parameter(features_extra.requires_grad_(True))
+        self._opacity = nn.Parameter(opacities.requires_grad_(True))
+        self._scaling = nn.Parameter(scales.requires_grad_(True))
+        self._rotation = nn.Parameter(rots.requires_grad_(True))
 
         self.active_sh_degree = self.max_sh_degree
 
+    def set_optimizable_tensors(self, optimizable_tensors):
+        self._xyz = optimizable_tensors.get("xyz", self._xyz)
+        self._features_dc = optimizable_tensors.get("f_dc", self._features_dc)
+        self._features_rest = optimizable_tensors.get("f_rest", self._features_rest)
+        self._opacity = optimizable_tensors.get("opacity", self._opacity)
+        self._scaling = optimizable_tensors.get("scaling", self._scaling)
+        self._rotation = optimizable_tensors.get("rotation", self._rotation)
+
     def replace_tensor_to_optimizer(self, tensor, name):
+        if isinstance(self.optimizer, GaussianAdam):
+            return self.optimizer.replace(tensor, name)
         optimizable_tensors = {}
         for group in self.optimizer.param_groups:
             if group["name"] == name:
@@ -290,7 +383,11 @@ class GaussianModel:
 
     def prune_points(self, mask):
         valid_points_mask = ~mask
-        optimizable_tensors = self._prune_optimizer(valid_points_mask)
+        if isinstance(self.optimizer, GaussianAdam):
+            # keep is None when the pruned Gaussians were only put on the storage free list
+            optimizable_tensors, keep = self.optimizer.prune(valid_points_mask)
+        else:
+            optimizable_tensors, keep = self._prune_optimizer(valid_points_mask), valid_points_mask
 
         self._xyz = optimizable_tensors["xyz"]
         self._features_dc = optimizable_tensors["f_dc"]
@@ -299,12 +396,18 @@ class GaussianModel:
         self._scaling = optimizable_tensors["scaling"]
         self._rotation = optimizable_tensors["rotation"]
 
-        self.xyz_gradient_accum = self.xyz_gradient_accum[valid_points_mask]
-
-        self.denom = self.denom[valid_points_mask]
-        self.max_radii2D = self.max_radii2D[valid_points_mask]
+        if keep is None:
+            self.xyz_gradient_accum[mask] = 0
+            self.denom[mask] = 0
+            self.max_radii2D[mask] = 0
+        else:
+            self.xyz_gradient_accum = self.xyz_gradient_accum[keep]
+            self.denom = self.denom[keep]
+            self.max_radii2D = self.max_radii2D[keep]
 
     def cat_tensors_to_optimizer(self, tensors_dict):
+        if isinstance(self.optimizer, GaussianAdam):
+            return self.optimizer.append(tensors_dict)
         optimizable_tensors = {}
         for group in self.optimizer.param_groups:
             assert len(group["params"]) == 1
@@ -342,21 +445,21 @@ class GaussianModel:
         self._scaling = optimizable_tensors["scaling"]
         self._rotation = optimizable_tensors["rotation"]
 
-        self.xyz_gradient_accum = torch.zeros((self.get_xyz.shape[0], 1), device="cuda")
-        self.denom = torch.zeros((self.get_xyz.shape[0], 1), device="cuda")
-        self.max_radii2D = torch.zeros((self.get_xyz.shape[0]), device="cuda")
+        self.xyz_gradient_accum = torch.zeros((self.get_xyz.shape[0], 1), device=get_device())
+        self.denom = torch.zeros((self.get_xyz.shape[0], 1), device=get_device())
+        self.max_radii2D = torch.zeros((self.get_xyz.shape[0]), device=get_device())
 
     def densify_and_split(self, grads, grad_threshold, scene_extent, N=2):
         n_init_points = self.get_xyz.shape[0]
         # Extract points that satisfy the gradient condition
-        padded_grad = torch.zeros((n_init_points), device="cuda")
+        padded_grad = torch.zeros((n_init_points), device=get_device())
         padded_grad[:grads.shape[0]] = grads.squeeze()
         selected_pts_mask = torch.where(padded_grad >= grad_threshold, True, False)
         selected_pts_mask = torch.logical_and(selected_pts_mask,
                                               torch.max(self.get_scaling, dim=1).values > self.percent_dense*scene_extent)
 
         stds = self.get_scaling[selected_pts_mask].repeat(N,1)
-        means =torch.zeros((stds.size(0), 3),device="cuda")
+        means =torch.zeros((stds.size(0), 3),device=get_device())
         samples = torch.normal(mean=means, std=stds)
         rots = build_rotation(self._rotation[selected_pts_mask]).repeat(N,1,1)
         new_xyz = torch.bmm(rots, samples.unsqueeze(-1)).squeeze(-1) + self.get_xyz[selected_pts_mask].repeat(N, 1)
@@ -366,11 +469,11 @@ class GaussianModel:
         new_features_rest = self._features_rest[selected_pts_mask].repeat(N,1,1)
         new_opacity = self._opacity[selected_pts_mask].repeat(N,1)
 
+        # Remove the split Gaussians before adding their children: growable storage puts the children
+        # into free slots (the freed parents first), so they do not necessarily end up at the tail
+        self.prune_points(selected_pts_mask)
         self.densification_postfix(new_xyz, new_features_dc, new_features_rest, new_opacity, new_scaling, new_rotation)
 
-        prune_filter = torch.cat((selected_pts_mask, torch.zeros(N * selected_pts_mask.sum(), device="cuda", dtype=bool)))
-        self.prune_points(prune_filter)
-
     def densify_and_clone(self, grads, grad_threshold, scene_extent):
         # Extract points that satisfy the gradient condition
         selected_pts_mask = torch.where(torch.norm(grads, dim=-1) >= grad_threshold, True, False)
@@ -14,6 +14,8 @@ import collections
 import struct
 import math
 import os
+import json
+import importlib
 from pyproj import Proj
 
 CameraModel = collections.namedtuple(
@@ -107,44 +109,148 @@ class Image(BaseImage):
     def qvec2rotmat(self):
         return qvec2rotmat(self.qvec)
 
-def read_opensfm_points3D(reconstructions):
-    xyzs = None
-    rgbs = None
-    errors = None
-    num_points = 0
-    for reconstruction in reconstructions:
-        num_points = num_points + len(reconstruction["points"])
+def _points_to_arrays(points, batch_size=1 << 20):
+    """
+    Collect OpenSfM point dicts into (N, 3) coordinate and color arrays.
 
-    xyzs = np.empty((num_points, 3))
-    rgbs = np.empty((num_points, 3))
-    errors = np.empty((num_points, 1))
-    count = 0
-    #reference_lat_0 = reconstructions[0]["reference_lla"]["latitude"]
-    #reference_lon_0 = reconstructions[0]["reference_lla"]["longitude"]
-    #reference_alt_0 = reconstructions[0]["reference_lla"]["altitude"]
-    #e2u_zone=int(divmod(reference_lon_0, 6)[0])+31
-    #e2u_conv=Proj(proj='utm', zone=e2u_zone, ellps='WGS84')
-    reference_x_0, reference_y_0 = 0 , 0 
-    reference_alt_0  = 0
-    for reconstruction in reconstructions:
-        #reference_lat = reconstruction["reference_lla"]["latitude"]
-        #reference_lon = reconstruction["reference_lla"]["longitude"]
-        #reference_alt = reconstruction["reference_lla"]["altitude"]
-        reference_x, reference_y = 0 , 0
-        reference_alt = 0
-        for i in (reconstruction["points"]):
-            color = (reconstruction["points"][i]["color"])
-            coordinates = (reconstruction["points"][i]["coordinates"])
-            xyz = np.array([coordinates[0] + reference_x - reference_x_0, coordinates[1] + reference_y - reference_y_0, coordinates[2] - reference_alt + reference_alt_0])
-            rgb = np.array([color[0], color[1], color[2]])
-            error = np.array(0)
-            xyzs[count] = xyz
-            rgbs[count] = rgb
-            errors[count] = error
-            count += 1
+    Points are gathered in fixed-size batches and converted with a single
+    np.array call per batch, so there is no per-point numpy allocation and the
+    source can be a stream of unknown length.
+    """
+    xyz_batches = []
+    rgb_batches = []
+    coordinates = []
+    colors = []
+    for point in points:
+        coordinates.append(point["coordinates"])
+        colors.append(point["color"])
+        if len(coordinates) == batch_size:
+            xyz_batches.append(np.array(coordinates, dtype=np.float64).reshape(-1, 3))
+            rgb_batches.append(np.array(colors, dtype=np.float64).reshape(-1, 3))
+            coordinates = []
+            colors = []
+    xyz_batches.append(np.array(coordinates, dtype=np.float64).reshape(-1, 3))
+    rgb_batches.append(np.array(colors, dtype=np.float64).reshape(-1, 3))
 
+    xyzs = np.concatenate(xyz_batches)
+    rgbs = np.concatenate(rgb_batches)
+    errors = np.zeros((xyzs.shape[0], 1))
     return xyzs, rgbs, errors
 
+def read_opensfm_points3D(reconstructions):
+    # Reference (lla -> utm) offsets between reconstructions are disabled, all
+    # points are expressed in the frame of the first reconstruction.
+    points = (point for reconstruction in reconstructions for point in reconstruction["points"].values())
+    return _points_to_arrays(points)
+
+def _build_value(events):
+    """ The next JSON value of an ijson event stream, as Python objects. """
+    import ijson
+    builder = ijson.ObjectBuilder()
+    depth = 0
+    for _, event, value in events:
+        builder.event(event, value)
+        if event in ("start_map", "start_array"):
+            depth += 1
+        elif event in ("end_map", "end_array"):
+            depth -= 1
+        if depth == 0:
+            return builder.value
+
+def _stream_points(events, batch_size=1 << 20):
+    """
+    Coordinate and color arrays of the "points" map an ijson event stream has
+    just entered. Numbers go straight into flat lists, converted to arrays in
+    batches, so no per-point dict is built.
+    """
+    xyz_batches = []
+    rgb_batches = []
+    coordinates = []
+    colors = []
+    for prefix, event, value in events:
+        if event == "number":
+            if prefix.endswith(".coordinates.item"):
+                coordinates.append(value)
+            elif prefix.endswith(".color.item"):
+                colors.append(value)
+        elif event == "end_map":
+            if prefix == "item.points":
+                break
+            if len(coordinates) >= 3 * batch_size:
+                xyz_batches.append(np.array(coordinates, dtype=np.float64).reshape(-1, 3))
+                rgb_batches.append(np.array(colors, dtype=np.float64).reshape(-1, 3))
+                coordinates = []
+                colors = []
+    xyz_batches.append(np.array(coordinates, dtype=np.float64).reshape(-1, 3))
+    rgb_batches.append(np.array(colors, dtype=np.float64).reshape(-1, 3))
+    return np.concatenate(xyz_batches), np.concatenate(rgb_batches)
+
+def _stream_reconstructions(f):
+    """ Reconstructions (without points) and point arrays of a reconstruction.json file, in a single ijson pass. """
+    import ijson
+    reconstructions = []
+    xyz_parts = [np.zeros((0, 3))]
+    rgb_parts = [np.zeros((0, 3))]
+    events = ijson.parse(f, use_float=True)
+    for prefix, event, value in events:
+        if prefix != "item":
+            continue
+        if event == "start_map":
+            reconstruction = {}
+        elif event == "map_key":
+            if value == "points":
+                xyz, rgb = _stream_points(events)
+                xyz_parts.append(xyz)
+                rgb_parts.append(rgb)
+            else:
+                reconstruction[value] = _build_value(events)
+        elif event == "end_map":
+            reconstructions.append(reconstruction)
+    xyzs = np.concatenate(xyz_parts)
+    rgbs = np.concatenate(rgb_parts)
+    return reconstructions, (xyzs, rgbs, np.zeros((xyzs.shape[0], 1)))
+
+def load_opensfm_reconstruction(path, backend="auto"):
+    """
+    Parse an OpenSfM reconstruction.json file.
+
+    Returns the list of reconstructions (with their "cameras" and "shots") and
+    the (xyzs, rgbs, errors) point arrays, equal to what read_opensfm_points3D
+    gives for the same file.
+    "orjson" and "json" load the whole document, orjson being several times
+    faster; "auto" uses orjson when it is installed and json otherwise.
+    "ijson" streams the file in one pass and puts points straight into
+    arrays, so the full point dictionary is never held in memory. With
+    ijson's pure-Python backend it is several times slower, so it is only
+    used when asked for, for reconstructions too large to load at once.
+    """
+    if backend == "auto":
+        try:
+            importlib.import_module("orjson")
+            backend = "orjson"
+        except ImportError:
+            backend = "json"
+
+    if backend == "ijson":
+        with open(path, "rb") as f:
+            return _stream_reconstructions(f)
+
+    if backend == "orjson":
+        import orjson
+        with open(path, "rb") as f:
+            reconstructions = orjson.loads(f.read())
+    elif backend == "json":
+        with open(path) as f:
+            reconstructions = json.load(f)
+    else:
+        raise ValueError("Unknown JSON backend {}, choose from [auto, ijson, orjson, json]".format(backend))
+
+    points = read_opensfm_points3D(reconstructions)
+    for reconstruction in reconstructions:
+        # Points now live in the arrays, release the per-point dicts
+        reconstruction.pop("points", None)
+    return reconstructions, points
+
 def read_opensfm_intrinsics_split(reconstructions):
     """
     Taken from https://github.com/colmap/colmap/blob/dev/scripts/python/read_write_model.py
@@ -4,13 +4,14 @@ import os
 from tqdm import tqdm
 from os import makedirs
 from gaussian_renderer import render, render_spherical
-import torchvision
-from utils.general_utils import safe_state
+from utils.general_utils import safe_state, get_device
 from argparse import ArgumentParser
 from arguments import ModelParams, PipelineParams, get_combined_args
 from gaussian_renderer import GaussianModel
+from utils.lod_utils import GaussianHierarchy
+from utils.async_writer import ImageWriter
 
-def render_set(model_path, name, iteration, views, gaussians, pipeline, background):
+def render_set(model_path, name, iteration, views, gaussians, pipeline, background, writer, hierarchy=None, lod_threshold=0.0, skip_existing_gt=False):
     render_path = os.path.join(model_path, name, "ours_{}".format(iteration), "renders")
     gts_path = os.path.join(model_path, name, "ours_{}".format(iteration), "gt")
 
@@ -18,24 +19,30 @@ def render_set(model_path, name, iteration, views, gaussians, pipeline, backgrou
     makedirs(gts_path, exist_ok=True)
 
     for idx, view in enumerate(tqdm(views, desc="Rendering progress")):
-        rendering = render_spherical(view, gaussians, pipeline, background)["render"]
-        gt = view.original_image[0:3, :, :]
-        torchvision.utils.save_image(rendering, os.path.join(render_path, '{0:05d}'.format(idx) + ".png"))
-        torchvision.utils.save_image(gt, os.path.join(gts_path, '{0:05d}'.format(idx) + ".png"))
+        # With a hierarchy, each view renders its own level-of-detail cut of the model
+        view_gaussians = hierarchy.cut(view, lod_threshold, spherical=True) if hierarchy is not None else gaussians
+        rendering = render_spherical(view, view_gaussians, pipeline, background)["render"]
+        # Encoding and writing happen on the writer's threads while the next view renders
+        writer.save(rendering, os.path.join(render_path, '{0:05d}'.format(idx)))
+        gt_stem = os.path.join(gts_path, '{0:05d}'.format(idx))
+        # Checked before touching original_image, which decodes the image in lazy mode
+        if not (skip_existing_gt and os.path.exists(writer.path(gt_stem))):
+            writer.save(view.original_image[0:3, :, :], gt_stem)
 
-def render_sets(dataset : ModelParams, iteration : int, pipeline : PipelineParams, skip_train : bool, skip_test : bool):
+def render_sets(dataset : ModelParams, iteration : int, pipeline : PipelineParams, skip_train : bool, skip_test : bool, lod_threshold : float, writer : ImageWriter, skip_existing_gt : bool):
     with torch.no_grad():
         gaussians = GaussianModel(dataset.sh_degree)
         scene = Scene(dataset, gaussians, load_iteration=iteration, shuffle=False, panorama=True)
 
         bg_color = [1,1,1] if dataset.white_background else [0, 0, 0]
-        background = torch.tensor(bg_color, dtype=torch.float32, device="cuda")
+        background = torch.tensor(bg_color, dtype=torch.float32, device=get_device())
+        hierarchy = GaussianHierarchy(gaussians) if lod_threshold > 0 else None
 
         if not skip_train:
-             render_set(dataset.model_path, "train", scene.loaded_iter, scene.getTrainCameras(), gaussians, pipeline, background)
+             render_set(dataset.model_path, "train", scene.loaded_iter, scene.getTrainCameras(), gaussians, pipeline, background, writer, hierarchy, lod_threshold, skip_existing_gt)
 
         if not skip_test:
-             render_set(dataset.model_path, "test", scene.loaded_iter, scene.getTestCameras(), gaussians, pipeline, background)
+             render_set(dataset.model_path, "test", scene.loaded_iter, scene.getTestCameras(), gaussians, pipeline, background, writer, hierarchy, lod_threshold, skip_existing_gt)
 
 if __name__ == "__main__":
     # Set up command line argument parser
@@ -46,11 +53,18 @@ if __name__ == "__main__":
     parser.add_argument("--skip_train", action="store_true")
     parser.add_argument("--skip_test", action="store_true")
     parser.add_argument("--quiet", action="store_true")
+    parser.add_argument("--lod_threshold", default=0.0, type=float)
+    parser.add_argument("--image_format", default="png", choices=ImageWriter.formats)
+    parser.add_argument("--writer_workers", default=-1, type=int)
+    parser.add_argument("--png_compression", default=6, type=int)
+    parser.add_argument("--skip_existing_gt", action="store_true")
     args = get_combined_args(parser)
     print("Rendering " + args.model_path)
 
     # Initialize system state (RNG)
     safe_state(args.quiet)
 
-    render_sets(model.extract(args), args.iteration, pipeline.extract(args), args.skip_train, args.skip_test)
+    writer = ImageWriter(args.image_format, args.writer_workers, png_compression=args.png_compression)
+    render_sets(model.extract(args), args.iteration, pipeline.extract(args), args.skip_train, args.skip_test, args.lod_threshold, writer, args.skip_existing_gt)
+    writer.close()
 
@@ -0,0 +1,129 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import time
+import torch
+import torch.nn.functional as F
+from math import exp
+from argparse import ArgumentParser
+from utils.loss_utils import ssim, latitude_weight
+
+# Largest (value, relative gradient) differences to the reference accepted by check_equivalence
+FLOAT_TOLERANCE = (1e-5, 1e-3)
+HALF_TOLERANCE = (5e-4, 5e-2)
+
+def ssim_reference(img1, img2, window_size=11, size_average=True, weights=None):
+    # Full 2D window rebuilt on every call, as ssim() did before it was made separable
+    channel = img1.size(-3)
+    gauss = torch.Tensor([exp(-(x - window_size // 2) ** 2 / float(2 * 1.5 ** 2)) for x in range(window_size)])
+    gauss = (gauss / gauss.sum()).unsqueeze(1)
+    window = gauss.mm(gauss.t()).float().unsqueeze(0).unsqueeze(0).expand(channel, 1, window_size, window_size).contiguous()
+    window = window.to(img1.device).type_as(img1)
+    if weights is None:
+        weights = torch.ones_like(img1)
+    img1 = img1 * weights
+    img2 = img2 * weights
+
+    mu1 = F.conv2d(img1, window, padding=window_size // 2, groups=channel)
+    mu2 = F.conv2d(img2, window, padding=window_size // 2, groups=channel)
+    mu1_sq, mu2_sq, mu1_mu2 = mu1.pow(2), mu2.pow(2), mu1 * mu2
+    sigma1_sq = F.conv2d(img1 * img1, window, padding=window_size // 2, groups=channel) - mu1_sq
+    sigma2_sq = F.conv2d(img2 * img2, window, padding=window_size // 2, groups=channel) - mu2_sq
+    sigma12 = F.conv2d(img1 * img2, window, padding=window_size // 2, groups=channel) - mu1_mu2
+    C1, C2 = 0.01 ** 2, 0.03 ** 2
+    ssim_map = ((2 * mu1_mu2 + C1) * (2 * sigma12 + C2)) / ((mu1_sq + mu2_sq + C1) * (sigma1_sq + sigma2_sq + C2))
+    return ssim_map.mean() if size_average else ssim_map.mean(1).mean(1).mean(1)
+
+def value_and_grad(fn, img1, img2, **kwargs):
+    img1 = img1.clone().requires_grad_(True)
+    value = fn(img1, img2, **kwargs)
+    value.sum().backward()
+    return value.detach(), img1.grad
+
+def check_equivalence(device, height, width):
+    """
+    Largest value and gradient differences to the reference over the input
+    layouts used in the repo, in float32 and with half=True. Raises when one
+    is out of tolerance.
+    """
+    torch.manual_seed(0)
+    img1 = torch.rand(3, height, width, device=device)
+    img2 = (img1 + 0.1 * torch.randn_like(img1)).clamp(0, 1)
+    batch1 = torch.rand(4, 3, height // 2, width // 2, device=device)
+    batch2 = torch.rand_like(batch1)
+    weights = latitude_weight(height).to(device)
+    # Bright, low-variance content is where float16 moments are most prone to cancellation
+    bright1 = (0.9 + 0.01 * torch.randn(3, height, width, device=device)).clamp(0, 1)
+    bright2 = (bright1 + 0.005 * torch.randn_like(bright1)).clamp(0, 1)
+    patch1 = 0.2 * torch.rand(3, height, width, device=device)
+    patch1[:, height // 4:3 * height // 4, width // 4:3 * width // 4] = bright1[:, :height // 2, :width // 2]
+    patch2 = (patch1 + 0.005 * torch.randn_like(patch1)).clamp(0, 1)
+    cases = [
+        ("image", (img1, img2), {}),
+        ("latitude weighted", (img1, img2), {"weights": weights}),
+        ("batch per image", (batch1, batch2), {"size_average": False}),
+        ("bright", (bright1, bright2), {}),
+        ("image", (img1, img2), {"half": True}),
+        ("latitude weighted", (img1, img2), {"weights": weights, "half": True}),
+        ("batch per image", (batch1, batch2), {"size_average": False, "half": True}),
+        ("bright", (bright1, bright2), {"half": True}),
+        ("bright patch", (patch1, patch2), {"half": True}),
+    ]
+    failures = []
+    for case, (x, y), kwargs in cases:
+        half = kwargs.pop("half", False)
+        ref_value, ref_grad = value_and_grad(ssim_reference, x, y, **kwargs)
+        value, grad = value_and_grad(ssim, x, y, half=half, **kwargs)
+        value_error = (value - ref_value).abs().max().item()
+        grad_error = ((grad - ref_grad).abs().max() / ref_grad.abs().max()).item()
+        value_tolerance, grad_tolerance = HALF_TOLERANCE if half else FLOAT_TOLERANCE
+        name = "{} ({})".format(case, "half" if half else "float32")
+        print("  {:<30} value {:.2e}  grad {:.2e} (relative)".format(name, value_error, grad_error))
+        if value_error > value_tolerance or grad_error > grad_tolerance:
+            failures.append(name)
+    if failures:
+        raise AssertionError("ssim differs from the reference beyond tolerance: " + ", ".join(failures))
+
+def timed(fn, img1, img2, repeats, **kwargs):
+    img1 = img1.clone().requires_grad_(True)
+    for _ in range(2):
+        fn(img1, img2, **kwargs).backward()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn(img1, img2, **kwargs).backward()
+    if img1.is_cuda:
+        torch.cuda.synchronize()
+    return (time.perf_counter() - start) / repeats
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="SSIM micro-benchmark")
+    parser.add_argument("--device", type=str, default="cpu")
+    parser.add_argument("--height", type=int, default=512)
+    parser.add_argument("--width", type=int, default=1024)
+    parser.add_argument("--repeats", type=int, default=10)
+    parser.add_argument("--threads", type=int, default=0, help="torch CPU threads, 0 keeps the default")
+    args = parser.parse_args()
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+
+    print("Max abs difference to the 2D-window reference:")
+    check_equivalence(args.device, 128, 256)
+
+    img1 = torch.rand(3, args.height, args.width, device=args.device)
+    img2 = torch.rand_like(img1)
+    weights = latitude_weight(args.height).to(args.device)
+    variants = [("reference", ssim_reference, {}), ("ssim", ssim, {}), ("ssim half", ssim, {"half": True})]
+    print("Forward + backward, 3x{}x{} latitude weighted:".format(args.height, args.width))
+    for name, fn, kwargs in variants:
+        elapsed = timed(fn, img1, img2, args.repeats, weights=weights, **kwargs)
+        print("  {:<10} {:8.2f} ms".format(name, elapsed * 1000))
+    value = ssim(img1, img2, weights=weights, half=True).item()
+    print("  half value error: {:.2e}".format(abs(value - ssim_reference(img1, img2, weights=weights).item())))
@@ -12,11 +12,13 @@
 import os
 import torch
 from random import randint
-from utils.loss_utils import l1_loss, ssim, latitude_weight
+from utils.loss_utils import l1_loss, ssim
 from gaussian_renderer import render, render_panorama, render_spherical, network_gui
 import sys
 from scene import Scene, GaussianModel
-from utils.general_utils import safe_state
+from utils.general_utils import safe_state, get_resolution_schedule
+from utils.async_writer import AsyncWriter, save_checkpoint
+from utils.profile_utils import StageProfiler
 import uuid
 from tqdm import tqdm
 from utils.image_utils import psnr
@@ -28,7 +30,7 @@ try:
 except ImportError:
     TENSORBOARD_FOUND = False
 
-def training(dataset, opt, pipe, testing_iterations, saving_iterations, checkpoint_iterations, checkpoint, debug_from, panorama, output):
+def training(dataset, opt, pipe, testing_iterations, saving_iterations, checkpoint_iterations, checkpoint, debug_from, panorama, output, async_save=False, checkpoint_keep=0, profile=False, profile_window=100, profile_trace=False):
     first_iter = 0
     tb_writer = prepare_output_and_logger(dataset , output)
     gaussians = GaussianModel(dataset.sh_degree)
@@ -41,28 +43,27 @@ def training(dataset, opt, pipe, testing_iterations, saving_iterations, checkpoi
     bg_color = [1, 1, 1] if dataset.white_background else [0, 0, 0]
     background = torch.tensor(bg_color, dtype=torch.float32, device="cuda")
 
+    # Snapshots are copied to host memory and written in the background, so training does not wait on the disk
+    writer = AsyncWriter(max_pending=2) if async_save else None
+
+    # Opt-in per-stage timings, reported to TensorBoard and timings.jsonl
+    profiler = StageProfiler(profile, profile_window, os.path.join(scene.model_path, "timings.jsonl"), tb_writer,
+                             os.path.join(scene.model_path, "profile") if profile_trace else None)
+
     iter_start = torch.cuda.Event(enable_timing = True)
     iter_end = torch.cuda.Event(enable_timing = True)
 
+    # Coarse-to-fine: early iterations train on downscaled copies of the cameras
+    resolution_schedule = get_resolution_schedule(opt.resolution_schedule)
+    resolution_scale = None
+
     viewpoint_stack = None
     ema_loss_for_log = 0.0
     progress_bar = tqdm(range(first_iter, opt.iterations), desc="Training progress")
     first_iter += 1
     for iteration in range(first_iter, opt.iterations + 1):        
-        if network_gui.conn == None:
-            network_gui.try_connect()
-        while network_gui.conn != None:
-            try:
-                net_image_bytes = None
-                custom_cam, do_training, pipe.convert_SHs_python, pipe.compute_cov3D_python, keep_alive, scaling_modifer = network_gui.receive()
-                if custom_cam != None:
-                    net_image = render(custom_cam, gaussians, pipe, background, scaling_modifer)["render"]
-                    net_image_bytes = memoryview((torch.clamp(net_image, min=0, max=1.0) * 255).byte().permute(1, 2, 0).contiguous().cpu().numpy())
-                network_gui.send(net_image_bytes, dataset.source_path)
-                if do_training and ((iteration < int(opt.iterations)) or not keep_alive):
-                    break
-            except Exception as e:
-                network_gui.conn = None
+        # The viewer renders from its own thread, it only needs a snapshot now and then (or blocks here when paused)
+        network_gui.serve(gaussians, pipe, background, dataset.source_path, last_iteration=iteration == int(opt.iterations))
 
         iter_start.record()
 
@@ -72,36 +73,43 @@ def training(dataset, opt, pipe, testing_iterations, saving_iterations, checkpoi
         if iteration % 1000 == 0:
             gaussians.oneupSHdegree()
 
-        # Pick a random Camera
-        if not viewpoint_stack:
-            viewpoint_stack = scene.getTrainCameras().copy()
-        viewpoint_cam = viewpoint_stack.pop(randint(0, len(viewpoint_stack)-1))
-        weights = latitude_weight(viewpoint_cam.image_height).to("cuda")
+        with profiler.span("data"):
+            # Start a new pass over the cameras whenever the training resolution changes
+            if resolution_schedule(iteration) != resolution_scale:
+                resolution_scale = resolution_schedule(iteration)
+                viewpoint_stack = None
+
+            # Pick a random Camera
+            if not viewpoint_stack:
+                viewpoint_stack = scene.getTrainCameras(resolution_scale).copy()
+                # Draw the whole pass up front (same random sequence as popping one at a time)
+                # so the upcoming cameras are known and their images can be prefetched
+                viewpoint_stack = [viewpoint_stack.pop(randint(0, len(viewpoint_stack)-1)) for _ in range(len(viewpoint_stack))][::-1]
+            viewpoint_cam = viewpoint_stack.pop()
+            scene.prefetch(reversed(viewpoint_stack[-dataset.prefetch_depth:]) if dataset.prefetch_depth > 0 else [])
+
+            gt_image = viewpoint_cam.original_image.cuda()
+            # Latitude weights for panoramas, zero on masked pixels, None when uniform
+            weights = scene.weight_maps.get(viewpoint_cam, gt_image.device, viewpoint_cam.is_masked)
 
         # Render
         if (iteration - 1) == debug_from:
             pipe.debug = True
 
-        bg = torch.rand((3), device="cuda") if opt.random_background else background
-        if viewpoint_cam.panorama:
-            render_pkg = render_spherical(viewpoint_cam, gaussians, pipe, bg)
-        else:
-            render_pkg = render(viewpoint_cam, gaussians, pipe, bg)
-        image, viewspace_point_tensor, visibility_filter, radii = render_pkg["render"], render_pkg["viewspace_points"], render_pkg["visibility_filter"], render_pkg["radii"]
+        with profiler.span("render"):
+            bg = torch.rand((3), device="cuda") if opt.random_background else background
+            if viewpoint_cam.panorama:
+                render_pkg = render_spherical(viewpoint_cam, gaussians, pipe, bg)
+            else:
+                render_pkg = render(viewpoint_cam, gaussians, pipe, bg)
+            image, viewspace_point_tensor, visibility_filter, radii = render_pkg["render"], render_pkg["viewspace_points"], render_pkg["visibility_filter"], render_pkg["radii"]
  
         # Loss
-        gt_image = viewpoint_cam.original_image.cuda()
-        mask = viewpoint_cam.is_masked
-        if mask is not None:
-            mask = mask.cuda()
-            gt_image[mask] = image.detach()[mask]
-        if viewpoint_cam.panorama:
+        with profiler.span("loss"):
             Ll1 = l1_loss(image, gt_image, weights=weights)
-            loss = (1.0 - opt.lambda_dssim) * Ll1 + opt.lambda_dssim * (1.0 - ssim(image, gt_image, weights=weights))
-        else:
-            Ll1 = l1_loss(image, gt_image)
-            loss = (1.0 - opt.lambda_dssim) * Ll1 + opt.lambda_dssim * (1.0 - ssim(image, gt_image))
-        loss.backward()
+            loss = (1.0 - opt.lambda_dssim) * Ll1 + opt.lambda_dssim * (1.0 - ssim(image, gt_image, weights=weights, half=opt.ssim_half))
+        with profiler.span("backward"):
+            loss.backward()
 
         iter_end.record()
 
@@ -114,32 +122,50 @@ def training(dataset, opt, pipe, testing_iterations, saving_iterations, checkpoi
             if iteration == opt.iterations:
                 progress_bar.close()
 
-            training_report(tb_writer, iteration, Ll1, loss, l1_loss, iter_start.elapsed_time(iter_end), testing_iterations, scene, render, render_spherical, (pipe, background))
-            if (iteration in saving_iterations):
-                print("\n[ITER {}] Saving Gaussians".format(iteration))
-                scene.save(iteration)
+            with profiler.span("report"):
+                training_report(tb_writer, iteration, Ll1, loss, l1_loss, iter_start.elapsed_time(iter_end), testing_iterations, scene, render, render_spherical, (pipe, background))
+                if (iteration in saving_iterations):
+                    print("\n[ITER {}] Saving Gaussians".format(iteration))
+                    scene.save(iteration, writer)
 
             # Densification
             if iteration < opt.densify_until_iter:
-                # Keep track of max radii in image-space for pruning
-                gaussians.max_radii2D[visibility_filter] = torch.max(gaussians.max_radii2D[visibility_filter], radii[visibility_filter])
-                gaussians.add_densification_stats(viewspace_point_tensor, visibility_filter)
+                with profiler.span("densify"):
+                    # Keep track of max radii in image-space for pruning, in full resolution pixels so the
+                    # screen size threshold means the same at every scale. Positional gradients are taken
+                    # in normalized device coordinates and need no rescaling.
+                    gaussians.max_radii2D[visibility_filter] = torch.max(gaussians.max_radii2D[visibility_filter], radii[visibility_filter] * resolution_scale)
+                    gaussians.add_densification_stats(viewspace_point_tensor, visibility_filter)
 
-                if iteration > opt.densify_from_iter and iteration % opt.densification_interval == 0:
-                    size_threshold = 20 if iteration > opt.opacity_reset_interval else None
-                    gaussians.densify_and_prune(opt.densify_grad_threshold, 0.005, scene.cameras_extent, size_threshold)
+                    if iteration > opt.densify_from_iter and iteration % opt.densification_interval == 0:
+                        size_threshold = 20 if iteration > opt.opacity_reset_interval else None
+                        gaussians.densify_and_prune(opt.densify_grad_threshold, 0.005, scene.cameras_extent, size_threshold)
                 
-                if iteration % opt.opacity_reset_interval == 0 or (dataset.white_background and iteration == opt.densify_from_iter):
-                    gaussians.reset_opacity()
+                    if iteration % opt.opacity_reset_interval == 0 or (dataset.white_background and iteration == opt.densify_from_iter):
+                        gaussians.reset_opacity()
 
             # Optimizer step
             if iteration < opt.iterations:
-                gaussians.optimizer.step()
-                gaussians.optimizer.zero_grad(set_to_none = True)
+                with profiler.span("optimizer"):
+                    if opt.optimizer_type == "sparse":
+                        gaussians.optimizer.step(visibility_filter)
+                    else:
+                        gaussians.optimizer.step()
+                    gaussians.optimizer.zero_grad(set_to_none = True)
 
             if (iteration in checkpoint_iterations):
                 print("\n[ITER {}] Saving Checkpoint".format(iteration))
-                torch.save((gaussians.capture(), iteration), scene.model_path + "/chkpnt" + str(iteration) + ".pth")
+                checkpoint_path = scene.model_path + "/chkpnt" + str(iteration) + ".pth"
+                if writer is None:
+                    save_checkpoint((gaussians.capture(), iteration), checkpoint_path, checkpoint_keep)
+                else:
+                    writer.submit(save_checkpoint, writer.snapshot((gaussians.capture(), iteration)), checkpoint_path, checkpoint_keep)
+
+        profiler.step(iteration)
+
+    profiler.close(opt.iterations)
+    if writer is not None:
+        writer.close()
 
 def prepare_output_and_logger(args , output):    
     if not args.model_path:
@@ -200,7 +226,7 @@ def training_report(tb_writer, iteration, Ll1, loss, l1_loss, elapsed, testing_i
 
         if tb_writer:
             tb_writer.add_histogram("scene/opacity_histogram", scene.gaussians.get_opacity, iteration)
-            tb_writer.add_scalar('total_points', scene.gaussians.get_xyz.shape[0], iteration)
+            tb_writer.add_scalar('total_points', scene.gaussians.num_points, iteration)
         torch.cuda.empty_cache()
 
 if __name__ == "__main__":
@@ -212,6 +238,7 @@ if __name__ == "__main__":
     pp = PipelineParams(parser)
     parser.add_argument('--ip', type=str, default="127.0.0.1")
     parser.add_argument('--port', type=int, default=6009)
+    parser.add_argument('--viewer_fps', type=int, default=30)
     parser.add_argument('--debug_from', type=int, default=-1)
     parser.add_argument('--detect_anomaly', action='store_true', default=False)
     parser.add_argument("--test_iterations", nargs="+", type=int, default=[10_000, 20_000, 30_000])
@@ -220,6 +247,11 @@ if __name__ == "__main__":
     parser.add_argument("--panorama", action="store_true")
     parser.add_argument("--checkpoint_iterations", nargs="+", type=int, default=[10_000, 20_000, 30_000])
     parser.add_argument("--start_checkpoint", type=str, default = None)
+    parser.add_argument("--async_save", action="store_true")
+    parser.add_argument("--checkpoint_keep", type=int, default=0)
+    parser.add_argument("--profile", action="store_true")
+    parser.add_argument("--profile_window", type=int, default=100)
+    parser.add_argument("--profile_trace", action="store_true")
     parser.add_argument("--output",type=Path)
     args = parser.parse_args(sys.argv[1:])
     args.save_iterations.append(args.iterations)
@@ -230,9 +262,9 @@ if __name__ == "__main__":
     safe_state(args.quiet)
 
     # Start GUI server, configure and run training
-    network_gui.init(args.ip, args.port)
+    network_gui.init(args.ip, args.port, args.viewer_fps)
     torch.autograd.set_detect_anomaly(args.detect_anomaly)
-    training(lp.extract(args), op.extract(args), pp.extract(args), args.test_iterations, args.save_iterations, args.checkpoint_iterations, args.start_checkpoint, args.debug_from, args.panorama,args.output)
+    training(lp.extract(args), op.extract(args), pp.extract(args), args.test_iterations, args.save_iterations, args.checkpoint_iterations, args.start_checkpoint, args.debug_from, args.panorama,args.output, args.async_save, args.checkpoint_keep, args.profile, args.profile_window, args.profile_trace)
 
     # All done
     print("\nTraining complete.")
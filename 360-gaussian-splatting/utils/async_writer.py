@@ -0,0 +1,165 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import os
+import re
+import queue
+import threading
+import numpy as np
+import torch
+from PIL import Image
+from utils.system_utils import resolveWorkers
+
+class AsyncWriter:
+    """
+    Background writer for model snapshots and checkpoints.
+
+    snapshot() enqueues device-to-host copies into pinned memory and returns
+    right away; the writer thread waits for those copies to land before
+    running the submitted write. Later in-place updates of the source tensors
+    are ordered after the copies on the same stream, so training can go on
+    immediately. At most `max_pending` snapshots are in flight, submit()
+    blocks when that budget is used up. With several `workers`, writes run
+    concurrently and in no particular order.
+    """
+
+    def __init__(self, max_pending=2, workers=1):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._threads = [threading.Thread(target=self._run, daemon=True) for _ in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def snapshot(self, obj):
+        """ Copy every tensor found in nested tuples, lists and dicts to host memory. """
+        if isinstance(obj, torch.Tensor):
+            tensor = obj.detach()
+            if not tensor.is_cuda:
+                return tensor.clone()
+            host = torch.empty(tensor.shape, dtype=tensor.dtype, pin_memory=True)
+            host.copy_(tensor, non_blocking=True)
+            return host
+        if isinstance(obj, tuple):
+            return tuple(self.snapshot(item) for item in obj)
+        if isinstance(obj, list):
+            return [self.snapshot(item) for item in obj]
+        if isinstance(obj, dict):
+            return {key: self.snapshot(value) for key, value in obj.items()}
+        return obj
+
+    def submit(self, fn, *args):
+        """ Run fn(*args) on the writer thread once the pending snapshot copies are done. """
+        self._raise_error()
+        event = None
+        if torch.cuda.is_available():
+            event = torch.cuda.Event()
+            event.record()
+        self._queue.put((event, fn, args))
+
+    def wait(self):
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        self.wait()
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+            event, fn, args = job
+            try:
+                if event is not None:
+                    event.synchronize()
+                fn(*args)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+class ImageWriter(AsyncWriter):
+    """
+    Encodes and writes rendered images on `workers` threads (one per CPU core
+    by default), so rendering the next view overlaps with encoding the
+    previous ones. Images are (3, H, W) tensors in [0, 1]; png and jpg are
+    quantized to 8 bits on the tensor's device like torchvision's save_image,
+    exr (through OpenCV) and npy keep the float values.
+    """
+
+    formats = ("png", "jpg", "exr", "npy")
+
+    def __init__(self, image_format="png", workers=-1, max_pending=None, png_compression=6, jpeg_quality=95):
+        if image_format not in self.formats:
+            raise ValueError("Unknown image format {}, expected one of {}".format(image_format, ", ".join(self.formats)))
+        workers = resolveWorkers(workers)
+        super().__init__(max_pending=max_pending or 2 * workers, workers=workers)
+        self.image_format = image_format
+        self.png_compression = png_compression
+        self.jpeg_quality = jpeg_quality
+        if image_format == "exr":
+            # OpenCV only enables its EXR codec when this is set before the import
+            os.environ.setdefault("OPENCV_IO_ENABLE_OPENEXR", "1")
+            import cv2
+            self._cv2 = cv2
+
+    def path(self, stem):
+        return stem + "." + self.image_format
+
+    def save(self, image, stem, skip_existing=False):
+        """ Queue image to be written to stem plus the format's extension, blocks while the queue is full. """
+        path = self.path(stem)
+        if skip_existing and os.path.exists(path):
+            return
+        image = image.detach()[:3]
+        if self.image_format in ("png", "jpg"):
+            image = image.mul(255).add_(0.5).clamp_(0, 255).to(torch.uint8)
+        else:
+            image = image.float()
+        self.submit(self._write, self.snapshot(image.permute(1, 2, 0).contiguous()), path)
+
+    def _write(self, image, path):
+        array = image.numpy()
+        if self.image_format == "npy":
+            np.save(path, array)
+        elif self.image_format == "exr":
+            if not self._cv2.imwrite(path, array[..., ::-1]):
+                raise RuntimeError("OpenCV could not write {}".format(path))
+        elif self.image_format == "png":
+            Image.fromarray(array).save(path, compress_level=self.png_compression)
+        else:
+            Image.fromarray(array).save(path, quality=self.jpeg_quality)
+
+def prune_checkpoints(model_path, keep):
+    # Keep only the `keep` most recent chkpnt<iteration>.pth files, 0 keeps everything
+    if keep <= 0:
+        return
+    checkpoints = []
+    for fname in os.listdir(model_path):
+        match = re.fullmatch(r"chkpnt(\d+)\.pth", fname)
+        if match:
+            checkpoints.append((int(match.group(1)), fname))
+    for _, fname in sorted(checkpoints)[:-keep]:
+        os.remove(os.path.join(model_path, fname))
+
+def save_checkpoint(obj, path, keep=0):
+    torch.save(obj, path)
+    prune_checkpoints(os.path.dirname(path), keep)
@@ -9,69 +9,153 @@
 # For inquiries contact  george.drettakis@inria.fr
 #
 import os
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
 
 import torch
+import torch.nn.functional as F
 import torchvision.utils
 from scene.cameras import Camera
 import numpy as np
-from utils.general_utils import PILtoTorch
+from PIL import Image
+from utils.general_utils import ArraytoTorch
+from utils.image_cache import DiskImageCache
+from utils.system_utils import resolveWorkers
 from utils.graphics_utils import fov2focal
 from tqdm import tqdm
 WARNED = False
 
-def loadCam(args, id, cam_info, resolution_scale, panorama=False):
-    orig_w, orig_h = cam_info.image.size
-
+def computeResolution(args, orig_w, orig_h, resolution_scale):
     if args.resolution in [1, 2, 4, 8]:
-        resolution = round(orig_w/(resolution_scale * args.resolution)), round(orig_h/(resolution_scale * args.resolution))
-    else:  # should be a type that converts to float
-        if args.resolution == -1:
-            if orig_w > 1600:
-                global WARNED
-                if not WARNED:
-                    print("[ INFO ] Encountered quite large input images (>1.6K pixels width), rescaling to 1.6K.\n "
-                        "If this is not desired, please explicitly specify '--resolution/-r' as 1")
-                    WARNED = True
-                global_down = orig_w / 1600
-            else:
-                global_down = 1
+        return round(orig_w/(resolution_scale * args.resolution)), round(orig_h/(resolution_scale * args.resolution))
+
+    # should be a type that converts to float
+    if args.resolution == -1:
+        if orig_w > 1600:
+            global WARNED
+            if not WARNED:
+                print("[ INFO ] Encountered quite large input images (>1.6K pixels width), rescaling to 1.6K.\n "
+                    "If this is not desired, please explicitly specify '--resolution/-r' as 1")
+                WARNED = True
+            global_down = orig_w / 1600
         else:
-            global_down = orig_w / args.resolution
+            global_down = 1
+    else:
+        global_down = orig_w / args.resolution
+
+    scale = float(global_down) * float(resolution_scale)
+    return (int(orig_w / scale), int(orig_h / scale))
+
+def loadResized(pil_image, path, resolution, disk_cache=None):
+    def decode():
+        if pil_image is not None:
+            return np.array(pil_image.resize(resolution))
+        with Image.open(path) as image:
+            return np.array(image.resize(resolution))
 
-        scale = float(global_down) * float(resolution_scale)
-        resolution = (int(orig_w / scale), int(orig_h / scale))
+    if disk_cache is None:
+        return ArraytoTorch(decode())
+    return ArraytoTorch(disk_cache.load(path, resolution, decode))
+
+def loadImage(args, cam_info, resolution, save_preview=True, disk_cache=None):
+    resized_image_rgb = loadResized(cam_info.image, cam_info.image_path, resolution, disk_cache)
 
-    resized_image_rgb = PILtoTorch(cam_info.image, resolution)
     resized_mask = None
-    if cam_info.mask is not None:
-        resized_mask = PILtoTorch(cam_info.mask, resolution)
+    if cam_info.mask is not None or cam_info.mask_path is not None:
+        resized_mask = loadResized(cam_info.mask, cam_info.mask_path, resolution, disk_cache)
+    if resized_mask is not None:
         if resized_mask.shape[0] != 1:
             resized_mask = resized_mask[:1, ...]
         resized_mask[resized_mask > 0] = 1.
 
-        masked_preview = torch.clone(resized_image_rgb)
-        masked_preview[0, resized_mask[0] == 0.] /= 4.
-        masked_preview[0, resized_mask[0] == 0.] += 0.75
-        preview_save_path = os.path.join(args.model_path, "mask_preview", cam_info.image_name.replace("/", "_"))
-        os.makedirs(os.path.dirname(preview_save_path), exist_ok=True)
-        torchvision.utils.save_image(masked_preview, preview_save_path)
+        if save_preview:
+            masked_preview = torch.clone(resized_image_rgb)
+            masked_preview[0, resized_mask[0] == 0.] /= 4.
+            masked_preview[0, resized_mask[0] == 0.] += 0.75
+            preview_save_path = os.path.join(args.model_path, "mask_preview", cam_info.image_name.replace("/", "_"))
+            os.makedirs(os.path.dirname(preview_save_path), exist_ok=True)
+            torchvision.utils.save_image(masked_preview, preview_save_path)
     gt_image = resized_image_rgb[:3, ...]
     loaded_mask = None
 
     if resized_image_rgb.shape[1] == 4:
         loaded_mask = resized_image_rgb[3:4, ...]
 
+    return gt_image, resized_mask, loaded_mask
+
+def loadCam(args, id, cam_info, resolution_scale, panorama=False, image_cache=None, disk_cache=None):
+    if cam_info.image is not None:
+        orig_w, orig_h = cam_info.image.size
+    else:
+        # Only the header is parsed here, pixels are decoded on first use
+        with Image.open(cam_info.image_path) as image:
+            orig_w, orig_h = image.size
+    resolution = computeResolution(args, orig_w, orig_h, resolution_scale)
+
+    if image_cache is not None:
+        return Camera(colmap_id=cam_info.uid, R=cam_info.R, T=cam_info.T,
+                      FoVx=cam_info.FovX, FoVy=cam_info.FovY,
+                      image=None, mask=None, gt_alpha_mask=None,
+                      image_name=cam_info.image_name, uid=id, data_device=args.data_device, panorama=cam_info.panorama,
+                      image_loader=partial(loadImage, args, cam_info, resolution, False, disk_cache),
+                      image_cache=image_cache, resolution=resolution)
+
+    gt_image, resized_mask, loaded_mask = loadImage(args, cam_info, resolution, disk_cache=disk_cache)
+
     return Camera(colmap_id=cam_info.uid, R=cam_info.R, T=cam_info.T, 
                   FoVx=cam_info.FovX, FoVy=cam_info.FovY, 
                   image=gt_image, mask=resized_mask, gt_alpha_mask=loaded_mask,
                   image_name=cam_info.image_name, uid=id, data_device=args.data_device, panorama=cam_info.panorama)
 
-def cameraList_from_camInfos(cam_infos, resolution_scale, args, panorama=False):
+def downscaleImages(resolution, load):
+    """ Area-downsample a full resolution (original_image, is_masked) pair to the loadImage layout. """
+    image, is_masked = load()
+    size = (resolution[1], resolution[0])
+    mask = None
+    if is_masked is not None:
+        # A low resolution pixel is masked as soon as one of its source pixels is
+        mask = 1.0 - F.adaptive_max_pool2d(is_masked[:1].float()[None], size)[0]
+    return F.interpolate(image[None], size=size, mode="area")[0], mask, None
+
+def loadDownscaledCam(camera, resolution_scale, image_cache=None):
+    resolution = (max(1, round(camera.image_width / resolution_scale)), max(1, round(camera.image_height / resolution_scale)))
+
+    if image_cache is not None:
+        # Decoded from the full resolution image (and its disk cache entry) whenever evicted
+        return Camera(colmap_id=camera.colmap_id, R=camera.R, T=camera.T,
+                      FoVx=camera.FoVx, FoVy=camera.FoVy,
+                      image=None, mask=None, gt_alpha_mask=None,
+                      image_name=camera.image_name, uid=camera.uid, trans=camera.trans, scale=camera.scale,
+                      data_device=camera.data_device, panorama=camera.panorama,
+                      image_loader=partial(downscaleImages, resolution, camera.load_image),
+                      image_cache=image_cache, resolution=resolution)
+
+    image, mask, _ = downscaleImages(resolution, lambda: (camera.original_image, camera.is_masked))
+    return Camera(colmap_id=camera.colmap_id, R=camera.R, T=camera.T,
+                  FoVx=camera.FoVx, FoVy=camera.FoVy,
+                  image=image, mask=mask, gt_alpha_mask=None,
+                  image_name=camera.image_name, uid=camera.uid, trans=camera.trans, scale=camera.scale,
+                  data_device=camera.data_device, panorama=camera.panorama)
+
+def cameraList_from_cameras(cameras, resolution_scale, image_cache=None):
+    """ Lower resolution copies of already loaded cameras, built from their pixels instead of the source files. """
+    return [loadDownscaledCam(camera, resolution_scale, image_cache) for camera in cameras]
+
+def cameraList_from_camInfos(cam_infos, resolution_scale, args, panorama=False, image_cache=None):
+    disk_cache = None
+    if args.image_cache_dir:
+        disk_cache = DiskImageCache(os.path.join(args.image_cache_dir, "r{}_s{}".format(args.resolution, resolution_scale)))
+    def load(id_and_info):
+        id, c = id_and_info
+        return loadCam(args, id, c, resolution_scale, image_cache=image_cache, disk_cache=disk_cache)
+
+    # map() keeps the input order, so uids and the camera order match the sequential path
     camera_list = []
-    with tqdm(enumerate(cam_infos), total=len(cam_infos)) as t:
-        for id, c in t:
-            t.set_description("{}".format(c.image_name))
-            camera_list.append(loadCam(args, id, c, resolution_scale))
+    with ThreadPoolExecutor(max_workers=resolveWorkers(args.load_workers)) as executor:
+        with tqdm(executor.map(load, enumerate(cam_infos)), total=len(cam_infos)) as t:
+            for camera in t:
+                t.set_description("{}".format(camera.image_name))
+                camera_list.append(camera)
     return camera_list
 
 def camera_to_JSON(id, camera : Camera):
@@ -0,0 +1,45 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import functools
+import cv2
+import numpy as np
+
+@functools.lru_cache(maxsize=64)
+def perspective_maps(in_height, in_width, fov, theta, phi, height, width):
+    """
+    Remap tables sampling a height x width perspective view, with horizontal
+    field of view fov, yaw theta and pitch phi (degrees), from an in_height x
+    in_width equirectangular image. Same projection as Equirec2Perspec's
+    GetPerspective, computed once per set of arguments and kept in cv2's
+    fixed-point format, which cv2.remap applies fastest.
+    """
+    f = 0.5 * width / np.tan(0.5 * np.radians(fov))
+    cx = (width - 1) / 2.0
+    cy = (height - 1) / 2.0
+    x, y = np.meshgrid((np.arange(width) - cx) / f, (np.arange(height) - cy) / f)
+    rays = np.stack((x, y, np.ones_like(x)), axis=-1)
+
+    R1, _ = cv2.Rodrigues(np.array([0.0, 1.0, 0.0]) * np.radians(theta))
+    R2, _ = cv2.Rodrigues(R1 @ np.array([1.0, 0.0, 0.0]) * np.radians(phi))
+    rays = rays @ (R2 @ R1).T
+    rays /= np.linalg.norm(rays, axis=-1, keepdims=True)
+
+    lon = np.arctan2(rays[..., 0], rays[..., 2])
+    lat = np.arcsin(rays[..., 1])
+    map_x = ((lon / (2 * np.pi) + 0.5) * (in_width - 1)).astype(np.float32)
+    map_y = ((lat / np.pi + 0.5) * (in_height - 1)).astype(np.float32)
+    return cv2.convertMaps(map_x, map_y, cv2.CV_16SC2)
+
+def equirect_to_perspective(image, fov, theta, phi, height, width):
+    """ Perspective view of an equirectangular image, see perspective_maps. """
+    maps = perspective_maps(image.shape[0], image.shape[1], fov, theta, phi, height, width)
+    return cv2.remap(image, maps[0], maps[1], cv2.INTER_CUBIC, borderMode=cv2.BORDER_WRAP)
@@ -20,7 +20,10 @@ def inverse_sigmoid(x):
 
 def PILtoTorch(pil_image, resolution):
     resized_image_PIL = pil_image.resize(resolution)
-    resized_image = torch.from_numpy(np.array(resized_image_PIL)) / 255.0
+    return ArraytoTorch(np.array(resized_image_PIL))
+
+def ArraytoTorch(array):
+    resized_image = torch.from_numpy(array) / 255.0
     if len(resized_image.shape) == 3:
         return resized_image.permute(2, 0, 1)
     else:
@@ -61,8 +64,31 @@ def get_expon_lr_func(
 
     return helper
 
+def get_resolution_schedule(schedule):
+    """
+    Parse a coarse-to-fine schedule such as "8:0,4:2000,2:5000,1:10000", a
+    list of downscale factor : first iteration pairs, into a function
+    returning the resolution scale of a given iteration. Iterations before
+    the first entry, and an empty schedule, train at full resolution.
+    """
+    steps = []
+    for entry in (schedule or "").replace(" ", "").split(","):
+        if entry:
+            scale, start = entry.split(":")
+            steps.append((int(start), float(scale)))
+    steps.sort()
+
+    def helper(step):
+        scale = 1.0
+        for start, step_scale in steps:
+            if step >= start:
+                scale = step_scale
+        return scale
+
+    return helper
+
 def strip_lowerdiag(L):
-    uncertainty = torch.zeros((L.shape[0], 6), dtype=torch.float, device="cuda")
+    uncertainty = torch.zeros((L.shape[0], 6), dtype=torch.float, device=L.device)
 
     uncertainty[:, 0] = L[:, 0, 0]
     uncertainty[:, 1] = L[:, 0, 1]
@@ -80,7 +106,7 @@ def build_rotation(r):
 
     q = r / norm[:, None]
 
-    R = torch.zeros((q.size(0), 3, 3), device='cuda')
+    R = torch.zeros((q.size(0), 3, 3), device=q.device)
 
     r = q[:, 0]
     x = q[:, 1]
@@ -98,8 +124,22 @@ def build_rotation(r):
     R[:, 2, 2] = 1 - 2 * (x*x + y*y)
     return R
 
+def rotation_to_quaternion(R):
+    """ Inverse of build_rotation: (N, 3, 3) rotation matrices to (N, 4) unit quaternions (r, x, y, z). """
+    m00, m11, m22 = R[:, 0, 0], R[:, 1, 1], R[:, 2, 2]
+    # Each row is 4 q_k q for one component k, well conditioned when q_k is the largest one
+    candidates = torch.stack((
+        torch.stack((1 + m00 + m11 + m22, R[:, 2, 1] - R[:, 1, 2], R[:, 0, 2] - R[:, 2, 0], R[:, 1, 0] - R[:, 0, 1]), dim=1),
+        torch.stack((R[:, 2, 1] - R[:, 1, 2], 1 + m00 - m11 - m22, R[:, 0, 1] + R[:, 1, 0], R[:, 0, 2] + R[:, 2, 0]), dim=1),
+        torch.stack((R[:, 0, 2] - R[:, 2, 0], R[:, 0, 1] + R[:, 1, 0], 1 - m00 + m11 - m22, R[:, 1, 2] + R[:, 2, 1]), dim=1),
+        torch.stack((R[:, 1, 0] - R[:, 0, 1], R[:, 0, 2] + R[:, 2, 0], R[:, 1, 2] + R[:, 2, 1], 1 - m00 - m11 + m22), dim=1),
+    ), dim=1)
+    best = torch.stack((m00 + m11 + m22, m00, m11, m22), dim=1).argmax(dim=1)
+    q = candidates[torch.arange(R.shape[0], device=R.device), best]
+    return q / q.norm(dim=1, keepdim=True)
+
 def build_scaling_rotation(s, r):
-    L = torch.zeros((s.shape[0], 3, 3), dtype=torch.float, device="cuda")
+    L = torch.zeros((s.shape[0], 3, 3), dtype=torch.float, device=s.device)
     R = build_rotation(r)
 
     L[:,0,0] = s[:,0]
@@ -130,4 +170,9 @@ def safe_state(silent):
     random.seed(0)
     np.random.seed(0)
     torch.manual_seed(0)
-    torch.cuda.set_device(torch.device("cuda:0"))
+    if torch.cuda.is_available():
+        torch.cuda.set_device(torch.device("cuda:0"))
+
+def get_device():
+    # Without a GPU everything falls back to the CPU, for use with --rasterizer cpu
+    return torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
@@ -0,0 +1,121 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import os
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+class ImageCache:
+    """
+    Bounded LRU cache of decoded camera images.
+
+    Entries are produced by loader callables and are decoded either on demand
+    or ahead of time by a single background prefetch worker. At most
+    `capacity` entries are kept alive, so memory stays flat whatever the
+    number of cameras in the scene.
+    """
+
+    def __init__(self, capacity=32, prefetch_depth=4):
+        # Keep room for the image in use plus everything being prefetched,
+        # otherwise prefetched frames would evict each other before use.
+        self.capacity = max(capacity, prefetch_depth + 2)
+        self.prefetch_depth = prefetch_depth
+        self._entries = OrderedDict()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1) if prefetch_depth > 0 else None
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, loader):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            future = self._pending.get(key)
+        if future is not None:
+            return future.result()
+        value = loader()
+        with self._lock:
+            self._insert(key, value)
+        return value
+
+    def prefetch(self, requests):
+        """ Schedule (key, loader) pairs for background decoding, nearest first. """
+        if self._executor is None:
+            return
+        for key, loader in list(requests)[:self.prefetch_depth]:
+            with self._lock:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    continue
+                if key in self._pending:
+                    continue
+                self._pending[key] = self._executor.submit(self._load, key, loader)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _load(self, key, loader):
+        try:
+            value = loader()
+            with self._lock:
+                self._insert(key, value)
+            return value
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def _insert(self, key, value):
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+class DiskImageCache:
+    """
+    Persistent cache of resized images, one memory-mapped .npy file per image.
+
+    Files are keyed by source path, modification time and target resolution,
+    so an edited source image or a different --resolution never hits a stale
+    entry. Writes go through a temporary file and an atomic rename, which keeps
+    concurrent runs on the same scene safe.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_path(self, image_path, resolution):
+        stat = os.stat(image_path)
+        key = "{}|{}|{}|{}x{}".format(os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size, *resolution)
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".npy")
+
+    def load(self, image_path, resolution, decode):
+        """ Return the resized pixel array of image_path, calling decode() only on a cache miss. """
+        entry_path = self.entry_path(image_path, resolution)
+        if os.path.exists(entry_path):
+            try:
+                return np.load(entry_path, mmap_mode="c")
+            except (ValueError, OSError):
+                pass  # Truncated or corrupt entry, decode again and overwrite it
+
+        array = decode()
+        tmp_path = "{}.{}.{}.tmp".format(entry_path, os.getpid(), threading.get_ident())
+        with open(tmp_path, "wb") as f:
+            np.save(f, array)
+        os.replace(tmp_path, entry_path)
+        return array
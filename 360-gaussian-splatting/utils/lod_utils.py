@@ -0,0 +1,214 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import math
+import torch
+from scene.gaussian_model import GaussianModel
+from utils.general_utils import build_scaling_rotation, rotation_to_quaternion, inverse_sigmoid
+
+class GaussianHierarchy:
+    """
+    Level-of-detail hierarchy over the Gaussians of a trained model.
+
+    The leaves are the model's Gaussians, stored first and unchanged. Inner
+    nodes are built bottom-up: at every level the nodes without a parent yet
+    are grouped by a grid whose cells double in size from level to level, and
+    every group of two or more is merged into one Gaussian that matches the
+    weighted first and second moments of its members (mean and covariance),
+    their weighted SH coefficients and their opacity mass, with weights
+    opacity * footprint area. Groups of one are carried to the next level.
+
+    Each node has an error, the 3 sigma size of its Gaussian (never smaller
+    than the error of its children), and a radius bounding the centers of its
+    descendants. cut() picks, for every leaf, the coarsest ancestor whose error
+    projects to at most `threshold` pixels, which gives one consistent set of
+    Gaussians per view.
+    """
+
+    def __init__(self, gaussians : GaussianModel, max_levels=24, group_size=8):
+        with torch.no_grad():
+            self.max_sh_degree = gaussians.max_sh_degree
+            self.active_sh_degree = gaussians.active_sh_degree
+            num_leaves = gaussians.get_xyz.shape[0]
+            xyz = gaussians.get_xyz.detach()
+            scaling = gaussians.get_scaling.detach()
+            opacity = gaussians.get_opacity.detach()
+            L = build_scaling_rotation(scaling, gaussians.get_rotation.detach())
+            features = torch.cat((gaussians._features_dc.detach(), gaussians._features_rest.detach()), dim=1).flatten(1)
+
+            # Per node arrays, one entry per level appended as the hierarchy grows
+            self._xyz = [xyz]
+            self._cov = [L @ L.transpose(1, 2)]
+            self._features = [features]
+            self._opacity = [opacity[:, 0]]
+            self._error = [3 * scaling.max(dim=1).values]
+            self._radius = [torch.zeros_like(self._error[0])]
+            self._parent = [torch.full((num_leaves,), -1, dtype=torch.long, device=xyz.device)]
+            self.num_levels = 1
+
+            # Leaves are represented exactly by their original parameters
+            self.leaves = {"xyz": gaussians._xyz.detach(), "f_dc": gaussians._features_dc.detach(),
+                           "f_rest": gaussians._features_rest.detach(), "opacity": gaussians._opacity.detach(),
+                           "scaling": gaussians._scaling.detach(), "rotation": gaussians._rotation.detach()}
+
+            # First cell size: about group_size Gaussians per occupied cell over the bulk of the scene.
+            # Start from the volume estimate, then shrink it since captures are mostly surfaces
+            sample = xyz[torch.randperm(num_leaves, device=xyz.device)[:100_000]].float()
+            bounds = torch.quantile(sample, torch.tensor([0.01, 0.99], device=xyz.device), dim=0)
+            span = torch.clamp_min(bounds[1] - bounds[0], 1e-6)
+            self.origin = xyz.float().min(dim=0).values
+            cell_size = float((span.prod() * group_size / max(num_leaves, 1)) ** (1 / 3))
+            for _ in range(8):
+                occupied = torch.unique(self._cell_keys(sample, cell_size)).shape[0]
+                if sample.shape[0] / occupied <= group_size:
+                    break
+                cell_size *= 0.5
+
+            frontier = torch.arange(num_leaves, device=xyz.device)
+            offset = num_leaves
+            for _ in range(max_levels - 1):
+                if frontier.shape[0] <= 1:
+                    break
+                frontier, offset = self._merge_level(frontier, offset, cell_size)
+                cell_size *= 2
+
+            self.xyz = torch.cat(self._xyz)
+            self.error = torch.cat(self._error)
+            self.radius = torch.cat(self._radius)
+            self.parent = torch.cat(self._parent)
+            self.num_nodes = self.xyz.shape[0]
+            self.num_leaves = num_leaves
+            self._build_inner_parameters(torch.cat(self._cov[1:]) if self.num_nodes > num_leaves else None,
+                                         torch.cat(self._features[1:]) if self.num_nodes > num_leaves else None,
+                                         torch.cat(self._opacity[1:]) if self.num_nodes > num_leaves else None)
+            del self._xyz, self._cov, self._features, self._opacity, self._error, self._radius, self._parent
+
+    def _gather(self, nodes, arrays):
+        # Node attributes across the per-level chunks
+        return torch.cat(arrays)[nodes]
+
+    def _cell_keys(self, xyz, cell_size):
+        # One integer per grid cell, the grid anchored at the scene bounds
+        coords = torch.clamp(torch.floor((xyz - self.origin) / cell_size), -2 ** 20 + 1, 2 ** 20 - 1).long() + 2 ** 20
+        return (coords[:, 0] << 42) | (coords[:, 1] << 21) | coords[:, 2]
+
+    def _merge_level(self, frontier, offset, cell_size):
+        xyz = self._gather(frontier, self._xyz)
+        _, group, counts = torch.unique(self._cell_keys(xyz, cell_size), return_inverse=True, return_counts=True)
+        merged = counts[group] > 1
+        if not merged.any():
+            return frontier, offset
+
+        # Groups of two or more become new nodes, numbered in group order
+        members = frontier[merged]
+        member_group = group[merged]
+        new_ids = torch.unique(member_group)
+        num_new = new_ids.shape[0]
+        local = torch.searchsorted(new_ids, member_group)
+
+        cov = self._gather(members, self._cov)
+        features = self._gather(members, self._features)
+        opacity = self._gather(members, self._opacity)
+        error = self._gather(members, self._error)
+        radius = self._gather(members, self._radius)
+        mean = xyz[merged]
+
+        eigenvalues = torch.linalg.eigvalsh(cov).clamp_min(0)
+        area = math.pi * torch.sqrt(eigenvalues[:, 1] * eigenvalues[:, 2])
+        weight = torch.clamp_min(opacity * area, 1e-30)
+
+        def weighted_sum(values):
+            out = torch.zeros((num_new, *values.shape[1:]), dtype=values.dtype, device=values.device)
+            return out.index_add_(0, local, values * weight.view(-1, *([1] * (values.dim() - 1))))
+        total = weighted_sum(torch.ones_like(weight))
+        new_xyz = weighted_sum(mean) / total[:, None]
+        second = weighted_sum(cov + mean[:, :, None] * mean[:, None, :]) / total[:, None, None]
+        new_cov = second - new_xyz[:, :, None] * new_xyz[:, None, :]
+        new_features = weighted_sum(features) / total[:, None]
+
+        new_eigenvalues = torch.linalg.eigvalsh(new_cov).clamp_min(0)
+        new_area = math.pi * torch.sqrt(new_eigenvalues[:, 1] * new_eigenvalues[:, 2])
+        mass = torch.zeros((num_new), device=xyz.device).index_add_(0, local, opacity * area)
+        new_opacity = torch.clamp(mass / torch.clamp_min(new_area, 1e-30), 0.0, 0.99)
+
+        new_error = 3 * torch.sqrt(new_eigenvalues[:, 2])
+        new_error = torch.maximum(new_error, torch.zeros_like(new_error).scatter_reduce_(0, local, error, "amax"))
+        extent = (mean - new_xyz[local]).norm(dim=1) + radius
+        new_radius = torch.zeros((num_new), device=xyz.device).scatter_reduce_(0, local, extent, "amax")
+
+        # Members get their parent, then the new nodes join the unmerged ones in the frontier
+        parent = torch.cat(self._parent)
+        parent[members] = offset + local
+        self._parent = [parent, torch.full((num_new,), -1, dtype=torch.long, device=xyz.device)]
+        self._xyz.append(new_xyz)
+        self._cov.append(new_cov)
+        self._features.append(new_features)
+        self._opacity.append(new_opacity)
+        self._error.append(new_error)
+        self._radius.append(new_radius)
+        self.num_levels += 1
+        frontier = torch.cat((frontier[~merged], offset + torch.arange(num_new, device=xyz.device)))
+        return frontier, offset + num_new
+
+    def _build_inner_parameters(self, cov, features, opacity):
+        # Scaling and rotation of the inner nodes from the eigen decomposition of their covariance
+        if cov is None:
+            self.inner = None
+            return
+        eigenvalues, eigenvectors = torch.linalg.eigh(cov)
+        flip = torch.linalg.det(eigenvectors) < 0
+        eigenvectors[flip, :, 0] *= -1
+        num_dc = 1
+        features = features.view(features.shape[0], -1, 3)
+        self.inner = {"xyz": self.xyz[self.num_leaves:],
+                      "f_dc": features[:, :num_dc].contiguous(),
+                      "f_rest": features[:, num_dc:].contiguous(),
+                      "opacity": inverse_sigmoid(torch.clamp_min(opacity, 1e-6))[:, None],
+                      "scaling": torch.log(torch.sqrt(torch.clamp_min(eigenvalues, 1e-20))),
+                      "rotation": rotation_to_quaternion(eigenvectors)}
+
+    def select(self, camera_center, pixels_per_radian, threshold):
+        """ Boolean mask over the nodes forming the cut for a camera. """
+        distance = torch.clamp_min((self.xyz - camera_center).norm(dim=1) - self.radius, 1e-6)
+        projected = self.error / distance * pixels_per_radian
+        # Projected errors never decrease from a node to its parent, so every leaf has exactly
+        # one selected ancestor (or itself): the coarsest one that is fine enough
+        fine = projected <= threshold if threshold > 0 else torch.zeros_like(projected, dtype=torch.bool)
+        fine[:self.num_leaves] = True
+        parent_fine = torch.zeros_like(fine)
+        has_parent = self.parent >= 0
+        parent_fine[has_parent] = fine[self.parent[has_parent]]
+        return fine & ~parent_fine
+
+    def cut(self, viewpoint_camera, threshold, spherical=False):
+        """ GaussianModel with the cut of the hierarchy for a view, the full model when threshold is 0. """
+        with torch.no_grad():
+            if spherical:
+                pixels_per_radian = viewpoint_camera.image_width / (2 * math.pi)
+            else:
+                pixels_per_radian = viewpoint_camera.image_width / (2 * math.tan(viewpoint_camera.FoVx * 0.5))
+            selected = self.select(viewpoint_camera.camera_center.to(self.xyz.device), pixels_per_radian, threshold)
+            leaves = selected[:self.num_leaves]
+            inner = selected[self.num_leaves:]
+
+            model = GaussianModel(self.max_sh_degree)
+            model.active_sh_degree = self.active_sh_degree
+            def pick(name):
+                if self.inner is None or not inner.any():
+                    return self.leaves[name][leaves]
+                return torch.cat((self.leaves[name][leaves], self.inner[name][inner]))
+            model._xyz = pick("xyz")
+            model._features_dc = pick("f_dc")
+            model._features_rest = pick("f_rest")
+            model._opacity = pick("opacity")
+            model._scaling = pick("scaling")
+            model._rotation = pick("rotation")
+            return model
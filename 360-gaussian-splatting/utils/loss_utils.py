@@ -9,10 +9,9 @@
 # For inquiries contact  george.drettakis@inria.fr
 #
 
+import weakref
 import torch
 import torch.nn.functional as F
-from torch.autograd import Variable
-from math import exp
 import numpy as np
 
 def latitude_weight(height):
@@ -21,51 +20,160 @@ def latitude_weight(height):
     weight = torch.cos(latitude)
     return weight.unsqueeze(-1).unsqueeze(0).expand(3, -1, -1)
 
+class WeightMaps:
+    """
+    Per-pixel loss weights shared by the cameras of a scene. Latitude weights
+    are computed once per (height, device) and kept as (1, H, 1) maps that
+    broadcast over channels and columns. Weights of masked cameras are kept
+    per (mask, device) for as long as the mask tensor itself is alive, so a
+    mask evicted from the lazy image cache takes its weights with it.
+    """
+
+    def __init__(self):
+        self._latitude = {}
+        self._masked = {}
+
+    def latitude(self, height, device):
+        key = (height, torch.device(device))
+        if key not in self._latitude:
+            self._latitude[key] = latitude_weight(height)[:1].to(device)
+        return self._latitude[key]
+
+    def get(self, camera, device, mask=None):
+        """ Weights for a camera's loss, with masked pixels set to zero, or None when uniform. """
+        weights = self.latitude(camera.image_height, device) if camera.panorama else None
+        if mask is None:
+            return weights
+        # Keyed by id() with a weak reference to check it, tensors cannot be dict keys by value
+        key = (id(mask), torch.device(device), camera.panorama, camera.image_height)
+        entry = self._masked.get(key)
+        if entry is None or entry[0]() is not mask:
+            valid = torch.logical_not(mask.to(device)).float()
+            if weights is not None:
+                valid *= weights
+            ref = weakref.ref(mask, lambda _, key=key: self._masked.pop(key, None))
+            entry = self._masked[key] = (ref, valid)
+        return entry[1]
+
 def l1_loss(network_output, gt, weights=None):
-    if weights is None:
-        weights = torch.ones_like(gt)
-    return torch.abs((network_output - gt) * weights).mean()
+    diff = torch.abs(network_output - gt)
+    if weights is not None:
+        diff = diff * weights
+    return diff.mean()
 
 def l2_loss(network_output, gt):
     return ((network_output - gt) ** 2).mean()
 
+# Separable Gaussian windows, keyed by (window_size, channel, device, dtype)
+_windows = {}
+
 def gaussian(window_size, sigma):
-    gauss = torch.Tensor([exp(-(x - window_size // 2) ** 2 / float(2 * sigma ** 2)) for x in range(window_size)])
-    return gauss / gauss.sum()
+    coords = torch.arange(window_size, dtype=torch.float64) - window_size // 2
+    gauss = torch.exp(-coords ** 2 / (2 * sigma ** 2))
+    return (gauss / gauss.sum()).float()
 
 def create_window(window_size, channel):
     _1D_window = gaussian(window_size, 1.5).unsqueeze(1)
     _2D_window = _1D_window.mm(_1D_window.t()).float().unsqueeze(0).unsqueeze(0)
-    window = Variable(_2D_window.expand(channel, 1, window_size, window_size).contiguous())
-    return window
+    return _2D_window.expand(channel, 1, window_size, window_size).contiguous()
+
+def separable_window(window_size, channel, device, dtype):
+    """ Horizontal and vertical 1D Gaussian kernels for a grouped convolution, built once per key. """
+    key = (window_size, channel, torch.device(device), dtype)
+    if key not in _windows:
+        gauss = gaussian(window_size, 1.5).to(device=device, dtype=dtype)
+        horizontal = gauss.view(1, 1, 1, window_size).expand(channel, 1, 1, window_size).contiguous()
+        vertical = gauss.view(1, 1, window_size, 1).expand(channel, 1, window_size, 1).contiguous()
+        _windows[key] = (horizontal, vertical)
+    return _windows[key]
 
-def ssim(img1, img2, window_size=11, size_average=True, weights=None):
+def _blur(x, window, window_size, channel):
+    # Same result as the 2D window with zero padding: padded rows stay zero after the horizontal pass
+    horizontal, vertical = window
+    x = F.conv2d(x, horizontal, padding=(0, window_size // 2), groups=channel)
+    return F.conv2d(x, vertical, padding=(window_size // 2, 0), groups=channel)
+
+def ssim(img1, img2, window_size=11, size_average=True, weights=None, half=False):
+    """
+    SSIM of (C, H, W) or (B, C, H, W) images. `weights` (e.g. from
+    latitude_weight) is broadcast against the images and scales them before
+    comparison. With half=True the window convolutions run in float16 on
+    locally centered images (see _centered_moments), the moments and the SSIM
+    ratio are evaluated at the input precision.
+    """
     channel = img1.size(-3)
-    window = create_window(window_size, channel)
-    
-    if img1.is_cuda:
-        window = window.cuda(img1.get_device())
-    window = window.type_as(img1)
-    
-    if weights is None:
-        weights = torch.ones_like(img1)
-    
-    img1 = img1 * weights
-    img2 = img2 * weights
-
-    return _ssim(img1, img2, window, window_size, channel, size_average)
-
-def _ssim(img1, img2, window, window_size, channel, size_average=True):
-    mu1 = F.conv2d(img1, window, padding=window_size // 2, groups=channel)
-    mu2 = F.conv2d(img2, window, padding=window_size // 2, groups=channel)
+    dtype = torch.float16 if half else img1.dtype
+    window = separable_window(window_size, 5 * channel, img1.device, dtype)
+
+    if weights is not None:
+        img1 = img1 * weights
+        img2 = img2 * weights
 
+    return _ssim(img1, img2, window, window_size, channel, size_average, dtype)
+
+def _ssim(img1, img2, window, window_size, channel, size_average=True, dtype=None):
+    if dtype is not None and dtype != img1.dtype:
+        moments = _centered_moments(img1, img2, window, window_size, channel, dtype)
+        return _ssim_from_moments(*moments, size_average)
+    # All five local moments are blurred by one pair of grouped convolutions over the stacked inputs
+    stacked = torch.cat([img1, img2, img1 * img1, img2 * img2, img1 * img2], dim=-3)
+    moments = _blur(stacked, window, window_size, 5 * channel)
+    mu1, mu2, img1_sq, img2_sq, img1_img2 = moments.split(channel, dim=-3)
+    return _ssim_from_moments(mu1, mu2, img1_sq, img2_sq, img1_img2, size_average)
+
+def _centered_moments(img1, img2, window, window_size, channel, dtype, tile=32):
+    """
+    The five blurred moments of _ssim with the convolutions at reduced precision.
+
+    Blurring raw squares in float16 loses the variances E[x^2] - mu^2 of bright,
+    low-variance regions to cancellation. So the images are cut into tiles
+    (with a halo of half a window, zero outside the image like the convolution
+    padding), each tile is centered on its own mean and blurred without
+    padding, and the moments are shifted back at the input precision. Every
+    window sees a single offset, so the shift cancels out exactly and is left
+    out of the gradient.
+    """
+    batch_shape = img1.shape[:-3]
+    height, width = img1.shape[-2:]
+    half = window_size // 2
+    rows = -(-height // tile)
+    cols = -(-width // tile)
+    # (N, 2C, rows, cols, tile + 2 * half, tile + 2 * half) overlapping tiles of both images
+    images = torch.cat([img1, img2], dim=-3).reshape(-1, 2 * channel, height, width)
+    images = F.pad(images, (half, half + cols * tile - width, half, half + rows * tile - height))
+    tiles = images.unfold(2, tile + 2 * half, tile).unfold(3, tile + 2 * half, tile)
+    offsets = tiles.detach().mean(dim=(-2, -1), keepdim=True)
+    centered = tiles - offsets
+
+    centered = centered.permute(0, 2, 3, 1, 4, 5).reshape(-1, 2 * channel, tile + 2 * half, tile + 2 * half)
+    centered1, centered2 = centered.split(channel, dim=1)
+    stacked = torch.cat([centered1, centered2, centered1 * centered1, centered2 * centered2, centered1 * centered2], dim=1)
+    horizontal, vertical = window
+    moments = F.conv2d(F.conv2d(stacked.to(dtype), horizontal, groups=5 * channel), vertical, groups=5 * channel).to(img1.dtype)
+    mu1, mu2, img1_sq, img2_sq, img1_img2 = moments.split(channel, dim=1)
+
+    offsets = offsets.permute(0, 2, 3, 1, 4, 5).reshape(-1, 2 * channel, 1, 1)
+    offset1, offset2 = offsets.split(channel, dim=1)
+    img1_sq = img1_sq + 2 * offset1 * mu1 + offset1 * offset1
+    img2_sq = img2_sq + 2 * offset2 * mu2 + offset2 * offset2
+    img1_img2 = img1_img2 + offset2 * mu1 + offset1 * mu2 + offset1 * offset2
+    mu1 = mu1 + offset1
+    mu2 = mu2 + offset2
+
+    def untile(moment):
+        # (N * rows * cols, C, tile, tile) back to (..., C, H, W)
+        moment = moment.reshape(-1, rows, cols, channel, tile, tile).permute(0, 3, 1, 4, 2, 5)
+        return moment.reshape(-1, channel, rows * tile, cols * tile)[..., :height, :width].reshape(*batch_shape, channel, height, width)
+    return [untile(moment) for moment in (mu1, mu2, img1_sq, img2_sq, img1_img2)]
+
+def _ssim_from_moments(mu1, mu2, img1_sq, img2_sq, img1_img2, size_average=True):
     mu1_sq = mu1.pow(2)
     mu2_sq = mu2.pow(2)
     mu1_mu2 = mu1 * mu2
 
-    sigma1_sq = F.conv2d(img1 * img1, window, padding=window_size // 2, groups=channel) - mu1_sq
-    sigma2_sq = F.conv2d(img2 * img2, window, padding=window_size // 2, groups=channel) - mu2_sq
-    sigma12 = F.conv2d(img1 * img2, window, padding=window_size // 2, groups=channel) - mu1_mu2
+    sigma1_sq = img1_sq - mu1_sq
+    sigma2_sq = img2_sq - mu2_sq
+    sigma12 = img1_img2 - mu1_mu2
 
     C1 = 0.01 ** 2
     C2 = 0.03 ** 2
@@ -76,4 +184,3 @@ def _ssim(img1, img2, window, window_size, channel, size_average=True):
         return ssim_map.mean()
     else:
         return ssim_map.mean(1).mean(1).mean(1)
-
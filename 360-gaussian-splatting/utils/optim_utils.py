@@ -0,0 +1,229 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import math
+import torch
+from torch import nn
+
+class GaussianAdam:
+    """
+    Adam over the per-Gaussian parameter groups of a GaussianModel.
+
+    Each group keeps its parameters and both moments in one (3, capacity, W)
+    buffer: plane 0 holds the parameters, planes 1 and 2 exp_avg and
+    exp_avg_sq, one row of W values per Gaussian slot. The parameters handed
+    back to the model are views of the first `count` rows of plane 0, hence
+    pruning, appending and resetting Gaussians are single indexing operations
+    per group and a step is one fused Adam kernel per group.
+
+    With sparse=True, step(visibility) only updates the Gaussians visible in
+    the current view and leaves the moments of the others untouched.
+
+    With growable=True the buffers keep spare capacity, doubled whenever it
+    runs out. Pruned slots are not removed but filled with `free_values`
+    (e.g. a zero opacity, so they do not render), given zero moments and put
+    on a free list that later appends fill first; the slots are compacted
+    once more than `max_free_fraction` of them are free.
+
+    The update and state_dict() follow torch.optim.Adam, so checkpoints can be
+    exchanged with the stock optimizer.
+    """
+
+    def __init__(self, param_groups, lr=0.0, betas=(0.9, 0.999), eps=1e-8, sparse=False,
+                 growable=False, max_free_fraction=0.1, free_values=None):
+        self.betas = betas
+        self.eps = eps
+        self.sparse = sparse
+        self.growable = growable
+        self.max_free_fraction = max_free_fraction
+        self.free_values = free_values or {}
+        self.param_groups = []
+        for group in param_groups:
+            assert len(group["params"]) == 1
+            param = group["params"][0].detach()
+            buffer = torch.zeros((3, param.shape[0], math.prod(param.shape[1:])), dtype=param.dtype, device=param.device)
+            buffer[0] = param.reshape(buffer.shape[1:])
+            self.param_groups.append({"name": group["name"], "lr": group.get("lr", lr), "params": [None],
+                                      "buffer": buffer, "shape": tuple(param.shape[1:]), "step": 0})
+        self.count = self.param_groups[0]["buffer"].shape[1]
+        self.free = torch.empty((0), dtype=torch.long, device=self.param_groups[0]["buffer"].device)
+        self._fused = hasattr(torch, "_fused_adam_")
+        self._bind()
+
+    @property
+    def capacity(self):
+        return self.param_groups[0]["buffer"].shape[1]
+
+    @property
+    def num_points(self):
+        """ Number of live Gaussians, free slots excluded. """
+        return self.count - self.free.shape[0]
+
+    def alive_mask(self):
+        """ Boolean mask of the live slots among the `count` parameter rows, None when none is free. """
+        if self.free.shape[0] == 0:
+            return None
+        mask = torch.ones((self.count), dtype=torch.bool, device=self.free.device)
+        mask[self.free] = False
+        return mask
+
+    def parameters(self):
+        """ {group name: nn.Parameter} views of the buffers, to be stored on the model. """
+        return {group["name"]: group["params"][0] for group in self.param_groups}
+
+    def _bind(self, names=None):
+        # New Parameter objects, without gradients, for the given groups (all by default)
+        for group in self.param_groups:
+            if names is None or group["name"] in names:
+                group["params"][0] = nn.Parameter(group["buffer"][0, :self.count].view(self.count, *group["shape"]))
+        return self.parameters()
+
+    def _resize(self, capacity):
+        for group in self.param_groups:
+            buffer = group["buffer"]
+            group["buffer"] = buffer.new_zeros((3, capacity, buffer.shape[2]))
+            group["buffer"][:, :self.count] = buffer[:, :self.count]
+
+    def _compact(self):
+        # Move the live slots to the front; groups are done one at a time to bound the peak memory
+        keep = self.alive_mask().nonzero().squeeze(1)
+        for group in self.param_groups:
+            group["buffer"][:, :keep.shape[0]] = group["buffer"].index_select(1, keep)
+        self.count = keep.shape[0]
+        self.free = self.free[:0]
+        return keep
+
+    def prune(self, valid_mask):
+        """
+        Remove the Gaussians outside valid_mask. Returns the new parameters and
+        the indices of the surviving slots when the slots moved, None when they
+        kept their place (growable storage, pruned slots put on the free list).
+        """
+        if not self.growable:
+            keep = valid_mask.nonzero().squeeze(1)
+            for group in self.param_groups:
+                group["buffer"] = group["buffer"].index_select(1, keep)
+            self.count = keep.shape[0]
+            return self._bind(), keep
+
+        removed = ~valid_mask
+        if self.free.shape[0] > 0:
+            removed[self.free] = False
+        removed = removed.nonzero().squeeze(1)
+        for group in self.param_groups:
+            group["buffer"][1:, removed] = 0
+            if group["name"] in self.free_values:
+                group["buffer"][0, removed] = self.free_values[group["name"]]
+        self.free = torch.cat((self.free, removed))
+
+        keep = None
+        if self.free.shape[0] > self.max_free_fraction * self.count:
+            keep = self._compact()
+        return self._bind(), keep
+
+    def append(self, tensors_dict):
+        """ Add Gaussians, into free slots first. Returns the new parameters. """
+        num_new = tensors_dict[self.param_groups[0]["name"]].shape[0]
+        reused, self.free = self.free[:num_new], self.free[num_new:]
+        num_tail = num_new - reused.shape[0]
+        if self.count + num_tail > self.capacity:
+            self._resize(max(self.count + num_tail, 2 * self.capacity) if self.growable else self.count + num_tail)
+        slots = torch.cat((reused, torch.arange(self.count, self.count + num_tail, device=reused.device)))
+        self.count += num_tail
+
+        for group in self.param_groups:
+            values = tensors_dict[group["name"]].detach().reshape(num_new, group["buffer"].shape[2])
+            group["buffer"][0].index_copy_(0, slots, values)
+            group["buffer"][1:, slots] = 0
+        return self._bind()
+
+    def replace(self, tensor, name):
+        """ Overwrite one group's values and reset its moments. """
+        group = next(group for group in self.param_groups if group["name"] == name)
+        group["buffer"][0, :self.count] = tensor.detach().reshape(self.count, group["buffer"].shape[2])
+        group["buffer"][1:, :self.count] = 0
+        return {name: self._bind([name])[name]}
+
+    def zero_grad(self, set_to_none=True):
+        for group in self.param_groups:
+            group["params"][0].grad = None
+
+    @torch.no_grad()
+    def step(self, visibility=None):
+        # Like torch.optim.Adam, parameters without a gradient (replaced since the last backward)
+        # are skipped, and each group counts its own steps
+        active = [group for group in self.param_groups if group["params"][0].grad is not None]
+        if not active:
+            return
+
+        index = None
+        if self.sparse and visibility is not None:
+            index = visibility.nonzero().squeeze(1)
+        for group in active:
+            group["step"] += 1
+            grad = group["params"][0].grad.reshape(self.count, group["buffer"].shape[2])
+            if index is None:
+                self._update(group["buffer"][:, :self.count], grad, group)
+            else:
+                state = group["buffer"].index_select(1, index)
+                self._update(state, grad.index_select(0, index), group)
+                group["buffer"].index_copy_(1, index, state)
+
+    def _update(self, state, grad, group):
+        param, exp_avg, exp_avg_sq = state
+        beta1, beta2 = self.betas
+        if self._fused:
+            # One kernel reading and writing every array once, when the device supports it
+            if "step_tensor" not in group:
+                group["step_tensor"] = torch.zeros((), dtype=torch.float32, device=param.device)
+            group["step_tensor"].fill_(group["step"])
+            try:
+                torch._fused_adam_([param], [grad], [exp_avg], [exp_avg_sq], [], [group["step_tensor"]],
+                                   lr=group["lr"], beta1=beta1, beta2=beta2, weight_decay=0.0, eps=self.eps,
+                                   amsgrad=False, maximize=False)
+                return
+            except (RuntimeError, NotImplementedError):
+                self._fused = False
+
+        bias_correction1 = 1 - beta1 ** group["step"]
+        bias_correction2_sqrt = math.sqrt(1 - beta2 ** group["step"])
+        exp_avg.lerp_(grad, 1 - beta1)
+        exp_avg_sq.mul_(beta2).addcmul_(grad, grad, value=1 - beta2)
+        denom = (exp_avg_sq.sqrt() / bias_correction2_sqrt).add_(self.eps)
+        param.addcdiv_(exp_avg, denom, value=-group["lr"] / bias_correction1)
+
+    def state_dict(self):
+        """ torch.optim.Adam layout: one state entry per group, moments shaped like the live parameters. """
+        alive = self.alive_mask()
+        state = {}
+        groups = []
+        for idx, group in enumerate(self.param_groups):
+            moments = group["buffer"][1:, :self.count]
+            if alive is not None:
+                moments = moments[:, alive]
+            state[idx] = {
+                "step": torch.tensor(float(group["step"])),
+                "exp_avg": moments[0].reshape(-1, *group["shape"]).clone(),
+                "exp_avg_sq": moments[1].reshape(-1, *group["shape"]).clone(),
+            }
+            groups.append({"lr": group["lr"], "betas": self.betas, "eps": self.eps, "weight_decay": 0,
+                           "amsgrad": False, "maximize": False, "name": group["name"], "params": [idx]})
+        return {"state": state, "param_groups": groups}
+
+    def load_state_dict(self, state_dict):
+        for group, saved in zip(self.param_groups, state_dict["param_groups"]):
+            group["lr"] = saved["lr"]
+            state = state_dict["state"].get(saved["params"][0])
+            if state is None:
+                continue
+            group["buffer"][1, :self.count] = state["exp_avg"].to(group["buffer"].device).reshape(self.count, group["buffer"].shape[2])
+            group["buffer"][2, :self.count] = state["exp_avg_sq"].to(group["buffer"].device).reshape(self.count, group["buffer"].shape[2])
+            group["step"] = int(state["step"])
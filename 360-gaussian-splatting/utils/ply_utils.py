@@ -0,0 +1,66 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import numpy as np
+
+def write_float_ply(path, names, data):
+    """
+    Write an (N, len(names)) array as the float vertex element of a binary
+    little endian PLY, with the same header plyfile would produce.
+    """
+    data = np.ascontiguousarray(data, dtype='<f4')
+    assert data.ndim == 2 and data.shape[1] == len(names)
+    header = ["ply", "format binary_little_endian 1.0", "element vertex {}".format(data.shape[0])]
+    header += ["property float {}".format(name) for name in names]
+    header.append("end_header")
+    with open(path, 'wb') as f:
+        f.write(("\n".join(header) + "\n").encode("ascii"))
+        data.tofile(f)
+
+def read_float_ply(path):
+    """
+    Read a binary little endian PLY whose only element is a vertex block of
+    float properties. Returns the property names and an (N, P) float32 array
+    read in one go, or None if the file has any other layout.
+    """
+    names = []
+    count = None
+    fmt = None
+    with open(path, 'rb') as f:
+        if f.readline().strip() != b"ply":
+            return None
+        while True:
+            line = f.readline()
+            if not line:
+                return None
+            tokens = line.split()
+            if not tokens or tokens[0] in (b"comment", b"obj_info"):
+                continue
+            if tokens[0] == b"end_header":
+                break
+            if tokens[0] == b"format":
+                fmt = tokens[1]
+            elif tokens[0] == b"element":
+                if count is not None or tokens[1] != b"vertex":
+                    return None
+                count = int(tokens[2])
+            elif tokens[0] == b"property":
+                if len(tokens) != 3 or tokens[1] not in (b"float", b"float32"):
+                    return None
+                names.append(tokens[2].decode("ascii"))
+            else:
+                return None
+        if fmt != b"binary_little_endian" or count is None:
+            return None
+        data = np.fromfile(f, dtype='<f4', count=count * len(names))
+    if data.size != count * len(names):
+        return None
+    return names, data.reshape(count, len(names))
@@ -0,0 +1,115 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import json
+import time
+import contextlib
+from collections import OrderedDict
+import numpy as np
+import torch
+
+class StageProfiler:
+    """
+    Per-stage timing of the training loop.
+
+    span(name) times a block with CUDA events when CUDA is available and with
+    wall-clock timers otherwise. Events are only resolved once per window, so
+    timing adds no synchronization inside the window. Every `window` steps the
+    p50/p95/mean of each stage (in milliseconds) are sent to TensorBoard under
+    timing/ and appended to a JSON lines file. With trace_dir set, the loop is
+    also run under torch.profiler and the spans show up as named ranges in its
+    trace. A disabled profiler returns no-op spans.
+    """
+
+    def __init__(self, enabled=False, window=100, jsonl_path=None, tb_writer=None, trace_dir=None, use_cuda=None):
+        self.enabled = enabled
+        self.window = window
+        self.jsonl_path = jsonl_path
+        self.tb_writer = tb_writer
+        self.use_cuda = torch.cuda.is_available() if use_cuda is None else use_cuda
+        self._pending = []
+        self._durations = OrderedDict()
+        self._steps = 0
+        self._profiler = None
+        if enabled and trace_dir:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if self.use_cuda:
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self._profiler = torch.profiler.profile(
+                activities=activities,
+                schedule=torch.profiler.schedule(wait=5, warmup=2, active=5, repeat=1),
+                on_trace_ready=torch.profiler.tensorboard_trace_handler(trace_dir))
+            self._profiler.start()
+
+    def span(self, name):
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._span(name)
+
+    @contextlib.contextmanager
+    def _span(self, name):
+        with torch.profiler.record_function(name):
+            if self.use_cuda:
+                start, end = torch.cuda.Event(enable_timing=True), torch.cuda.Event(enable_timing=True)
+                start.record()
+                yield
+                end.record()
+                self._pending.append((name, start, end))
+            else:
+                start = time.perf_counter()
+                yield
+                self._durations.setdefault(name, []).append((time.perf_counter() - start) * 1000)
+
+    def step(self, iteration):
+        """ Mark the end of an iteration, reporting the window statistics every `window` steps. """
+        if not self.enabled:
+            return
+        if self._profiler is not None:
+            self._profiler.step()
+        self._steps += 1
+        if self._steps >= self.window:
+            self.flush(iteration)
+
+    def summary(self):
+        """ {stage: {"p50", "p95", "mean", "count"}} over the spans recorded since the last flush. """
+        if self._pending:
+            self._pending[-1][2].synchronize()
+            for name, start, end in self._pending:
+                self._durations.setdefault(name, []).append(start.elapsed_time(end))
+            self._pending = []
+        stats = OrderedDict()
+        for name, durations in self._durations.items():
+            durations = np.asarray(durations)
+            stats[name] = {"p50": float(np.percentile(durations, 50)), "p95": float(np.percentile(durations, 95)),
+                           "mean": float(durations.mean()), "count": int(durations.size)}
+        return stats
+
+    def flush(self, iteration):
+        stats = self.summary()
+        self._durations = OrderedDict()
+        self._steps = 0
+        if not stats:
+            return
+        if self.tb_writer:
+            for name, values in stats.items():
+                self.tb_writer.add_scalar("timing/{}_p50".format(name), values["p50"], iteration)
+                self.tb_writer.add_scalar("timing/{}_p95".format(name), values["p95"], iteration)
+        if self.jsonl_path:
+            with open(self.jsonl_path, "a") as f:
+                f.write(json.dumps({"iteration": iteration, "stages": stats}) + "\n")
+
+    def close(self, iteration):
+        if not self.enabled:
+            return
+        self.flush(iteration)
+        if self._profiler is not None:
+            self._profiler.stop()
+            self._profiler = None
@@ -0,0 +1,96 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import numpy as np
+
+QUANTIZED_FORMATS = ("fp16", "uint8")
+
+# Property prefixes stored at reduced precision, everything else stays float32
+QUANTIZED_GROUPS = ("f_rest_", "scale_", "rot_")
+# Properties that are always zero and are not stored at all
+DROPPED_PROPERTIES = ("nx", "ny", "nz")
+
+def quantize(values, dtype, chunk_size):
+    """
+    Quantize an (N, C) float array column-wise. With chunk_size > 0 every run of
+    chunk_size rows is normalized to [0, 1] by its own min/max before the cast;
+    uint8 always needs a range, so chunk_size 0 means one chunk over all rows.
+    Returns (q, lo, hi), lo and hi being None when no normalization is applied.
+    """
+    values = np.ascontiguousarray(values, dtype=np.float32)
+    if dtype == "fp16" and chunk_size <= 0:
+        return values.astype(np.float16), None, None
+    n = values.shape[0]
+    if n == 0:
+        empty = np.zeros((0, values.shape[1]), dtype=np.float32)
+        return values.astype(np.uint8 if dtype == "uint8" else np.float16), empty, empty
+    chunk = chunk_size if chunk_size > 0 else n
+    starts = np.arange(0, n, chunk)
+    lo = np.minimum.reduceat(values, starts, axis=0)
+    hi = np.maximum.reduceat(values, starts, axis=0)
+    rows = np.arange(n) // chunk
+    span = hi - lo
+    span[span == 0] = 1
+    unit = (values - lo[rows]) / span[rows]
+    if dtype == "uint8":
+        return np.rint(unit * 255).astype(np.uint8), lo, hi
+    return unit.astype(np.float16), lo, hi
+
+def dequantize(q, lo, hi, chunk_size):
+    values = q.astype(np.float32)
+    if lo is None:
+        return values
+    if q.dtype == np.uint8:
+        values /= 255
+    chunk = chunk_size if chunk_size > 0 else max(q.shape[0], 1)
+    rows = np.arange(q.shape[0]) // chunk
+    return lo[rows] + values * (hi - lo)[rows]
+
+def write_quantized(path, names, data, dtype="uint8", chunk_size=256):
+    """
+    Write the (N, len(names)) float vertex block of a Gaussian PLY as an .npz
+    archive, with SH rest coefficients, scales and rotations stored as fp16 or
+    uint8 and the remaining properties kept as float32.
+    """
+    assert dtype in QUANTIZED_FORMATS
+    data = np.asarray(data, dtype=np.float32)
+    archive = {"names": np.array(names), "dtype": np.array(dtype), "chunk_size": np.array(chunk_size)}
+    quantized = set()
+    for prefix in QUANTIZED_GROUPS:
+        columns = [idx for idx, name in enumerate(names) if name.startswith(prefix)]
+        q, lo, hi = quantize(data[:, columns], dtype, chunk_size)
+        archive[prefix + "q"] = q
+        if lo is not None:
+            archive[prefix + "lo"] = lo
+            archive[prefix + "hi"] = hi
+        quantized.update(columns)
+    columns = [idx for idx, name in enumerate(names) if idx not in quantized and name not in DROPPED_PROPERTIES]
+    archive["raw"] = np.ascontiguousarray(data[:, columns])
+    with open(path, "wb") as f:
+        np.savez(f, **archive)
+
+def read_quantized(path):
+    """ Decode an archive from write_quantized back to property names and an (N, P) float32 array. """
+    with np.load(path) as archive:
+        names = [str(name) for name in archive["names"]]
+        chunk_size = int(archive["chunk_size"])
+        raw = archive["raw"]
+        data = np.zeros((raw.shape[0], len(names)), dtype=np.float32)
+        quantized = set()
+        for prefix in QUANTIZED_GROUPS:
+            columns = [idx for idx, name in enumerate(names) if name.startswith(prefix)]
+            lo = archive[prefix + "lo"] if prefix + "lo" in archive else None
+            hi = archive[prefix + "hi"] if prefix + "hi" in archive else None
+            data[:, columns] = dequantize(archive[prefix + "q"], lo, hi, chunk_size)
+            quantized.update(columns)
+        columns = [idx for idx, name in enumerate(names) if idx not in quantized and name not in DROPPED_PROPERTIES]
+        data[:, columns] = raw
+    return names, data
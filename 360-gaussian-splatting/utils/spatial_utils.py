@@ -0,0 +1,154 @@
+#
+# Copyright (C) 2023, Inria
+# GRAPHDECO research group, https://team.inria.fr/graphdeco
+# All rights reserved.
+#
+# This software is free for non-commercial, research and evaluation use
+# under the terms of the LICENSE.md file.
+#
+# For inquiries contact  george.drettakis@inria.fr
+#
+
+import math
+import torch
+
+def frustum_planes(viewmatrix, projmatrix, width, height, margin=32):
+    """
+    (5, 4) planes normal . x + offset >= 0 around what a pinhole camera's
+    rasterizer can draw: the near plane of the centers first, then the four
+    image borders widened by margin pixels.
+    """
+    viewmatrix, projmatrix = viewmatrix.float(), projmatrix.float()
+    planes = [torch.cat((viewmatrix[:3, 2], viewmatrix[3, 2:3] - 0.2))]
+    for axis, size in ((0, width), (1, height)):
+        slack = 1 + 2 * margin / size
+        for sign in (1, -1):
+            planes.append(slack * projmatrix[:, 3] + sign * projmatrix[:, axis])
+    return torch.stack(planes)
+
+def footprint_stretch(tanfovx, tanfovy):
+    # The screen-space footprint comes from the projection linearized at the center, with the
+    # view direction clamped to 1.3 times the field of view; extents grown by this factor bound it
+    return 1 + 1.69 * (tanfovx ** 2 + tanfovy ** 2)
+
+def frustum_visible(xyz, extent, viewpoint_camera, scale_modifier=1.0, margin=32):
+    """
+    Mask of the Gaussians that can be visible through a pinhole camera, the
+    test of GaussianGrid.query_frustum done per Gaussian (center and 3 sigma
+    extent) instead of per cell, so it needs no index.
+    """
+    with torch.no_grad():
+        planes = frustum_planes(viewpoint_camera.world_view_transform, viewpoint_camera.full_proj_transform,
+                                int(viewpoint_camera.image_width), int(viewpoint_camera.image_height), margin).to(xyz.device)
+        xyz = xyz.float()
+        grow = extent.float() * scale_modifier * footprint_stretch(math.tan(viewpoint_camera.FoVx * 0.5), math.tan(viewpoint_camera.FoVy * 0.5))
+        visible = xyz @ planes[0, :3] + planes[0, 3] >= 0
+        for plane in planes[1:]:
+            # Farthest point of the grown box along the plane normal
+            visible &= xyz @ plane[:3] + plane[3] + grow * plane[:3].abs().sum() >= 0
+        return visible
+
+class GaussianGrid:
+    """
+    Uniform grid over Gaussian centers, used to pre-cull Gaussians before rasterization.
+
+    Every Gaussian is assigned to a cell once, at build time; refit() then
+    recomputes the cell bounds for moved Gaussians without reassigning them.
+    Each cell keeps the bounding box of its centers and the largest 3 sigma
+    extent of its Gaussians. Queries test the cells against the camera and
+    return the indices of the Gaussians in the cells that pass, in increasing
+    order, so that rendering the subset gives the same image as rendering all
+    Gaussians:
+
+    - tests the rasterizer also does on centers (near plane, sphere of the
+      panorama rasterizer) are done on the center boxes, hence exact;
+    - image border tests use the boxes grown by the extents, with enough
+      slack to keep every Gaussian whose footprint reaches the image.
+
+    Only the optional distance radius drops Gaussians that the rasterizer
+    would draw.
+    """
+
+    def __init__(self, xyz, extent, alive=None, points_per_cell=64, max_cells_per_axis=256):
+        with torch.no_grad():
+            sample = xyz if alive is None else xyz[alive]
+            num_cells = max(1, sample.shape[0] // points_per_cell)
+            if sample.shape[0] > 100_000:
+                sample = sample[torch.randperm(sample.shape[0], device=sample.device)[:100_000]]
+            # Grid over the bulk of the points, distant outliers are clamped into the border cells
+            quantiles = torch.tensor([0.01, 0.99], device=xyz.device)
+            bounds = torch.quantile(sample.float(), quantiles, dim=0) if sample.shape[0] > 0 else torch.zeros((2, 3), device=xyz.device)
+            span = torch.clamp_min(bounds[1] - bounds[0], 1e-6)
+            cell_size = (span.prod() / num_cells) ** (1 / 3)
+            dims = torch.clamp(torch.ceil(span / cell_size), 1, max_cells_per_axis).long()
+
+            coords = torch.floor((xyz - bounds[0]) / span * dims).long()
+            coords = torch.minimum(torch.clamp_min(coords, 0), dims - 1)
+            self.cell = (coords[:, 0] * dims[1] + coords[:, 1]) * dims[2] + coords[:, 2]
+            self.num_cells = int(dims.prod())
+            if alive is not None:
+                # Free slots go to an extra cell that never passes a query
+                self.cell[~alive] = self.num_cells
+            self.refit(xyz, extent)
+
+    def refit(self, xyz, extent):
+        """ Recompute the cell bounds from the current centers and extents. """
+        with torch.no_grad():
+            index = self.cell[:, None].expand(-1, 3)
+            self.lo = torch.full((self.num_cells + 1, 3), math.inf, device=xyz.device).scatter_reduce_(0, index, xyz.float(), "amin")
+            self.hi = torch.full((self.num_cells + 1, 3), -math.inf, device=xyz.device).scatter_reduce_(0, index, xyz.float(), "amax")
+            self.extent = torch.zeros((self.num_cells + 1), device=xyz.device).scatter_reduce_(0, self.cell, extent.float(), "amax")
+            self.occupied = torch.zeros((self.num_cells + 1), dtype=torch.bool, device=xyz.device)
+            self.occupied[self.cell] = True
+            self.occupied[-1] = False
+            # Empty cells get a finite box so that plane tests do not produce NaNs
+            self.lo[~self.occupied] = 0
+            self.hi[~self.occupied] = 0
+
+    def _select(self, cells):
+        return cells[self.cell].nonzero().squeeze(1)
+
+    def _outside(self, normal, offset, lo, hi):
+        # Boxes entirely on the negative side of the plane normal . x + offset = 0
+        corner = torch.where(normal > 0, hi, lo)
+        return corner @ normal + offset < 0
+
+    def _distance(self, center, lo, hi):
+        # Distance from center to the closest point of each box
+        closest = torch.minimum(torch.maximum(center, lo), hi)
+        return (closest - center).norm(dim=1)
+
+    def query_frustum(self, viewmatrix, projmatrix, tanfovx, tanfovy, width, height, scale_modifier=1.0, radius=0.0, margin=32):
+        """
+        Indices of the Gaussians that can be visible through a pinhole camera
+        (transposed world-to-view and full projection matrices, as stored on
+        Camera). margin is in pixels and covers the rasterizer's tile rounding.
+        """
+        with torch.no_grad():
+            planes = frustum_planes(viewmatrix, projmatrix, width, height, margin)
+            cells = self.occupied.clone()
+            # The rasterizer drops centers with a view depth up to 0.2
+            cells &= ~self._outside(planes[0, :3], planes[0, 3], self.lo, self.hi)
+
+            grow = (self.extent * scale_modifier * footprint_stretch(tanfovx, tanfovy))[:, None]
+            lo, hi = self.lo - grow, self.hi + grow
+            for plane in planes[1:]:
+                cells &= ~self._outside(plane[:3], plane[3], lo, hi)
+            if radius > 0:
+                center = torch.inverse(viewmatrix.float())[3, :3]
+                cells &= self._distance(center, lo, hi) <= radius
+            return self._select(cells)
+
+    def query_sphere(self, center, scale_modifier=1.0, radius=0.0, near=0.2, far=100.0):
+        """ Indices of the Gaussians that can be visible from a panorama camera at center. """
+        with torch.no_grad():
+            center = center.float()
+            cells = self.occupied.clone()
+            # The rasterizer drops centers closer than near or at far and beyond
+            farthest = torch.maximum((self.lo - center).abs(), (self.hi - center).abs())
+            cells &= farthest.norm(dim=1) > near
+            cells &= self._distance(center, self.lo, self.hi) < far
+            if radius > 0:
+                grow = (self.extent * scale_modifier)[:, None]
+                cells &= self._distance(center, self.lo - grow, self.hi + grow) <= radius
+            return self._select(cells)
@@ -26,3 +26,9 @@ def mkdir_p(folder_path):
 def searchForMaxIteration(folder):
     saved_iters = [int(fname.split("_")[-1]) for fname in os.listdir(folder)]
     return max(saved_iters)
+
+def resolveWorkers(workers):
+    # Negative worker counts mean one worker per CPU core
+    if workers < 0:
+        return os.cpu_count() or 1
+    return max(workers, 1)
@@ -1,8 +1,205 @@
-import subprocess
-import sys
+import os
+import json
+import mmap
+import shutil
+import sqlite3
+import struct
 import argparse
+import subprocess
+import numpy as np
 from pathlib import Path
 
+# COLMAP camera model ids of the binary model and database, with their number of parameters
+COLMAP_CAMERA_MODELS = {
+    0: ("SIMPLE_PINHOLE", 3), 1: ("PINHOLE", 4), 2: ("SIMPLE_RADIAL", 4), 3: ("RADIAL", 5),
+    4: ("OPENCV", 8), 5: ("OPENCV_FISHEYE", 8), 6: ("FULL_OPENCV", 12), 7: ("FOV", 5),
+    8: ("SIMPLE_RADIAL_FISHEYE", 4), 9: ("RADIAL_FISHEYE", 5), 10: ("THIN_PRISM_FISHEYE", 12),
+}
+
+def camera_name(colmap_camera_id):
+    # Same camera names as the kapture conversion
+    return f'cam_{colmap_camera_id:05d}'
+
+def read_cameras(model_dir):
+    """ {COLMAP camera id: (model name, width, height, params)} from cameras.txt or cameras.bin. """
+    cameras = {}
+    text_path = os.path.join(model_dir, 'cameras.txt')
+    if os.path.exists(text_path):
+        with open(text_path, 'r') as fid:
+            for line in fid:
+                if line.startswith('#') or not line.strip():
+                    continue
+                elems = line.replace(',', ' ').split()
+                cameras[int(elems[0])] = (elems[1], int(float(elems[2])), int(float(elems[3])), [float(v) for v in elems[4:]])
+        return cameras
+    with open(os.path.join(model_dir, 'cameras.bin'), 'rb') as fid:
+        num_cameras = struct.unpack('<Q', fid.read(8))[0]
+        for _ in range(num_cameras):
+            camera_id, model_id, width, height = struct.unpack('<iiQQ', fid.read(24))
+            if model_id not in COLMAP_CAMERA_MODELS:
+                raise ValueError(f'unknown COLMAP camera model id {model_id}, export the model as text to convert it')
+            model, num_params = COLMAP_CAMERA_MODELS[model_id]
+            params = list(struct.unpack('<' + 'd' * num_params, fid.read(8 * num_params)))
+            cameras[camera_id] = (model, width, height, params)
+    return cameras
+
+def read_database_cameras(database_path):
+    """ Cameras of a COLMAP database, unknown models read as SIMPLE_PINHOLE like the kapture conversion. """
+    cameras = {}
+    connection = sqlite3.connect(database_path)
+    try:
+        for camera_id, model_id, width, height, params in connection.execute('SELECT camera_id, model, width, height, params FROM cameras;'):
+            model = COLMAP_CAMERA_MODELS.get(model_id, COLMAP_CAMERA_MODELS[0])[0]
+            cameras[camera_id] = (model, width, height, np.frombuffer(params, dtype=np.float64).tolist())
+    finally:
+        connection.close()
+    return cameras
+
+def read_images(model_dir):
+    """
+    Registered images as (names, COLMAP camera ids, qvecs, tvecs), streaming
+    images.txt or images.bin and skipping the 2D points.
+    """
+    names, camera_ids, poses = [], [], []
+    text_path = os.path.join(model_dir, 'images.txt')
+    if os.path.exists(text_path):
+        with open(text_path, 'r') as fid:
+            for line in fid:
+                if line.startswith('#') or not line.strip():
+                    continue
+                elems = line.replace(',', ' ').split()
+                # IMAGE_ID, QW, QX, QY, QZ, TX, TY, TZ, CAMERA_ID, NAME (which may contain spaces)
+                poses.append([float(v) for v in elems[1:8]])
+                camera_ids.append(int(elems[8]))
+                names.append(' '.join(elems[9:]))
+                fid.readline()  # POINTS2D[] as (X, Y, POINT3D_ID)
+    else:
+        properties = struct.Struct('<idddddddi')
+        with open(os.path.join(model_dir, 'images.bin'), 'rb') as fid:
+            with mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                num_images = struct.unpack_from('<Q', buffer, 0)[0]
+                offset = 8
+                for _ in range(num_images):
+                    values = properties.unpack_from(buffer, offset)
+                    offset += properties.size
+                    name_end = buffer.find(b'\x00', offset)
+                    names.append(buffer[offset:name_end].decode('utf-8'))
+                    poses.append(values[1:8])
+                    camera_ids.append(values[8])
+                    num_points2D = struct.unpack_from('<Q', buffer, name_end + 1)[0]
+                    offset = name_end + 9 + 24 * num_points2D
+    poses = np.array(poses, dtype=np.float64).reshape(-1, 7)
+    return names, camera_ids, poses[:, :4], poses[:, 4:]
+
+def iter_points(model_dir, chunk_size=100_000):
+    """ Chunks of (xyz, rgb) arrays from points3D.txt or points3D.bin, tracks skipped. """
+    text_path = os.path.join(model_dir, 'points3D.txt')
+    if os.path.exists(text_path):
+        with open(text_path, 'r') as fid:
+            rows = []
+            for line in fid:
+                if line.startswith('#') or not line.strip():
+                    continue
+                # POINT3D_ID, X, Y, Z, R, G, B, ERROR, TRACK[]
+                rows.append(line.replace(',', ' ').split(maxsplit=8)[1:7])
+                if len(rows) == chunk_size:
+                    data = np.array(rows, dtype=np.float64)
+                    rows = []
+                    yield data[:, :3], data[:, 3:6]
+            if rows:
+                data = np.array(rows, dtype=np.float64)
+                yield data[:, :3], data[:, 3:6]
+        return
+    binary_path = os.path.join(model_dir, 'points3D.bin')
+    if not os.path.exists(binary_path) or os.path.getsize(binary_path) <= 8:
+        return
+    header = struct.Struct('<Q3d3BdQ')
+    with open(binary_path, 'rb') as fid:
+        with mmap.mmap(fid.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            num_points = struct.unpack_from('<Q', buffer, 0)[0]
+            offset = 8
+            xyz, rgb = [], []
+            for _ in range(num_points):
+                values = header.unpack_from(buffer, offset)
+                xyz.append(values[1:4])
+                rgb.append(values[4:7])
+                offset += header.size + 8 * values[8]
+                if len(xyz) == chunk_size:
+                    yield np.array(xyz), np.array(rgb, dtype=np.float64)
+                    xyz, rgb = [], []
+            if xyz:
+                yield np.array(xyz), np.array(rgb, dtype=np.float64)
+
+def opensfm_camera(model, width, height, params):
+    """ OpenSfM camera of a COLMAP camera, as the kapture export writes it. """
+    if model == 'PANORAMA':
+        return {'projection_type': 'spherical', 'width': int(width), 'height': int(height)}
+    if model not in ('SIMPLE_PINHOLE', 'SIMPLE_RADIAL', 'RADIAL'):
+        raise ValueError(f'Unable to export camera of type "{model}" to OpenSfM')
+    # The principal point is ignored by OpenSfM
+    return {
+        'projection_type': 'perspective',
+        'width': int(width),
+        'height': int(height),
+        'focal': params[0] / max(width, height),
+        'k1': params[3] if model in ('SIMPLE_RADIAL', 'RADIAL') else 0.0,
+        'k2': params[4] if model == 'RADIAL' else 0.0,
+    }
+
+def quaternion_to_rotation_vector(qvecs):
+    # Angle-axis vectors of (w, x, y, z) quaternions
+    sin_half = np.linalg.norm(qvecs[:, 1:], axis=1, keepdims=True)
+    angle = 2 * np.arctan2(sin_half, qvecs[:, :1])
+    scale = np.divide(angle, sin_half, out=np.zeros_like(angle), where=sin_half > 0)
+    return qvecs[:, 1:] * scale
+
+def link_images(image_names, images_dir, output_dir):
+    """ Link the images into the OpenSfM project, copying only where links are not supported. """
+    for name in image_names:
+        source = os.path.abspath(os.path.join(images_dir, name))
+        target = os.path.join(output_dir, name)
+        if os.path.islink(target) and os.readlink(target) == source:
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.lexists(target):
+            os.remove(target)
+        try:
+            os.symlink(source, target)
+        except OSError:
+            shutil.copy2(source, target)
+
+def colmap_to_opensfm(model_dir, images_dir, output_dir, database_path=None):
+    """
+    Write the OpenSfM project read by readOpensfmSceneInfo (reconstruction.json,
+    camera_models.json and linked images) from a COLMAP model, in one pass
+    over the model files. Points are written as they are read.
+    """
+    cameras = read_database_cameras(database_path) if database_path and os.path.exists(database_path) else {}
+    cameras.update(read_cameras(model_dir))
+    opensfm_cameras = {camera_name(camera_id): opensfm_camera(*camera) for camera_id, camera in cameras.items()}
+
+    names, camera_ids, qvecs, tvecs = read_images(model_dir)
+    rotations = quaternion_to_rotation_vector(qvecs)
+    shots = {}
+    for name, camera_id, rotation, translation in zip(names, camera_ids, rotations.tolist(), tvecs.tolist()):
+        shots[name] = {'capture_time': 0, 'camera': camera_name(camera_id), 'rotation': rotation, 'translation': translation}
+
+    os.makedirs(output_dir, exist_ok=True)
+    link_images(names, images_dir, os.path.join(output_dir, 'images'))
+
+    with open(os.path.join(output_dir, 'reconstruction.json'), 'w') as f:
+        f.write('[{"cameras": ' + json.dumps(opensfm_cameras) + ', "shots": ' + json.dumps(shots) + ', "points": {')
+        index = 0
+        for xyz, rgb in iter_points(model_dir):
+            f.write(('' if index == 0 else ',') + ','.join(
+                f'"{index + i}": {{"coordinates": [{x!r}, {y!r}, {z!r}], "color": [{r!r}, {g!r}, {b!r}]}}'
+                for i, (x, y, z, r, g, b) in enumerate(np.hstack((xyz, rgb)).tolist())))
+            index += xyz.shape[0]
+        f.write('}}]')
+    with open(os.path.join(output_dir, 'camera_models.json'), 'w') as f:
+        json.dump(opensfm_cameras, f, indent=4)
+    return len(shots), index
+
 def run_docker_and_script(volume_path):
     # Check if the container already exists
     container_exists_command = ["sudo", "docker", "ps", "-a", "--filter", "name=kapture_container", "--format", "{{.Names}}"]
@@ -48,6 +245,12 @@ def run_docker_and_script(volume_path):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Convert SFM to OpenMVG format!")
     parser.add_argument("-path", type=Path, required=True, help="Path to the dataset")
+    parser.add_argument("--docker", action="store_true", help="Convert through kapture in the docker container instead")
     args = parser.parse_args()
     volume_path = args.path
-    run_docker_and_script(volume_path)
+    if args.docker:
+        run_docker_and_script(volume_path)
+    else:
+        num_shots, num_points = colmap_to_opensfm(os.path.join(volume_path, "0"), os.path.join(volume_path, "images"),
+                                                  os.path.join(volume_path, "opensfm"), os.path.join(volume_path, "database.db"))
+        print(f"Wrote {num_shots} shots and {num_points} points to {os.path.join(volume_path, 'opensfm')}")
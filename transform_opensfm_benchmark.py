@@ -0,0 +1,114 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+from transform_opensfm import colmap_to_opensfm
+
+KAPTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'kapture')
+
+def write_sample(dataset_dir, num_images, num_points, observations_per_point, width=4000):
+    """ Synthetic panorama COLMAP project: text model in 0/, images/ and database.db, as transform_opensfm.py expects. """
+    sys.path.insert(0, KAPTURE_DIR)
+    from kapture.converter.colmap.database import COLMAPDatabase
+
+    rng = np.random.default_rng(0)
+    model_dir = os.path.join(dataset_dir, '0')
+    images_dir = os.path.join(dataset_dir, 'images')
+    os.makedirs(model_dir)
+    os.makedirs(images_dir)
+    names = [f'pano_{i:05d}.jpg' for i in range(num_images)]
+    for name in names:
+        with open(os.path.join(images_dir, name), 'wb') as f:
+            f.write(rng.bytes(1 << 20))
+
+    with open(os.path.join(model_dir, 'cameras.txt'), 'w') as f:
+        f.write(f'1 PANORAMA {width} {width // 2} {width / 4} {width / 2} {width / 4}\n')
+    qvecs = rng.normal(size=(num_images, 4))
+    qvecs /= np.linalg.norm(qvecs, axis=1, keepdims=True)
+    tvecs = rng.normal(size=(num_images, 3))
+    observations = rng.integers(0, num_images, size=(num_points, observations_per_point))
+    keypoints = [rng.uniform(0, width / 2, size=(observations_per_point * num_points // num_images, 2)) for _ in names]
+    with open(os.path.join(model_dir, 'images.txt'), 'w') as f:
+        for i, name in enumerate(names):
+            f.write(' '.join(map(str, [i + 1, *qvecs[i], *tvecs[i], 1, name])) + '\n')
+            f.write(' '.join(f'{x} {y} -1' for x, y in keypoints[i]) + '\n')
+    xyz = rng.normal(size=(num_points, 3)) * 10
+    rgb = rng.integers(0, 256, size=(num_points, 3))
+    with open(os.path.join(model_dir, 'points3D.txt'), 'w') as f:
+        for i in range(num_points):
+            track = ' '.join(f'{image + 1} {i % len(keypoints[image])}' for image in observations[i])
+            f.write(f'{i + 1} {xyz[i, 0]} {xyz[i, 1]} {xyz[i, 2]} {rgb[i, 0]} {rgb[i, 1]} {rgb[i, 2]} 0.5 {track}\n')
+
+    database = COLMAPDatabase.connect(os.path.join(dataset_dir, 'database.db'))
+    database.create_tables()
+    database.add_camera(0, width, width // 2, [width / 4, width / 2, width / 4], camera_id=1)
+    for i, name in enumerate(names):
+        database.add_image(name, 1, prior_q=np.full(4, np.nan), prior_t=np.full(3, np.nan), image_id=i + 1)
+        database.add_keypoints(i + 1, keypoints[i])
+    database.commit()
+    database.close()
+
+def kapture_two_step(dataset_dir):
+    """ The former conversion: kapture_import_colmap.py then kapture_export_opensfm.py, without the docker round-trip. """
+    env = dict(os.environ, PYTHONPATH=KAPTURE_DIR)
+    subprocess.run([sys.executable, os.path.join(KAPTURE_DIR, 'tools', 'kapture_import_colmap.py'),
+                    '-db', os.path.join(dataset_dir, 'database.db'), '-txt', os.path.join(dataset_dir, '0'),
+                    '-im', os.path.join(dataset_dir, 'images'), '-o', os.path.join(dataset_dir, 'kapture'), '-f', '-q'],
+                   check=True, env=env)
+    subprocess.run([sys.executable, os.path.join(KAPTURE_DIR, 'tools', 'kapture_export_opensfm.py'),
+                    '-k', os.path.join(dataset_dir, 'kapture'), '-o', os.path.join(dataset_dir, 'opensfm_kapture'), '-f', '-q'],
+                   check=True, env=env)
+
+def compare(reference_path, path):
+    with open(reference_path) as f:
+        reference = json.load(f)[0]
+    with open(path) as f:
+        result = json.load(f)[0]
+    assert reference['cameras'] == result['cameras'], 'cameras differ'
+    assert reference['shots'].keys() == result['shots'].keys(), 'shots differ'
+    pose_diff = max(np.abs(np.subtract(reference['shots'][name][key], result['shots'][name][key])).max()
+                    for name in reference['shots'] for key in ('rotation', 'translation'))
+    assert reference['points'].keys() == result['points'].keys(), 'points differ'
+    point_diff = max(np.abs(np.subtract(reference['points'][key]['coordinates'] + reference['points'][key]['color'],
+                                        result['points'][key]['coordinates'] + result['points'][key]['color'])).max()
+                     for key in reference['points'])
+    return pose_diff, point_diff
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the direct COLMAP to OpenSfM conversion with the kapture two-step one")
+    parser.add_argument("-path", type=str, default=None, help="Dataset with 0/ (text model), images/ and database.db; a synthetic one by default")
+    parser.add_argument("--num_images", type=int, default=500)
+    parser.add_argument("--num_points", type=int, default=200_000)
+    parser.add_argument("--observations_per_point", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        dataset_dir = args.path
+        if dataset_dir is None:
+            dataset_dir = os.path.join(tmp_dir, 'dataset')
+            write_sample(dataset_dir, args.num_images, args.num_points, args.observations_per_point)
+
+        start = time.perf_counter()
+        kapture_two_step(dataset_dir)
+        two_step_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        num_shots, num_points = colmap_to_opensfm(os.path.join(dataset_dir, '0'), os.path.join(dataset_dir, 'images'),
+                                                  os.path.join(dataset_dir, 'opensfm_direct'), os.path.join(dataset_dir, 'database.db'))
+        direct_time = time.perf_counter() - start
+
+        pose_diff, point_diff = compare(os.path.join(dataset_dir, 'opensfm_kapture', 'reconstruction.json'),
+                                        os.path.join(dataset_dir, 'opensfm_direct', 'reconstruction.json'))
+        if args.path is not None:
+            for output in ('kapture', 'opensfm_kapture', 'opensfm_direct'):
+                shutil.rmtree(os.path.join(dataset_dir, output))
+
+    print(f'{num_shots} shots, {num_points} points')
+    print(f'kapture two-step: {two_step_time:.2f} s')
+    print(f'direct:           {direct_time:.2f} s ({two_step_time / direct_time:.1f}x)')
+    print(f'max pose difference {pose_diff:.2e}, max point difference {point_diff:.2e}')